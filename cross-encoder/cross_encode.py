@@ -2,7 +2,6 @@ from typing import List, Tuple
 import pandas as pd
 from transformers import AutoTokenizer, AutoModelForSequenceClassification
 import torch
-from tqdm import tqdm
 
 # LOINC lab test codes and their descriptions
 candidate_pool = [
@@ -29,12 +28,20 @@ candidate_pool = [
 ]
 
 class MedicalTermRanker:
-    def __init__(self, candidate_pool):
-        """Initialize the cross-encoder model for medical term ranking."""
+    def __init__(self, candidate_pool, cache=None):
+        """
+        Initialize the cross-encoder model for medical term ranking.
+
+        Args:
+            candidate_pool: List of (code, description) candidates ranked by rank_terms()
+            cache: Optional score_cache.ScoreCache reused across calls (and runs, if persistent)
+        """
         model_name = 'cross-encoder/ms-marco-MiniLM-L-6-v2'
+        self.model_name = model_name
         self.tokenizer = AutoTokenizer.from_pretrained(model_name)
         self.model = AutoModelForSequenceClassification.from_pretrained(model_name)
         self.candidates = candidate_pool
+        self.cache = cache
         self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
         self.model.to(self.device)
         # Add deterministic setting for better reproducibility
@@ -42,35 +49,69 @@ class MedicalTermRanker:
 
     def get_similarity_score(self, query: str, candidate: str) -> float:
         """Get similarity score between query and candidate using cross-encoder."""
-        inputs = self.tokenizer(
-            [query],
-            [candidate],
-            padding=True,
-            truncation=True,
-            return_tensors='pt'
-        )
-        inputs = {k: v.to(self.device) for k, v in inputs.items()}
-        
-        with torch.no_grad():
-            outputs = self.model(**inputs)
-            scores = outputs.logits.squeeze()
-            return float(scores.cpu().numpy())
+        return self.score_pairs([query], [candidate])[0]
+
+    def score_pairs(self, queries: List[str], candidates: List[str], batch_size: int = 64) -> List[float]:
+        """
+        Score (query, candidate) pairs with the cross-encoder in padded batches.
+
+        Args:
+            queries (List[str]): Query text for each pair
+            candidates (List[str]): Candidate text for each pair (same length as queries)
+            batch_size (int): Maximum number of pairs sent to the model at a time
+
+        Returns:
+            List[float]: One score per pair, in input order
+        """
+        if self.cache is None:
+            return self._predict(queries, candidates, batch_size)
 
-    def rank_terms(self, description: str) -> List[Tuple[str, str, float]]:
+        # Only send pairs without a cached score to the model
+        scores = self.cache.get_scores(self.model_name, queries, candidates)
+        missing = [i for i, score in enumerate(scores) if score is None]
+        if missing:
+            missing_queries = [queries[i] for i in missing]
+            missing_candidates = [candidates[i] for i in missing]
+            predicted = self._predict(missing_queries, missing_candidates, batch_size)
+            self.cache.put_scores(self.model_name, missing_queries, missing_candidates, predicted)
+            for i, score in zip(missing, predicted):
+                scores[i] = score
+        return scores
+
+    def _predict(self, queries: List[str], candidates: List[str], batch_size: int) -> List[float]:
+        """Run the model on (query, candidate) pairs in padded batches."""
+        scores = []
+        for start in range(0, len(queries), batch_size):
+            inputs = self.tokenizer(
+                queries[start:start + batch_size],
+                candidates[start:start + batch_size],
+                padding=True,
+                truncation=True,
+                return_tensors='pt'
+            )
+            inputs = {k: v.to(self.device) for k, v in inputs.items()}
+
+            with torch.no_grad():
+                outputs = self.model(**inputs)
+                scores.extend(outputs.logits.view(-1).cpu().tolist())
+        return scores
+
+    def rank_terms(self, description: str, candidates: List[Tuple[str, str]] = None) -> List[Tuple[str, str, float]]:
         """
         Rank LOINC terms based on their relevance to the input description.
         
         Args:
             description (str): Free-form text description of the medical concept
+            candidates (List[Tuple[str, str]]): Optional (code, description) pool; defaults to self.candidates
             
         Returns:
             List[Tuple[str, str, float]]: Ranked list of (LOINC code, description, score)
         """
-        # Get similarity scores for each candidate
-        results = [
-            (code, desc, self.get_similarity_score(description, desc))
-            for code, desc in tqdm(self.candidates, desc='Ranking terms')
-        ]
+        candidates = self.candidates if candidates is None else candidates
+
+        # Score all candidates in a single batched pass
+        scores = self.score_pairs([description] * len(candidates), [desc for _, desc in candidates])
+        results = [(code, desc, score) for (code, desc), score in zip(candidates, scores)]
         
         # Sort by score in descending order
         ranked_results = sorted(results, key=lambda x: x[2], reverse=True)
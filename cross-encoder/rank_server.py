@@ -0,0 +1,239 @@
+'''
+Local HTTP rank service around MedicalTermRanker. One process loads the cross-encoder once and
+serves rank requests from any number of clients (curators, notebooks, match.py rerank jobs).
+
+Concurrent requests are collected over a short time window (--window-ms) and scored together as
+one padded batch, so the model sees a few large batches instead of many single pairs.
+
+Usage:
+python rank_server.py --port=8765 --window-ms=10 --max-batch-pairs=512
+
+Endpoints:
+POST /rank    {"description": "blood glucose", "candidates": [["2345-7", "Glucose ..."], ...], "top_n": 5}
+              {"queries": [{"description": "...", "candidates": [...]}, ...]}
+              "candidates" is optional and defaults to the server's candidate pool.
+              Returns {"results": [[[code, description, score], ...], ...]} (one ranked list per query)
+GET  /health  Returns model and batching statistics
+
+CLI arguments:
+--host: Interface to bind (default: 127.0.0.1)
+--port: Port to listen on (default: 8765)
+--window-ms: How long to wait for more requests before scoring a batch (default: 10)
+--max-batch-pairs: Maximum number of (query, candidate) pairs scored in one batch (default: 512)
+--batch-size: Pairs per forward pass inside a batch (default: 64)
+--cache-path: Optional SQLite file to persist pair scores across restarts
+--cache-size: Maximum number of pair scores kept in memory (default: 100000)
+'''
+
+import argparse
+import asyncio
+import json
+import time
+from typing import List, Tuple
+
+import requests
+
+
+class MicroBatcher:
+    """Collects concurrent rank requests into batches scored by a single worker."""
+
+    def __init__(self, ranker, window_ms: float = 10, max_batch_pairs: int = 512, batch_size: int = 64):
+        self.ranker = ranker
+        self.window = window_ms / 1000.0
+        self.max_batch_pairs = max_batch_pairs
+        self.batch_size = batch_size
+        self.queue = asyncio.Queue()
+        self.stats = {"requests": 0, "batches": 0, "pairs": 0, "model_seconds": 0.0}
+
+    async def rank(self, description: str, candidates: List[Tuple[str, str]]) -> List[Tuple[str, str, float]]:
+        """Queue one query and wait for its ranked candidates."""
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((description, candidates, future))
+        return await future
+
+    async def run(self):
+        """Worker loop: gather requests for up to `window` seconds, then score them in one batch."""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            num_pairs = len(batch[0][1])
+            deadline = loop.time() + self.window
+            while num_pairs < self.max_batch_pairs:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                num_pairs += len(item[1])
+
+            queries, texts = [], []
+            for description, candidates, _ in batch:
+                queries.extend([description] * len(candidates))
+                texts.extend([desc for _, desc in candidates])
+
+            start_time = time.time()
+            try:
+                # The model runs in a worker thread so the event loop keeps accepting requests
+                scores = await loop.run_in_executor(None, self.ranker.score_pairs, queries, texts, self.batch_size)
+            except Exception as e:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.stats["model_seconds"] += time.time() - start_time
+            self.stats["requests"] += len(batch)
+            self.stats["batches"] += 1
+            self.stats["pairs"] += len(queries)
+
+            offset = 0
+            for description, candidates, future in batch:
+                results = [(code, desc, score) for (code, desc), score
+                           in zip(candidates, scores[offset:offset + len(candidates)])]
+                offset += len(candidates)
+                if not future.done():
+                    future.set_result(sorted(results, key=lambda x: x[2], reverse=True))
+
+
+class RankServer:
+    """Minimal asyncio HTTP/1.1 server exposing the micro-batched ranker."""
+
+    def __init__(self, batcher: MicroBatcher, model_name: str = ""):
+        self.batcher = batcher
+        self.model_name = model_name
+
+    async def handle_rank(self, body: dict) -> dict:
+        queries = body.get("queries") or [body]
+        top_n = body.get("top_n")
+        tasks = []
+        for query in queries:
+            description = query.get("description") or ""
+            candidates = query.get("candidates")
+            candidates = self.batcher.ranker.candidates if candidates is None else candidates
+            tasks.append(self.batcher.rank(description, [(str(code), str(desc)) for code, desc in candidates]))
+        results = await asyncio.gather(*tasks)
+        if top_n:
+            results = [ranked[:int(top_n)] for ranked in results]
+        return {"results": [[list(item) for item in ranked] for ranked in results]}
+
+    def handle_health(self) -> dict:
+        stats = dict(self.batcher.stats)
+        stats["avg_pairs_per_batch"] = stats["pairs"] / stats["batches"] if stats["batches"] else 0
+        if self.batcher.ranker.cache is not None:
+            stats["cache"] = self.batcher.ranker.cache.stats()
+        return {"status": "ok", "model": self.model_name, "queued": self.batcher.queue.qsize(), "stats": stats}
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                try:
+                    if method == "POST" and path.startswith("/rank"):
+                        status, payload = 200, await self.handle_rank(json.loads(body or b"{}"))
+                    elif method == "GET" and path.startswith("/health"):
+                        status, payload = 200, self.handle_health()
+                    else:
+                        status, payload = 404, {"error": f"Unknown endpoint: {method} {path}"}
+                except (ValueError, TypeError, KeyError) as e:
+                    status, payload = 400, {"error": f"Invalid request: {str(e)}"}
+                except Exception as e:
+                    status, payload = 500, {"error": f"Ranking error: {str(e)}"}
+
+                response = json.dumps(payload).encode("utf-8")
+                keep_alive = headers.get("connection", "").lower() != "close"
+                writer.write(
+                    f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(response)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + response
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionResetError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str, port: int):
+        worker = asyncio.create_task(self.batcher.run())
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        print(f"Rank server listening on http://{host}:{port} (model: {self.model_name})")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            worker.cancel()
+
+
+def rank_remote(server_url: str, descriptions: List[str], candidates: List[List[Tuple[str, str]]] = None,
+                top_n: int = None, timeout: float = 300) -> List[List[Tuple[str, str, float]]]:
+    """
+    Rank one or more descriptions against a running rank server.
+
+    Args:
+        server_url: Base URL of the rank server, e.g. http://localhost:8765
+        descriptions: Query descriptions
+        candidates: Optional (code, description) pool for each description; server pool if omitted
+        top_n: Optional number of ranked results to return per description
+
+    Returns:
+        One ranked list of (code, description, score) per description
+    """
+    queries = []
+    for i, description in enumerate(descriptions):
+        query = {"description": description}
+        if candidates is not None:
+            query["candidates"] = [list(candidate) for candidate in candidates[i]]
+        queries.append(query)
+    body = {"queries": queries}
+    if top_n:
+        body["top_n"] = top_n
+    r = requests.post(server_url.rstrip("/") + "/rank", json=body, timeout=timeout)
+    r.raise_for_status()
+    return [[tuple(item) for item in ranked] for ranked in r.json()["results"]]
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='rank_server.py', description='Serve MedicalTermRanker over HTTP with micro-batching')
+    parser.add_argument('--host', default='127.0.0.1', help="Interface to bind (default: 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=8765, help="Port to listen on (default: 8765)")
+    parser.add_argument('--window-ms', type=float, default=10,
+                        help="How long to wait for more requests before scoring a batch (default: 10)")
+    parser.add_argument('--max-batch-pairs', type=int, default=512,
+                        help="Maximum number of (query, candidate) pairs scored in one batch (default: 512)")
+    parser.add_argument('--batch-size', type=int, default=64, help="Pairs per forward pass inside a batch (default: 64)")
+    parser.add_argument('--cache-path', help="Optional SQLite file to persist pair scores across restarts")
+    parser.add_argument('--cache-size', type=int, default=100000,
+                        help="Maximum number of pair scores kept in memory (default: 100000)")
+    args = parser.parse_args()
+
+    from cross_encode import MedicalTermRanker, candidate_pool
+    from score_cache import ScoreCache
+
+    ranker = MedicalTermRanker(candidate_pool, cache=ScoreCache(path=args.cache_path, max_entries=args.cache_size))
+    batcher = MicroBatcher(ranker, window_ms=args.window_ms, max_batch_pairs=args.max_batch_pairs,
+                           batch_size=args.batch_size)
+    server = RankServer(batcher, model_name=ranker.model_name)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+'''
+Cache for cross-encoder pair scores and bi-encoder embeddings.
+
+The same (query, candidate) pairs and the same terms are scored again and again across
+test_descriptions.csv re-runs, interactive sessions, mapping batches and encoder evaluations.
+ScoreCache keeps a bounded in-memory LRU in front of an optional SQLite file, so repeated runs
+only pay for pairs and texts they have not seen before. Every key includes the model id, so one
+cache file can be shared by several models.
+
+Usage:
+from score_cache import ScoreCache
+
+cache = ScoreCache(path="score_cache.sqlite", max_entries=100000)
+ranker = MedicalTermRanker(candidate_pool, cache=cache)
+ranker.rank_terms("blood glucose measurement")
+print(cache.stats())
+'''
+
+import hashlib
+import json
+import os
+import sqlite3
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+
+class ScoreCache:
+    """Bounded LRU cache with an optional persistent SQLite layer for pair scores and embeddings."""
+
+    def __init__(self, path: Optional[str] = None, max_entries: int = 100000):
+        """
+        Args:
+            path: Optional SQLite file used to persist entries across runs
+            max_entries: Maximum number of entries kept in memory (least recently used are evicted)
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.memory = OrderedDict()
+        self.counters = {kind: {"memory_hits": 0, "disk_hits": 0, "misses": 0} for kind in ("score", "embedding")}
+        self.conn = None
+        if path:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.conn = sqlite3.connect(path, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS pair_scores (key BLOB PRIMARY KEY, score REAL NOT NULL)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vector BLOB NOT NULL)")
+            self.conn.commit()
+
+    @staticmethod
+    def make_key(kind: str, model_id: str, *texts: str) -> bytes:
+        """Hash the model id and texts into a fixed-size key."""
+        return hashlib.sha1("\x1f".join((kind, model_id) + texts).encode("utf-8")).digest()
+
+    def _remember(self, key: bytes, value):
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def _lookup(self, kind: str, table: str, column: str, keys: List[bytes]) -> Dict[bytes, object]:
+        """Find keys in memory first, then in the SQLite file; returns the entries that were found."""
+        found, missing = {}, []
+        for key in keys:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                found[key] = self.memory[key]
+                self.counters[kind]["memory_hits"] += 1
+            else:
+                missing.append(key)
+
+        if self.conn is not None and missing:
+            unique_missing = list(dict.fromkeys(missing))
+            for start in range(0, len(unique_missing), 500):
+                batch = unique_missing[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                for key, value in self.conn.execute(
+                        f"SELECT key, {column} FROM {table} WHERE key IN ({placeholders})", batch):
+                    found[key] = value
+                    self._remember(key, value)
+            self.counters[kind]["disk_hits"] += sum(1 for key in missing if key in found)
+
+        self.counters[kind]["misses"] += sum(1 for key in missing if key not in found)
+        return found
+
+    def _store(self, table: str, column: str, entries: Dict[bytes, object]):
+        for key, value in entries.items():
+            self._remember(key, value)
+        if self.conn is not None and entries:
+            self.conn.executemany(f"INSERT OR REPLACE INTO {table} (key, {column}) VALUES (?, ?)", entries.items())
+            self.conn.commit()
+
+    def get_scores(self, model_id: str, queries: List[str], candidates: List[str]) -> List[Optional[float]]:
+        """Return the cached score of each (query, candidate) pair, or None where it is not cached."""
+        keys = [self.make_key("score", model_id, q, c) for q, c in zip(queries, candidates)]
+        found = self._lookup("score", "pair_scores", "score", keys)
+        return [found.get(key) for key in keys]
+
+    def put_scores(self, model_id: str, queries: List[str], candidates: List[str], scores: List[float]):
+        """Store the scores of (query, candidate) pairs."""
+        self._store("pair_scores", "score", {
+            self.make_key("score", model_id, q, c): float(score)
+            for q, c, score in zip(queries, candidates, scores)
+        })
+
+    def get_embeddings(self, model_id: str, texts: List[str]) -> List[Optional[bytes]]:
+        """Return the cached embedding of each text (float32 bytes), or None where it is not cached."""
+        keys = [self.make_key("embedding", model_id, text) for text in texts]
+        found = self._lookup("embedding", "embeddings", "vector", keys)
+        return [found.get(key) for key in keys]
+
+    def put_embeddings(self, model_id: str, texts: List[str], vectors: List[bytes]):
+        """Store embeddings (float32 bytes) of single texts."""
+        self._store("embeddings", "vector", {
+            self.make_key("embedding", model_id, text): vector for text, vector in zip(texts, vectors)
+        })
+
+    def stats(self) -> dict:
+        """Hit/miss counters and hit rate for scores and embeddings."""
+        stats = {"memory_entries": len(self.memory)}
+        for kind, counters in self.counters.items():
+            lookups = sum(counters.values())
+            hits = counters["memory_hits"] + counters["disk_hits"]
+            stats[kind] = dict(counters, lookups=lookups, hit_rate=round(hits / lookups, 4) if lookups else 0.0)
+        return stats
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+def encode_cached(model, model_id: str, texts: List[str], cache: Optional[ScoreCache] = None,
+                  batch_size: int = 256, **encode_kwargs):
+    """
+    Encode texts with a SentenceTransformer model, reusing cached embeddings.
+
+    Only texts without a cached embedding are sent to the model (in batches of `batch_size`). Extra
+    encode_kwargs (e.g. normalize_embeddings, prompt_name) change the vectors, so they are part of the
+    cache key: embeddings encoded with other settings are not reused.
+
+    Returns:
+        numpy.ndarray of shape (len(texts), dimension), dtype float32
+    """
+    import numpy as np
+
+    if cache is None:
+        return np.asarray(model.encode(texts, batch_size=batch_size, convert_to_numpy=True,
+                                       show_progress_bar=False, **encode_kwargs), dtype=np.float32)
+
+    if encode_kwargs:
+        model_id = f"{model_id}|{json.dumps(encode_kwargs, sort_keys=True, default=str)}"
+    unique_texts = list(dict.fromkeys(texts))
+    cached = cache.get_embeddings(model_id, unique_texts)
+    vectors = {text: np.frombuffer(blob, dtype=np.float32) for text, blob in zip(unique_texts, cached) if blob is not None}
+    missing = [text for text in unique_texts if text not in vectors]
+    if missing:
+        encoded = np.asarray(model.encode(missing, batch_size=batch_size, convert_to_numpy=True,
+                                          show_progress_bar=False, **encode_kwargs), dtype=np.float32)
+        cache.put_embeddings(model_id, missing, [vector.tobytes() for vector in encoded])
+        vectors.update(zip(missing, encoded))
+    return np.stack([vectors[text] for text in texts])
+
+
+def predict_cached(model, model_id: str, pairs: List[tuple], cache: Optional[ScoreCache] = None,
+                   batch_size: int = 64) -> List[float]:
+    """
+    Score (query, candidate) pairs with a sentence-transformers CrossEncoder, reusing cached scores.
+
+    Returns:
+        One score per pair, in input order
+    """
+    if cache is None:
+        return [float(score) for score in model.predict(pairs, batch_size=batch_size, show_progress_bar=False)]
+
+    queries = [q for q, _ in pairs]
+    candidates = [c for _, c in pairs]
+    scores = cache.get_scores(model_id, queries, candidates)
+    missing = [i for i, score in enumerate(scores) if score is None]
+    if missing:
+        predicted = model.predict([pairs[i] for i in missing], batch_size=batch_size, show_progress_bar=False)
+        cache.put_scores(model_id, [queries[i] for i in missing], [candidates[i] for i in missing], predicted)
+        for i, score in zip(missing, predicted):
+            scores[i] = float(score)
+    return scores
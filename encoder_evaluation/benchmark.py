@@ -0,0 +1,216 @@
+'''
+Benchmark the models listed in Models.csv on quality and cost together. Each model is evaluated in
+its own worker process (a fresh process per model, so its memory is released when it finishes),
+and several models can run in parallel with --workers.
+
+For each model the runner records:
+- Accuracy / Top5 / MRR: Ranking quality on the mapped terms (see evaluate.py)
+- Load Seconds: Time to load the model
+- Terms/sec: Encode throughput (bi-encoders: texts encoded per second; cross-encoders: pairs scored per second)
+- p50 ms / p99 ms: Latency of a single query (encode one target and rank all sources, or score one shortlist)
+- Peak RSS MB: Peak resident memory of the worker process
+- Dimension: Embedding dimension (bi-encoders only)
+
+The results are written as a comparison table (CSV, default Models_Accuracy.csv) and as JSON.
+
+Usage:
+python benchmark.py --data=./data/bc-health-concerns-and-diagnosis-value-set-v3-constrained.csv --workers=2
+python benchmark.py --data=./data/values.csv --sample=1000 --latency-queries=200 --json=Models_Benchmark.json
+
+CLI arguments:
+--data: CSV file with mapped source/target terms
+--source-column: Column with the source terms (default: SNOMED_Term)
+--target-column: Column with the target terms (default: ICD10CA_Term)
+--models: CSV file listing the models to benchmark (default: Models.csv)
+--output: Comparison table CSV file (default: Models_Accuracy.csv)
+--json: Machine-readable results file (default: Models_Benchmark.json)
+--sample: Benchmark on a random sample of N rows instead of the full value set
+--workers: Number of models benchmarked in parallel, one process each (default: 1)
+--latency-queries: Number of single queries timed for p50/p99 latency (default: 100)
+--batch-size: Texts per encode batch (default: 256)
+--shortlist-model: Bi-encoder used to shortlist candidates for cross-encoders (default: all-MiniLM-L6-v2)
+--shortlist-size: Candidates per target scored by cross-encoders (default: 20)
+-v, --verbosity: Verbosity
+'''
+
+import argparse
+import json
+import multiprocessing
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from evaluate import evaluate_model, load_evaluation_data, normalize
+
+TABLE_COLUMNS = {
+    "accuracy": "Accuracy",
+    "top_5": "Top5",
+    "mrr": "MRR",
+    "load_seconds": "Load Seconds",
+    "terms_per_second": "Terms/sec",
+    "latency_p50_ms": "p50 ms",
+    "latency_p99_ms": "p99 ms",
+    "peak_rss_mb": "Peak RSS MB",
+    "dimension": "Dimension",
+}
+
+
+def peak_rss_mb():
+    """Peak resident set size of the current process in MB."""
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return max_rss / (1024 * 1024) if sys.platform == "darwin" else max_rss / 1024
+
+
+def benchmark_model(model_name, model_type, df_evaluation, latency_queries=100, batch_size=256,
+                    shortlist_model="all-MiniLM-L6-v2", shortlist_size=20):
+    """
+    Benchmark one model. Runs inside a worker process.
+
+    Returns:
+        Dictionary with quality metrics, throughput, latency, memory and load time for the model
+    """
+    start_time = time.time()
+    if model_type == "BiEncoder":
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(model_name)
+    elif model_type == "CrossEncoder":
+        from sentence_transformers.cross_encoder import CrossEncoder
+        model = CrossEncoder(model_name)
+    else:
+        raise ValueError("Invalid model_type. Choose either 'BiEncoder' or 'CrossEncoder'.")
+    load_seconds = time.time() - start_time
+
+    # Accuracy and throughput come from the same full evaluation run (no cache, so every term is encoded)
+    results = evaluate_model(model_name, model_type, df_evaluation, model=model, batch_size=batch_size,
+                             shortlist_model=shortlist_model, shortlist_size=shortlist_size)
+
+    targets = df_evaluation['target'].tolist()
+    sources = df_evaluation['source'].tolist()
+    query_indices = np.random.default_rng(0).choice(len(targets), size=min(latency_queries, len(targets)), replace=False)
+    latencies = []
+    if model_type == "BiEncoder":
+        terms_per_second = results["num_encoded"] / results["encode_seconds"] if results["encode_seconds"] else 0
+        source_embeddings = results["source_embeddings"]
+        dimension = int(source_embeddings.shape[1])
+        for i in query_indices:
+            query_start = time.perf_counter()
+            query_embedding = normalize(model.encode([targets[i]], convert_to_numpy=True, show_progress_bar=False))
+            int(np.argmax(source_embeddings @ query_embedding[0]))
+            latencies.append((time.perf_counter() - query_start) * 1000)
+    else:
+        terms_per_second = results["num_pairs"] / results["predict_seconds"] if results["predict_seconds"] else 0
+        dimension = None
+        for i in query_indices:
+            pairs = [(sources[j], targets[i]) for j in results["top_indices"][i]]
+            query_start = time.perf_counter()
+            model.predict(pairs, show_progress_bar=False)
+            latencies.append((time.perf_counter() - query_start) * 1000)
+
+    return {
+        "model": model_name,
+        "model_type": model_type,
+        "rows": len(df_evaluation),
+        "accuracy": round(results["top_1"], 2),
+        "top_5": round(results["top_5"], 2),
+        "mrr": round(results["mrr"], 4),
+        "load_seconds": round(load_seconds, 2),
+        "terms_per_second": round(terms_per_second, 1),
+        "latency_p50_ms": round(float(np.percentile(latencies, 50)), 2) if latencies else None,
+        "latency_p99_ms": round(float(np.percentile(latencies, 99)), 2) if latencies else None,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "dimension": dimension,
+        "total_seconds": round(time.time() - start_time, 2),
+    }
+
+
+def run_benchmarks(df_model, df_evaluation, workers=1, verbosity=0, **kwargs):
+    """
+    Benchmark every model in df_model, each in its own process.
+
+    Returns:
+        List of result dictionaries, in the order of df_model
+    """
+    models = [(row['Model'].strip(), row['Model Type'].strip()) for _, row in df_model.iterrows()]
+    results = {}
+    # Spawned processes that run a single task each, so every model starts and ends with a clean process
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                             max_tasks_per_child=1) as executor:
+        futures = {
+            executor.submit(benchmark_model, model_name, model_type, df_evaluation, **kwargs): (model_name, model_type)
+            for model_name, model_type in models
+        }
+        for future in as_completed(futures):
+            model_name, model_type = futures[future]
+            try:
+                results[model_name] = future.result()
+            except Exception as e:
+                results[model_name] = {"model": model_name, "model_type": model_type, "error": str(e)}
+            if verbosity:
+                result = results[model_name]
+                if "error" in result:
+                    print(f"Model: {model_name}, Type: {model_type}, Error: {result['error']}")
+                else:
+                    print(f"Model: {model_name}, Type: {model_type}, Accuracy: {result['accuracy']:.2f}%, "
+                          f"Terms/sec: {result['terms_per_second']}, p50: {result['latency_p50_ms']} ms, "
+                          f"Peak RSS: {result['peak_rss_mb']} MB")
+    return [results[model_name] for model_name, _ in models]
+
+
+def results_table(df_model, results):
+    """Models.csv columns plus one column per benchmark metric."""
+    df_table = df_model.copy()
+    for column in TABLE_COLUMNS.values():
+        df_table[column] = None
+    for idx, result in zip(df_table.index, results):
+        for key, column in TABLE_COLUMNS.items():
+            df_table.at[idx, column] = result.get(key)
+    return df_table
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='benchmark.py', description='Benchmark encoder models on quality, speed and memory')
+    parser.add_argument('--data', required=True, help="CSV file with mapped source/target terms")
+    parser.add_argument('--source-column', default="SNOMED_Term", help="Column with the source terms")
+    parser.add_argument('--target-column', default="ICD10CA_Term", help="Column with the target terms")
+    parser.add_argument('--models', default="Models.csv", help="CSV file listing the models to benchmark")
+    parser.add_argument('--output', default="Models_Accuracy.csv", help="Comparison table CSV file")
+    parser.add_argument('--json', default="Models_Benchmark.json", help="Machine-readable results file")
+    parser.add_argument('--sample', type=int, help="Benchmark on a random sample of N rows instead of the full value set")
+    parser.add_argument('--workers', type=int, default=1, help="Number of models benchmarked in parallel")
+    parser.add_argument('--latency-queries', type=int, default=100, help="Number of single queries timed for latency")
+    parser.add_argument('--batch-size', type=int, default=256, help="Texts per encode batch (default: 256)")
+    parser.add_argument('--shortlist-model', default="all-MiniLM-L6-v2",
+                        help="Bi-encoder used to shortlist candidates for cross-encoders")
+    parser.add_argument('--shortlist-size', type=int, default=20, help="Candidates per target scored by cross-encoders")
+    parser.add_argument('-v', '--verbosity', type=int, default=1)
+    args = parser.parse_args()
+
+    df_data = load_evaluation_data(args.data, args.source_column, args.target_column, sample=args.sample)
+    df_model = pd.read_csv(args.models)
+    if args.verbosity:
+        print(f"Benchmarking {len(df_model)} models on {len(df_data)} rows with {args.workers} worker(s)")
+
+    results = run_benchmarks(
+        df_model, df_data, workers=args.workers, verbosity=args.verbosity,
+        latency_queries=args.latency_queries, batch_size=args.batch_size,
+        shortlist_model=args.shortlist_model, shortlist_size=args.shortlist_size
+    )
+
+    df_table = results_table(df_model, results)
+    df_table.to_csv(args.output, index=False)
+    with open(args.json, 'w') as f:
+        f.write(json.dumps({"rows": len(df_data), "args": vars(args), "results": results}, indent=4))
+
+    if args.verbosity:
+        print("\nCOMPARISON:")
+        print(df_table.to_string(index=False))
+        print(f"\nResults saved to: {args.output} and {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+'''
+Evaluate the bi-encoder and cross-encoder models listed in Models.csv on a set of mapped terms
+(e.g. SNOMED -> ICD10CA) and save their performance to Models_Accuracy.csv.
+
+Each target term is used as a query against all source terms; the correct answer is the source on
+the same row. Bi-encoders encode sources and targets once, in large batches, and the full
+similarity matrix is computed block by block with matrix multiplication, so memory stays bounded
+on the full value set. Cross-encoders only score a shortlist of the best bi-encoder candidates
+for each target instead of every (source, target) pair.
+
+Metrics:
+- Accuracy: Percentage of targets whose correct source is ranked first (top-1); sources with the same
+  score are ranked by row, as the notebook's argmax picked the first one (e.g. duplicate titles)
+- Top-5: Percentage of targets whose correct source is in the first 5
+- MRR: Mean reciprocal rank of the correct source
+
+Usage:
+python evaluate.py --data=./data/bc-health-concerns-and-diagnosis-value-set-v3-constrained.csv
+    --source-column=SNOMED_Term --target-column=ICD10CA_Term -v=1
+
+python evaluate.py --data=./data/values.csv --sample=100 --cache=score_cache.sqlite
+    --shortlist-model=ls-da3m0ns/bge_large_medical --shortlist-size=50
+
+CLI arguments:
+--data: CSV file with mapped source/target terms
+--source-column: Column with the source terms (default: SNOMED_Term)
+--target-column: Column with the target terms (default: ICD10CA_Term)
+--models: CSV file listing the models to evaluate (default: Models.csv)
+--output: Output CSV file (default: Models_Accuracy.csv)
+--sample: Evaluate a random sample of N rows instead of the full value set
+--batch-size: Texts per encode batch (default: 256)
+--block-size: Queries per similarity matrix block (default: 1024)
+--shortlist-model: Bi-encoder used to shortlist candidates for cross-encoders (default: all-MiniLM-L6-v2)
+--shortlist-size: Candidates per target scored by cross-encoders (default: 20)
+--cache: Optional SQLite file to cache embeddings and cross-encoder scores
+-v, --verbosity: Verbosity
+'''
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'cross-encoder'))
+from score_cache import ScoreCache, encode_cached, predict_cached
+
+
+def load_evaluation_data(filename, source_column="SNOMED_Term", target_column="ICD10CA_Term", sample=None,
+                         random_state=0):
+    """
+    Load mapped terms into a DataFrame with 'source' and 'target' columns.
+
+    Rows with an empty source or target are dropped. If `sample` is given, a random sample of that
+    many rows is returned instead of the full value set.
+    """
+    df_raw = pd.read_csv(filename)
+    df_data = df_raw[[source_column, target_column]].dropna().astype(str).copy()
+    df_data.columns = ['source', 'target']
+    if sample and sample < len(df_data):
+        df_data = df_data.sample(sample, random_state=random_state)
+    return df_data.reset_index(drop=True)
+
+
+def normalize(embeddings):
+    """L2-normalize rows so that a dot product is the cosine similarity."""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+
+def blockwise_rank(query_embeddings, corpus_embeddings, top_k=5, block_size=1024):
+    """
+    Rank the corpus for every query, one block of queries at a time.
+
+    The correct corpus item for query i is corpus item i. Only a (block_size x corpus) slice of the
+    similarity matrix is held in memory at once. Ties are ranked by corpus index, as the notebook's
+    argmax picked the first best item: a duplicate title earlier in the corpus ranks above the correct one.
+
+    Returns:
+        Tuple of (top_k corpus indices per query (n_queries x top_k), 1-based rank of the correct item per query)
+    """
+    n_queries, n_corpus = len(query_embeddings), len(corpus_embeddings)
+    top_k = min(top_k, n_corpus)
+    top_indices = np.empty((n_queries, top_k), dtype=np.int64)
+    ranks = np.empty(n_queries, dtype=np.int64)
+    corpus_t = np.ascontiguousarray(corpus_embeddings.T)
+
+    for start in range(0, n_queries, block_size):
+        end = min(start + block_size, n_queries)
+        scores = query_embeddings[start:end] @ corpus_t
+        rows = np.arange(end - start)
+
+        correct_scores = scores[rows, np.arange(start, end)][:, None]
+        earlier = np.arange(n_corpus)[None, :] < np.arange(start, end)[:, None]
+        ranks[start:end] = 1 + ((scores > correct_scores) | ((scores == correct_scores) & earlier)).sum(axis=1)
+
+        # Partial selection of the top-k, then sort only those k
+        candidates = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+        order = np.argsort(-scores[rows[:, None], candidates], axis=1)
+        top_indices[start:end] = candidates[rows[:, None], order]
+
+    return top_indices, ranks
+
+
+def ranking_metrics(ranks, ks=(1, 5)):
+    """Top-k percentages and mean reciprocal rank from 1-based ranks (np.inf for not found)."""
+    ranks = np.asarray(ranks, dtype=np.float64)
+    metrics = {f"top_{k}": float((ranks <= k).mean() * 100) for k in ks}
+    metrics["mrr"] = float((1.0 / ranks).mean())
+    return metrics
+
+
+def evaluate_bi_encoder(model_name, df_evaluation, cache=None, batch_size=256, block_size=1024, top_k=5, model=None):
+    """
+    Evaluate a bi-encoder: encode sources and targets once, then rank sources for every target.
+
+    Returns:
+        Dictionary with top-1/top-5 percentages, MRR, the top-k source indices and correct ranks per target,
+        the normalized source embeddings and encoding time
+    """
+    if model is None:
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(model_name)
+
+    start_time = time.time()
+    source_embeddings = normalize(encode_cached(model, model_name, df_evaluation['source'].tolist(), cache, batch_size))
+    target_embeddings = normalize(encode_cached(model, model_name, df_evaluation['target'].tolist(), cache, batch_size))
+    encode_seconds = time.time() - start_time
+
+    top_indices, ranks = blockwise_rank(target_embeddings, source_embeddings, top_k=top_k, block_size=block_size)
+    results = ranking_metrics(ranks)
+    results.update({
+        "top_indices": top_indices,
+        "ranks": ranks,
+        "source_embeddings": source_embeddings,
+        "num_encoded": 2 * len(df_evaluation),
+        "encode_seconds": encode_seconds
+    })
+    return results
+
+
+def evaluate_cross_encoder(model_name, df_evaluation, cache=None, shortlist_model="all-MiniLM-L6-v2",
+                           shortlist_size=20, batch_size=256, block_size=1024, model=None):
+    """
+    Evaluate a cross-encoder on a bi-encoder shortlist.
+
+    For each target, the `shortlist_size` best sources according to `shortlist_model` are scored by
+    the cross-encoder and re-ordered. Correct sources that are not in the shortlist count as misses.
+
+    Returns:
+        Dictionary with top-1/top-5 percentages, MRR, shortlist recall, the correct ranks per target,
+        the shortlist and scoring time
+    """
+    shortlist = evaluate_bi_encoder(shortlist_model, df_evaluation, cache=cache, batch_size=batch_size,
+                                    block_size=block_size, top_k=shortlist_size)
+    top_indices = shortlist["top_indices"]
+
+    if model is None:
+        from sentence_transformers.cross_encoder import CrossEncoder
+        model = CrossEncoder(model_name)
+
+    sources = df_evaluation['source'].tolist()
+    targets = df_evaluation['target'].tolist()
+    pairs = [(sources[j], targets[i]) for i in range(len(targets)) for j in top_indices[i]]
+    start_time = time.time()
+    scores = np.asarray(predict_cached(model, model_name, pairs, cache, batch_size=batch_size),
+                        dtype=np.float32).reshape(top_indices.shape)
+    predict_seconds = time.time() - start_time
+
+    ranks = np.full(len(targets), np.inf)
+    for i in range(len(targets)):
+        hits = np.flatnonzero(top_indices[i] == i)
+        if len(hits):
+            # Ties are ranked by source index, as in blockwise_rank
+            correct_score = scores[i, hits[0]]
+            ranks[i] = 1 + ((scores[i] > correct_score) | ((scores[i] == correct_score) & (top_indices[i] < i))).sum()
+
+    results = ranking_metrics(ranks)
+    results.update({
+        "ranks": ranks,
+        "top_indices": top_indices,
+        "shortlist_recall": float(np.isfinite(ranks).mean() * 100),
+        "num_pairs": len(pairs),
+        "predict_seconds": predict_seconds
+    })
+    return results
+
+
+def evaluate_model(model_name, model_type, df_evaluation, cache=None, **kwargs):
+    """
+    Evaluate one model from Models.csv.
+
+    Args:
+        model_name: Hugging Face / SentenceTransformer model name
+        model_type: BiEncoder or CrossEncoder
+        df_evaluation: DataFrame containing 'source' and 'target' columns
+        cache: Optional ScoreCache for embeddings and pair scores
+
+    Returns:
+        Dictionary with 'top_1' (accuracy percentage), 'top_5', 'mrr' and per-target details
+    """
+    if model_type == "BiEncoder":
+        kwargs.pop("shortlist_model", None)
+        kwargs.pop("shortlist_size", None)
+        return evaluate_bi_encoder(model_name, df_evaluation, cache=cache, **kwargs)
+    elif model_type == "CrossEncoder":
+        return evaluate_cross_encoder(model_name, df_evaluation, cache=cache, **kwargs)
+    raise ValueError("Invalid model_type. Choose either 'BiEncoder' or 'CrossEncoder'.")
+
+
+def evaluate_models(df_model, df_evaluation, cache=None, verbosity=0, **kwargs):
+    """
+    Evaluate every model listed in a Models.csv DataFrame.
+
+    Returns:
+        Copy of df_model with Accuracy (top-1 %), Top5 (%), MRR and Seconds columns
+    """
+    df_model = df_model.copy()
+    for idx, row in df_model.iterrows():
+        model_name = row['Model'].strip()
+        model_type = row['Model Type'].strip()
+        start_time = time.time()
+        results = evaluate_model(model_name, model_type, df_evaluation, cache=cache, **kwargs)
+        df_model.at[idx, 'Accuracy'] = round(results['top_1'], 2)
+        df_model.at[idx, 'Top5'] = round(results['top_5'], 2)
+        df_model.at[idx, 'MRR'] = round(results['mrr'], 4)
+        df_model.at[idx, 'Seconds'] = round(time.time() - start_time, 2)
+
+        if verbosity:
+            print(f"Model: {model_name}, Type: {model_type}, Accuracy: {results['top_1']:.2f}%, "
+                  f"Top-5: {results['top_5']:.2f}%, MRR: {results['mrr']:.4f}, "
+                  f"Time: {df_model.at[idx, 'Seconds']} sec")
+    return df_model
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='evaluate.py', description='Evaluate bi-encoder and cross-encoder models on mapped terms')
+    parser.add_argument('--data', required=True, help="CSV file with mapped source/target terms")
+    parser.add_argument('--source-column', default="SNOMED_Term", help="Column with the source terms")
+    parser.add_argument('--target-column', default="ICD10CA_Term", help="Column with the target terms")
+    parser.add_argument('--models', default="Models.csv", help="CSV file listing the models to evaluate")
+    parser.add_argument('--output', default="Models_Accuracy.csv", help="Output CSV file")
+    parser.add_argument('--sample', type=int, help="Evaluate a random sample of N rows instead of the full value set")
+    parser.add_argument('--batch-size', type=int, default=256, help="Texts per encode batch (default: 256)")
+    parser.add_argument('--block-size', type=int, default=1024, help="Queries per similarity matrix block (default: 1024)")
+    parser.add_argument('--shortlist-model', default="all-MiniLM-L6-v2",
+                        help="Bi-encoder used to shortlist candidates for cross-encoders")
+    parser.add_argument('--shortlist-size', type=int, default=20, help="Candidates per target scored by cross-encoders")
+    parser.add_argument('--cache', help="Optional SQLite file to cache embeddings and cross-encoder scores")
+    parser.add_argument('-v', '--verbosity', type=int, default=1)
+    args = parser.parse_args()
+
+    df_data = load_evaluation_data(args.data, args.source_column, args.target_column, sample=args.sample)
+    df_model = pd.read_csv(args.models)
+    cache = ScoreCache(path=args.cache) if args.cache else None
+    if args.verbosity:
+        print(f"Evaluating {len(df_model)} models on {len(df_data)} rows")
+
+    df_results = evaluate_models(
+        df_model, df_data, cache=cache, verbosity=args.verbosity,
+        batch_size=args.batch_size, block_size=args.block_size,
+        shortlist_model=args.shortlist_model, shortlist_size=args.shortlist_size
+    )
+    df_results.to_csv(args.output, index=False)
+    if args.verbosity:
+        if cache is not None:
+            print(f"Cache: {cache.stats()}")
+        print(f"Results saved to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
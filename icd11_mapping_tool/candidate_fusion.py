@@ -0,0 +1,360 @@
+'''
+Fused ICD-11 candidate generation for CIEL concepts from several sources at once.
+
+For each chunk of concepts, every enabled source is queried in parallel:
+- search: ICD API linearization search (icd_bulk_client.py)
+- autocode: ICD API entity autocode resolved to its MMS code (icd_bulk_client.py)
+- crossref: WHO ICD-10 -> ICD-11 cross-reference of the concept's ICD-10 code (icd_crossref.py)
+- semantic: Nearest ICD-11 concepts in a Qdrant collection built by the Phase 3.1 notebook
+
+The candidate lists are merged into one ranked list per concept with reciprocal rank fusion
+(score = sum of weight / (k + rank)) or weighted score fusion (sum of weight x score normalised to
+the best score of that source). Every fused candidate records which sources proposed it and at
+which rank. Each source has its own timeout, so a slow or failing source is dropped for that
+chunk without holding up the others, and per-source time, timeouts and errors are reported.
+The crossref and semantic sources run in a worker thread, which cannot be interrupted: after a
+timeout the thread finishes its lookup in the background and the source skips the following chunks
+until it is done, so timed-out lookups do not pile up.
+
+Usage:
+python candidate_fusion.py -i=./ciel_diagnoses.csv -o=./output/icd11_fused.csv --icd10-column=icd10_code
+python candidate_fusion.py -i=./ciel_diagnoses.csv -o=./output/icd11_fused.csv --sources=search,autocode,semantic
+    --method=weighted --weights=search=1,autocode=2,semantic=1 --timeout=20
+
+CLI arguments:
+-i, --inputfile: CSV file with the CIEL concepts
+-o, --outputfile: Output CSV file with one fused candidate list per concept
+--name-column: Column with the concept name (default: name)
+--icd10-column: Column with the concept's ICD-10 code (required for the crossref source)
+--sources: Comma-separated sources (default: search,autocode, plus crossref if --icd10-column is given)
+--method: rrf or weighted (default: rrf)
+--weights: Source weights, e.g. search=1,autocode=1.5 (default: 1 for every source)
+--rrf-k: Reciprocal rank fusion constant (default: 60)
+--top: Number of fused candidates kept per concept (default: 10)
+--timeout: Seconds each source may take per chunk (default: 60); a timed-out crossref or semantic lookup keeps
+    running in its thread and the source skips chunks until it finishes
+--chunk: Concepts per chunk (default: 200)
+--semantic-model: SentenceTransformer model for the semantic source (default: sentence-transformers/all-MiniLM-L6-v2)
+--collection: Qdrant collection for the semantic source (default: icd11_concepts_minilm)
+--qdrant-host / --qdrant-port: Qdrant server (default: localhost:6333)
+--cache: SQLite file used to memoise ICD API responses (default: ./assets/icd_cache.sqlite)
+--api-url: ICD API base URL (default: $ICD_API_URL or http://icdapi)
+--release: ICD-11 release (default: $ICD_RELEASE or 2025-01)
+--concurrency: Maximum number of concurrent ICD API requests (default: 30)
+--stats: Optional JSON file for the per-source statistics
+'''
+
+import argparse
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+from tqdm import tqdm
+
+from icd_api import ICD_API_URL, ICD_RELEASE
+from icd_bulk_client import ICDBulkClient
+from icd_cache import ICDCache
+
+
+class CandidateSource:
+    """A source of ranked ICD-11 candidates for a batch of concepts."""
+
+    name = ""
+
+    async def candidates(self, concepts):
+        """
+        Args:
+            concepts: List of dictionaries with at least 'name' (and 'icd10' for crossref)
+
+        Returns:
+            One list of {"code", "title", "score"} per concept, best first
+        """
+        raise NotImplementedError
+
+    def busy(self):
+        """True while a lookup that timed out is still running (thread sources only)."""
+        return False
+
+
+class ThreadSource(CandidateSource):
+    """A source whose blocking lookups run in its own worker thread, one at a time."""
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=self.name)
+        self.future = None
+
+    async def run_in_thread(self, func, *args):
+        # Keep the thread's future: cancelling the awaiting task on timeout does not stop the thread
+        self.future = self.executor.submit(func, *args)
+        return await asyncio.wrap_future(self.future)
+
+    def busy(self):
+        return self.future is not None and not self.future.done()
+
+
+class SearchSource(CandidateSource):
+    name = "search"
+
+    def __init__(self, client):
+        self.client = client
+
+    async def candidates(self, concepts):
+        results = await asyncio.gather(*[self.client.search(concept['name']) for concept in concepts], return_exceptions=True)
+        return [result if isinstance(result, list) else [] for result in results]
+
+
+class AutocodeSource(CandidateSource):
+    name = "autocode"
+
+    def __init__(self, client):
+        self.client = client
+
+    async def candidates(self, concepts):
+        results = await asyncio.gather(*[self.client.autocode(concept['name']) for concept in concepts], return_exceptions=True)
+        return [
+            [{"code": result['code'], "title": result['title'], "score": result['score']}]
+            if isinstance(result, dict) and result.get('code') else []
+            for result in results
+        ]
+
+
+class CrossReferenceSource(ThreadSource):
+    name = "crossref"
+
+    def __init__(self, resolver):
+        super().__init__()
+        self.resolver = resolver
+
+    async def candidates(self, concepts):
+        codes = [concept.get('icd10') or "" for concept in concepts]
+        resolved = await self.run_in_thread(self.resolver.resolve, codes)
+        return [
+            [{"code": target.icd11Code, "title": target.icd11Title, "score": 1.0 if target.mapping == "one" else 0.5}
+             for target in resolved.get(code.strip(), [])]
+            for code in codes
+        ]
+
+
+class SemanticSource(ThreadSource):
+    name = "semantic"
+
+    def __init__(self, model_name, collection, host="localhost", port=6333, limit=20):
+        super().__init__()
+        # Lazy imports so the other sources work without qdrant-client / sentence-transformers
+        from qdrant_client import QdrantClient
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name)
+        self.client = QdrantClient(host=host, port=port)
+        self.collection = collection
+        self.limit = limit
+
+    def _search(self, names):
+        vectors = self.model.encode(names, convert_to_numpy=True, show_progress_bar=False)
+        results = []
+        for vector in vectors:
+            points = self.client.query_points(self.collection, query=vector.tolist(), limit=self.limit).points
+            candidates, seen = [], set()
+            for point in points:
+                code = (point.payload or {}).get("code")
+                if code and code not in seen:
+                    seen.add(code)
+                    candidates.append({"code": code, "title": point.payload.get("concept_name", ""), "score": point.score})
+            results.append(candidates)
+        return results
+
+    async def candidates(self, concepts):
+        return await self.run_in_thread(self._search, [concept['name'] for concept in concepts])
+
+
+def fuse(source_candidates, weights=None, method="rrf", rrf_k=60, top=10):
+    """
+    Merge the candidate lists of several sources for one concept.
+
+    Args:
+        source_candidates: Dictionary source name -> list of {"code", "title", "score"}, best first
+        weights: Optional dictionary source name -> weight (default 1)
+        method: 'rrf' (reciprocal rank fusion) or 'weighted' (normalised score fusion)
+
+    Returns:
+        List of {"code", "title", "score", "sources": {source: rank}}, best first
+    """
+    weights = weights or {}
+    fused = {}
+    for source, candidates in source_candidates.items():
+        weight = weights.get(source, 1.0)
+        best_score = max((candidate.get('score') or 0 for candidate in candidates), default=0) or 1.0
+        for rank, candidate in enumerate(candidates, start=1):
+            entry = fused.setdefault(candidate['code'], {"code": candidate['code'], "title": candidate.get('title', ""),
+                                                         "score": 0.0, "sources": {}})
+            if source in entry['sources']:
+                continue
+            entry['sources'][source] = rank
+            if method == "rrf":
+                entry['score'] += weight / (rrf_k + rank)
+            else:
+                entry['score'] += weight * (candidate.get('score') or 0) / best_score
+            if not entry['title']:
+                entry['title'] = candidate.get('title', "")
+    ranked = sorted(fused.values(), key=lambda entry: (-entry['score'], -len(entry['sources'])))
+    for entry in ranked:
+        entry['score'] = round(entry['score'], 6)
+    return ranked[:top]
+
+
+class CandidateFusion:
+    """Runs all sources in parallel per chunk and fuses their candidates."""
+
+    def __init__(self, sources, weights=None, method="rrf", rrf_k=60, top=10, timeout=60):
+        self.sources = sources
+        self.weights = weights or {}
+        self.method = method
+        self.rrf_k = rrf_k
+        self.top = top
+        self.timeout = timeout
+        self.stats = {source.name: {"seconds": 0.0, "chunks": 0, "timeouts": 0, "skipped": 0, "errors": 0,
+                                    "candidates": 0}
+                      for source in sources}
+
+    async def _run_source(self, source, concepts):
+        stats = self.stats[source.name]
+        if source.busy():
+            # The lookup of an earlier chunk timed out and is still running in the source's thread
+            stats['skipped'] += 1
+            return None
+        start_time = time.perf_counter()
+        try:
+            results = await asyncio.wait_for(source.candidates(concepts), timeout=self.timeout)
+            stats['candidates'] += sum(len(result) for result in results)
+            return results
+        except asyncio.TimeoutError:
+            stats['timeouts'] += 1
+        except Exception:
+            stats['errors'] += 1
+        finally:
+            stats['seconds'] += time.perf_counter() - start_time
+            stats['chunks'] += 1
+        return None
+
+    async def fuse_chunk(self, concepts):
+        """Fused candidate list for each concept of the chunk."""
+        results = await asyncio.gather(*[self._run_source(source, concepts) for source in self.sources])
+        fused = []
+        for i in range(len(concepts)):
+            source_candidates = {
+                source.name: source_results[i] for source, source_results in zip(self.sources, results)
+                if source_results is not None
+            }
+            fused.append(fuse(source_candidates, self.weights, self.method, self.rrf_k, self.top))
+        return fused
+
+
+def parse_weights(value):
+    """'search=1,autocode=1.5' -> {'search': 1.0, 'autocode': 1.5}"""
+    weights = {}
+    for item in filter(None, (value or "").split(",")):
+        source, weight = item.split("=")
+        weights[source.strip()] = float(weight)
+    return weights
+
+
+def default_sources(args):
+    """search,autocode, plus crossref when the input has an ICD-10 column."""
+    if args.icd10_column:
+        return "search,autocode,crossref"
+    print("• No --icd10-column given: the crossref source is left out (sources: search,autocode)")
+    return "search,autocode"
+
+
+async def run(args, df_input):
+    client = ICDBulkClient(cache=ICDCache(args.cache), api_url=args.api_url, release=args.release,
+                           concurrency=args.concurrency, search_results=args.top)
+    source_names = [name.strip() for name in (args.sources or default_sources(args)).split(",") if name.strip()]
+    sources = []
+    for name in source_names:
+        if name == "search":
+            sources.append(SearchSource(client))
+        elif name == "autocode":
+            sources.append(AutocodeSource(client))
+        elif name == "crossref":
+            if not args.icd10_column:
+                raise ValueError("The crossref source requires --icd10-column")
+            from icd_crossref import CrossReferenceResolver
+            from icd_db import get_engine
+            sources.append(CrossReferenceSource(CrossReferenceResolver(get_engine(), preload=True)))
+        elif name == "semantic":
+            sources.append(SemanticSource(args.semantic_model, args.collection, args.qdrant_host, args.qdrant_port))
+        else:
+            raise ValueError(f"Unknown source: {name}")
+
+    fusion = CandidateFusion(sources, weights=parse_weights(args.weights), method=args.method,
+                             rrf_k=args.rrf_k, top=args.top, timeout=args.timeout)
+    async with client:
+        for start in tqdm(range(0, len(df_input), args.chunk), desc="Fusing candidates", unit="chunks"):
+            df_chunk = df_input.iloc[start:start + args.chunk].copy()
+            concepts = [
+                {"name": name, "icd10": icd10}
+                for name, icd10 in zip(df_chunk[args.name_column].fillna("").astype(str),
+                                       df_chunk[args.icd10_column].fillna("").astype(str) if args.icd10_column
+                                       else [""] * len(df_chunk))
+            ]
+            fused = await fusion.fuse_chunk(concepts)
+            df_chunk['fused_code'] = [candidates[0]['code'] if candidates else None for candidates in fused]
+            df_chunk['fused_title'] = [candidates[0]['title'] if candidates else None for candidates in fused]
+            df_chunk['fused_score'] = [candidates[0]['score'] if candidates else None for candidates in fused]
+            df_chunk['fused_sources'] = [",".join(candidates[0]['sources']) if candidates else None for candidates in fused]
+            df_chunk['fused_candidates'] = [json.dumps(candidates) for candidates in fused]
+            df_chunk.to_csv(args.outputfile, mode='w' if start == 0 else 'a', header=start == 0, index=False)
+    return fusion.stats
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='candidate_fusion.py', description='Fuse ICD-11 candidates from several sources')
+    parser.add_argument('-i', '--inputfile', required=True, help="CSV file with the CIEL concepts")
+    parser.add_argument('-o', '--outputfile', required=True, help="Output CSV file with one fused candidate list per concept")
+    parser.add_argument('--name-column', default="name", help="Column with the concept name")
+    parser.add_argument('--icd10-column', help="Column with the concept's ICD-10 code (crossref source)")
+    parser.add_argument('--sources', help="Comma-separated sources (default: search,autocode, plus crossref "
+                        "if --icd10-column is given)")
+    parser.add_argument('--method', choices=["rrf", "weighted"], default="rrf", help="Fusion method")
+    parser.add_argument('--weights', help="Source weights, e.g. search=1,autocode=1.5")
+    parser.add_argument('--rrf-k', type=int, default=60, help="Reciprocal rank fusion constant")
+    parser.add_argument('--top', type=int, default=10, help="Number of fused candidates kept per concept")
+    parser.add_argument('--timeout', type=float, default=60,
+                        help="Seconds each source may take per chunk; a timed-out crossref or semantic lookup "
+                        "cannot be interrupted, it keeps running in its thread and the source skips chunks until it finishes")
+    parser.add_argument('--chunk', type=int, default=200, help="Concepts per chunk")
+    parser.add_argument('--semantic-model', default="sentence-transformers/all-MiniLM-L6-v2", help="Model for the semantic source")
+    parser.add_argument('--collection', default="icd11_concepts_minilm", help="Qdrant collection for the semantic source")
+    parser.add_argument('--qdrant-host', default="localhost", help="Qdrant host")
+    parser.add_argument('--qdrant-port', type=int, default=6333, help="Qdrant port")
+    parser.add_argument('--cache', default="./assets/icd_cache.sqlite", help="SQLite file used to memoise ICD API responses")
+    parser.add_argument('--api-url', default=ICD_API_URL, help="ICD API base URL")
+    parser.add_argument('--release', default=ICD_RELEASE, help="ICD-11 release")
+    parser.add_argument('--concurrency', type=int, default=30, help="Maximum number of concurrent ICD API requests")
+    parser.add_argument('--stats', help="Optional JSON file for the per-source statistics")
+    args = parser.parse_args()
+
+    df_input = pd.read_csv(args.inputfile, dtype=str)
+    if args.icd10_column and args.icd10_column not in df_input.columns:
+        raise ValueError(f"Column not found: {args.icd10_column}")
+
+    start_time = time.time()
+    stats = asyncio.run(run(args, df_input))
+    elapsed_seconds = time.time() - start_time
+
+    print(f"✅ {len(df_input)} concepts fused in {round(elapsed_seconds, 2)} sec, saved to: {args.outputfile}")
+    for source, source_stats in stats.items():
+        source_stats['seconds'] = round(source_stats['seconds'], 2)
+        print(f"• {source}: {source_stats['seconds']} sec over {source_stats['chunks']} chunks, "
+              f"{source_stats['candidates']} candidates, {source_stats['timeouts']} timeouts, "
+              f"{source_stats['skipped']} chunks skipped, {source_stats['errors']} errors")
+    if args.stats:
+        with open(args.stats, 'w') as f:
+            json.dump({"concepts": len(df_input), "seconds": round(elapsed_seconds, 2), "sources": stats}, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+'''
+Shared settings and helpers for the local WHO ICD API container (whoicd/icd-api).
+
+The defaults match the devcontainer setup (service "icdapi", release 2025-01) and can be
+overridden with the ICD_API_URL and ICD_RELEASE environment variables.
+'''
+
+import asyncio
+import os
+
+ICD_API_URL = os.getenv("ICD_API_URL", "http://icdapi")
+ICD_RELEASE = os.getenv("ICD_RELEASE", "2025-01")
+ROOT_ENTITY_ID = "448895267"  # Root entity for ICD Entities
+
+HEADERS = {
+    "accept": "application/json",
+    "API-Version": "v2",
+    "Accept-Language": "en"
+}
+
+
+def entity_url(entity_id, api_url=ICD_API_URL):
+    """Foundation entity endpoint, e.g. http://icdapi/icd/entity/448895267"""
+    return f"{api_url.rstrip('/')}/icd/entity/{entity_id}"
+
+
+def linearization_url(entity_path, api_url=ICD_API_URL, release=ICD_RELEASE, linearization="mms"):
+    """Linearization endpoint for an entity path, e.g. '1673130746' or '927970860/unspecified'"""
+    return f"{api_url.rstrip('/')}/icd/release/11/{release}/{linearization}/{entity_path}"
+
+
+def extract_entity_path(full_url):
+    """Extract the full path after /mms/, preserving /unspecified, /other etc."""
+    try:
+        return full_url.split("/mms/")[1]
+    except IndexError:
+        return ""
+
+
+def extract_entity_id(full_url):
+    """Extract only the last numeric ID of the URL (for the foundation)"""
+    return full_url.rstrip("/").split("/")[-1]
+
+
+def make_async_client(concurrency=30, timeout=30):
+    """
+    Create an httpx.AsyncClient with a connection pool sized for `concurrency` requests.
+
+    Lazy import to avoid requiring httpx for the synchronous helpers.
+    """
+    import httpx
+    return httpx.AsyncClient(
+        headers=HEADERS,
+        timeout=timeout,
+        limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    )
+
+
+async def get_json(client, url, params=None, retries=3, backoff=0.5):
+    """
+    GET a JSON document, retrying connection errors and 5xx responses.
+
+    Returns:
+        Parsed JSON, or None if the resource does not exist (4xx)
+    """
+    import httpx
+    for attempt in range(retries + 1):
+        try:
+            response = await client.get(url, params=params)
+            if response.status_code < 400:
+                return response.json()
+            if response.status_code < 500:
+                return None
+            response.raise_for_status()
+        except (httpx.TransportError, httpx.HTTPStatusError):
+            if attempt == retries:
+                raise
+        await asyncio.sleep(backoff * 2 ** attempt)
@@ -0,0 +1,236 @@
+'''
+Bulk ICD-11 candidate lookup for CIEL concepts through the local ICD API container.
+
+For every concept of the input file, the linearization search, the entity autocode and the
+resolution of the autocode hit to its MMS code run concurrently (capped by --concurrency) over a
+pooled connection. Responses are memoised on disk by request and release (see icd_cache.py), so
+re-runs and interrupted runs only call the API for new queries. One candidate row is written per
+concept, and per-endpoint request counts, cache hits, throughput and latency are reported at the end.
+
+Usage:
+python icd_bulk_client.py -i=./ciel_diagnoses.csv -o=./output/icd11_candidates.csv
+python icd_bulk_client.py -i=./ciel_diagnoses.csv -o=./output/icd11_candidates.csv --id-column=concept_id
+    --name-column=fsn --concurrency=50 --search-results=10 --stats=./output/icd11_candidates_stats.json
+
+CLI arguments:
+-i, --inputfile: CSV file with the CIEL concepts
+-o, --outputfile: Output CSV file with one candidate row per concept
+--id-column: Column with the concept ID (default: local_id)
+--name-column: Column with the concept name searched in ICD-11 (default: name)
+--search-results: Number of search results kept per concept (default: 5)
+--cache: SQLite file used to memoise API responses (default: ./assets/icd_cache.sqlite)
+--api-url: ICD API base URL (default: $ICD_API_URL or http://icdapi)
+--release: ICD-11 release (default: $ICD_RELEASE or 2025-01)
+--concurrency: Maximum number of concurrent API requests (default: 30)
+--chunk: Concepts processed and written per chunk (default: 500)
+--stats: Optional JSON file for the per-endpoint statistics
+'''
+
+import argparse
+import asyncio
+import json
+import re
+import time
+from urllib.parse import urlencode
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from icd_api import ICD_API_URL, ICD_RELEASE, get_json, linearization_url, make_async_client
+from icd_cache import ICDCache
+
+SEARCH_PARAMS = {
+    "subtreeFilterUsesFoundationDescendants": "false",
+    "includeKeywordResult": "false",
+    "useFlexisearch": "false",
+    "flatResults": "true",
+    "highlightingEnabled": "true",
+    "medicalCodingMode": "true"
+}
+
+OUTPUT_COLUMNS = [
+    "search_code", "search_title", "search_score", "search_candidates",
+    "autocode_code", "autocode_title", "autocode_score", "autocode_matching_text", "autocode_foundation_uri"
+]
+
+
+def strip_highlighting(title):
+    """Remove the <em class='found'> tags of highlighted search results."""
+    return re.sub(r"</?em[^>]*>", "", title or "")
+
+
+class EndpointStats:
+    """Request, cache hit, error and latency counters of one endpoint."""
+
+    def __init__(self):
+        self.requests = 0
+        self.cache_hits = 0
+        self.errors = 0
+        self.latencies = []
+
+    def summary(self, elapsed_seconds):
+        latencies = np.asarray(self.latencies) * 1000
+        return {
+            "requests": self.requests,
+            "cache_hits": self.cache_hits,
+            "errors": self.errors,
+            "requests_per_second": round(self.requests / elapsed_seconds, 1) if elapsed_seconds else 0.0,
+            "latency_p50_ms": round(float(np.percentile(latencies, 50)), 1) if len(latencies) else None,
+            "latency_p95_ms": round(float(np.percentile(latencies, 95)), 1) if len(latencies) else None,
+            "latency_max_ms": round(float(latencies.max()), 1) if len(latencies) else None,
+        }
+
+
+class ICDBulkClient:
+    """Concurrent, disk-memoised search / autocode / entity client."""
+
+    def __init__(self, cache=None, api_url=ICD_API_URL, release=ICD_RELEASE, concurrency=30, search_results=5):
+        self.cache = cache if cache is not None else ICDCache()
+        self.api_url = api_url.rstrip("/")
+        self.release = release
+        self.concurrency = concurrency
+        self.search_results = search_results
+        self.stats = {endpoint: EndpointStats() for endpoint in ("search", "autocode", "entity")}
+        self.semaphore = None
+        self.client = None
+        self.in_flight = {}
+
+    async def __aenter__(self):
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.client = make_async_client(self.concurrency)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.client.aclose()
+
+    async def fetch(self, endpoint, url, params=None):
+        """GET with disk memoisation by release, URL and parameters; identical concurrent requests are shared."""
+        key = f"{self.release}|{url}?{urlencode(sorted((params or {}).items()))}"
+        cached = self.cache.get_many("api", [key])
+        stats = self.stats[endpoint]
+        if key in cached:
+            stats.cache_hits += 1
+            return cached[key]
+        if key in self.in_flight:
+            stats.cache_hits += 1
+            return await asyncio.shield(self.in_flight[key])
+
+        self.in_flight[key] = asyncio.ensure_future(self._request(endpoint, key, url, params))
+        try:
+            return await asyncio.shield(self.in_flight[key])
+        finally:
+            self.in_flight.pop(key, None)
+
+    async def _request(self, endpoint, key, url, params):
+        stats = self.stats[endpoint]
+        async with self.semaphore:
+            start_time = time.perf_counter()
+            try:
+                data = await get_json(self.client, url, params=params)
+            except Exception:
+                stats.errors += 1
+                raise
+            finally:
+                stats.requests += 1
+                stats.latencies.append(time.perf_counter() - start_time)
+        self.cache.put("api", key, data)
+        return data
+
+    async def search(self, name):
+        data = await self.fetch("search", linearization_url("search", self.api_url, self.release),
+                                dict(SEARCH_PARAMS, q=name))
+        results = sorted((data or {}).get("destinationEntities", []), key=lambda x: x.get("score", 0), reverse=True)
+        return [
+            {"code": result.get("theCode", ""), "title": strip_highlighting(result.get("title")), "score": result.get("score")}
+            for result in results[:self.search_results]
+        ]
+
+    async def autocode(self, name):
+        data = await self.fetch("autocode", f"{self.api_url}/icd/entity/autocode", {"searchText": name})
+        if not data or not data.get("foundationURI"):
+            return {}
+        entity_id = data["foundationURI"].split("/")[-1]
+        entity = await self.fetch("entity", linearization_url(entity_id, self.api_url, self.release)) or {}
+        return {
+            "code": entity.get("code") or (entity.get("codeRange") or "").split("-")[-1],
+            "title": entity.get("title", {}).get("@value", ""),
+            "score": data.get("matchScore"),
+            "matching_text": data.get("matchingText", ""),
+            "foundation_uri": data["foundationURI"],
+        }
+
+    async def lookup(self, name):
+        """Search and autocode one concept name concurrently; returns the candidate columns."""
+        search, autocode = await asyncio.gather(self.search(name), self.autocode(name), return_exceptions=True)
+        row = {column: None for column in OUTPUT_COLUMNS}
+        if isinstance(search, list) and search:
+            row.update({
+                "search_code": search[0]["code"],
+                "search_title": search[0]["title"],
+                "search_score": search[0]["score"],
+                "search_candidates": json.dumps(search),
+            })
+        if isinstance(autocode, dict) and autocode:
+            row.update({
+                "autocode_code": autocode["code"],
+                "autocode_title": autocode["title"],
+                "autocode_score": autocode["score"],
+                "autocode_matching_text": autocode["matching_text"],
+                "autocode_foundation_uri": autocode["foundation_uri"],
+            })
+        return row
+
+    async def lookup_many(self, names):
+        return await asyncio.gather(*[self.lookup(name) for name in names])
+
+
+async def run(df_input, output_filename, name_column, client, chunk_size=500):
+    """Look up every concept, chunk by chunk, appending each chunk to the output file."""
+    async with client:
+        for start in tqdm(range(0, len(df_input), chunk_size), desc="Looking up concepts", unit="chunks"):
+            df_chunk = df_input.iloc[start:start + chunk_size].copy()
+            rows = await client.lookup_many(df_chunk[name_column].fillna("").astype(str).tolist())
+            for column in OUTPUT_COLUMNS:
+                df_chunk[column] = [row[column] for row in rows]
+            df_chunk.to_csv(output_filename, mode='w' if start == 0 else 'a', header=start == 0, index=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='icd_bulk_client.py', description='Bulk ICD-11 search and autocode for CIEL concepts')
+    parser.add_argument('-i', '--inputfile', required=True, help="CSV file with the CIEL concepts")
+    parser.add_argument('-o', '--outputfile', required=True, help="Output CSV file with one candidate row per concept")
+    parser.add_argument('--id-column', default="local_id", help="Column with the concept ID")
+    parser.add_argument('--name-column', default="name", help="Column with the concept name")
+    parser.add_argument('--search-results', type=int, default=5, help="Number of search results kept per concept")
+    parser.add_argument('--cache', default="./assets/icd_cache.sqlite", help="SQLite file used to memoise API responses")
+    parser.add_argument('--api-url', default=ICD_API_URL, help="ICD API base URL")
+    parser.add_argument('--release', default=ICD_RELEASE, help="ICD-11 release")
+    parser.add_argument('--concurrency', type=int, default=30, help="Maximum number of concurrent API requests")
+    parser.add_argument('--chunk', type=int, default=500, help="Concepts processed and written per chunk")
+    parser.add_argument('--stats', help="Optional JSON file for the per-endpoint statistics")
+    args = parser.parse_args()
+
+    df_input = pd.read_csv(args.inputfile, dtype=str)
+    df_input = df_input[[args.id_column, args.name_column]]
+    client = ICDBulkClient(cache=ICDCache(args.cache), api_url=args.api_url, release=args.release,
+                           concurrency=args.concurrency, search_results=args.search_results)
+
+    start_time = time.time()
+    asyncio.run(run(df_input, args.outputfile, args.name_column, client, chunk_size=args.chunk))
+    elapsed_seconds = time.time() - start_time
+
+    stats = {endpoint: endpoint_stats.summary(elapsed_seconds) for endpoint, endpoint_stats in client.stats.items()}
+    print(f"✅ {len(df_input)} concepts looked up in {round(elapsed_seconds, 2)} sec "
+          f"({round(len(df_input) / elapsed_seconds, 1) if elapsed_seconds else 0} concepts/sec), saved to: {args.outputfile}")
+    for endpoint, summary in stats.items():
+        print(f"• {endpoint}: {summary['requests']} requests ({summary['requests_per_second']}/sec), "
+              f"{summary['cache_hits']} cache hits, {summary['errors']} errors, "
+              f"p50 {summary['latency_p50_ms']} ms, p95 {summary['latency_p95_ms']} ms")
+    if args.stats:
+        with open(args.stats, 'w') as f:
+            json.dump({"concepts": len(df_input), "seconds": round(elapsed_seconds, 2), "endpoints": stats}, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
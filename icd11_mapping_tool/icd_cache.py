@@ -0,0 +1,85 @@
+'''
+Persistent key/value cache for ICD API responses and derived results (SQLite).
+
+Entries are grouped by namespace (e.g. "api", "validation") and stored as JSON, so the same file can
+hold raw API responses and the results computed from them. Keys should include the ICD release
+when the value depends on it.
+
+Usage:
+from icd_cache import ICDCache
+
+cache = ICDCache("./assets/icd_cache.sqlite")
+cache.put_many("api", {url: response_json})
+cache.get_many("api", [url])   # {url: response_json} for the keys that are cached
+'''
+
+import json
+import os
+import sqlite3
+import time
+
+
+class ICDCache:
+    """Namespaced JSON cache in a SQLite file; an in-memory database is used when no path is given."""
+
+    def __init__(self, path=None):
+        self.path = path
+        if path and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            )
+        """)
+        self.conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, namespace, keys):
+        """Return {key: value} for the keys found in the cache."""
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            for key, value in self.conn.execute(
+                    f"SELECT key, value FROM cache WHERE namespace = ? AND key IN ({placeholders})", [namespace] + batch):
+                found[key] = json.loads(value)
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def get(self, namespace, key, default=None):
+        return self.get_many(namespace, [key]).get(key, default)
+
+    def put_many(self, namespace, entries):
+        """Store {key: value} entries (values must be JSON serializable)."""
+        now = time.time()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO cache (namespace, key, value, created_at) VALUES (?, ?, ?, ?)",
+            [(namespace, key, json.dumps(value), now) for key, value in entries.items()]
+        )
+        self.conn.commit()
+
+    def put(self, namespace, key, value):
+        self.put_many(namespace, {key: value})
+
+    def clear(self, namespace=None):
+        if namespace is None:
+            self.conn.execute("DELETE FROM cache")
+        else:
+            self.conn.execute("DELETE FROM cache WHERE namespace = ?", (namespace,))
+        self.conn.commit()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0}
+
+    def close(self):
+        self.conn.close()
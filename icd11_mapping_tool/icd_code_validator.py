@@ -0,0 +1,278 @@
+'''
+Batched QA of proposed ICD-11 codes: terminal stems and allowed postcoordination.
+
+Replaces the one-request-per-code QA loop of README.ipynb. A whole batch of proposed codes is
+deduplicated and validated at once:
+- Codes are split into clusters: '/' joins stem codes and '&' attaches extension codes to the
+  preceding stem, e.g. '2C25.0&XH7SM1/1C11.0'
+- Stems are checked against analytics.icd11_mms_en (known code, terminal / leaf)
+- Every extension must be one of the options allowed for its stem in
+  analytics.icd11_mms_en_postcoordination; stems with required postcoordination must have one
+- Only codes that are not in the local tables are sent to the ICD API (codeinfo + linearization),
+  concurrently
+- Results and API responses are kept in a persistent cache (see icd_cache.py). Results are keyed by
+  release and a hash of the loaded stem and postcoordination tables, so a table reload is not served
+  stale results; results of codes whose API lookup failed are not cached and are looked up again
+
+With --status, the pending rows of analytics.lab_review_icd11_mapping are validated and the results
+are written in bulk to analytics.lab_review_icd11_mapping_qa (one row per mapping id).
+
+Usage:
+python icd_code_validator.py --status=PENDING --cache=./assets/icd_cache.sqlite
+python icd_code_validator.py --codes 1C11.0 1C11 "2C25.0&XH7SM1"
+
+CLI arguments:
+--status: Validate the mappings of analytics.lab_review_icd11_mapping with this review_status
+--codes: Codes to validate (printed, not written to the database)
+--cache: SQLite cache file for API responses and validation results (default: ./assets/icd_cache.sqlite)
+--api-url: ICD API base URL (default: $ICD_API_URL or http://icdapi)
+--release: ICD-11 release (default: $ICD_RELEASE or 2025-01)
+--concurrency: Maximum number of concurrent API requests (default: 30)
+'''
+
+import argparse
+import asyncio
+import hashlib
+import json
+import time
+
+from sqlalchemy import text
+
+from icd_api import ICD_API_URL, ICD_RELEASE, extract_entity_path, get_json, linearization_url, make_async_client
+from icd_cache import ICDCache
+from icd_db import execute_in_batches, get_engine
+
+QA_TABLE = "analytics.lab_review_icd11_mapping_qa"
+
+
+def parse_cluster(code):
+    """
+    Split a cluster code into (stem, [extensions]) groups.
+
+    '2C25.0&XH7SM1/1C11.0&XK8G' -> [('2C25.0', ['XH7SM1']), ('1C11.0', ['XK8G'])]
+    """
+    groups = []
+    for group in code.split("/"):
+        parts = [part.strip() for part in group.split("&") if part.strip()]
+        if parts:
+            groups.append((parts[0], parts[1:]))
+    return groups
+
+
+class CodeValidator:
+    """Validates batches of ICD-11 codes against local tables, with an API fallback for unknown codes."""
+
+    def __init__(self, stems, postcoordination, cache=None, api_url=ICD_API_URL, release=ICD_RELEASE, concurrency=30):
+        """
+        Args:
+            stems: Dictionary code -> (icd11_mms_en id, is_leaf)
+            postcoordination: Dictionary icd11_mms_en id -> {allowed code: required}
+            cache: Optional ICDCache for API responses and validation results
+        """
+        self.stems = stems
+        self.postcoordination = postcoordination
+        self.cache = cache if cache is not None else ICDCache()
+        self.api_url = api_url
+        self.release = release
+        self.concurrency = concurrency
+        self.api_requests = 0
+        # Cached results are only valid for the tables they were validated against
+        self.tables_version = hashlib.sha1(json.dumps(
+            [sorted(stems.items()), sorted((stem_id, sorted(allowed.items())) for stem_id, allowed in postcoordination.items())],
+            default=str
+        ).encode("utf-8")).hexdigest()[:12]
+
+    @classmethod
+    def from_database(cls, engine, **kwargs):
+        """Load stems and postcoordination options from analytics.icd11_mms_en(_postcoordination)."""
+        with engine.connect() as conn:
+            stems = {
+                row.code: (row.id, bool(row.is_leaf))
+                for row in conn.execute(text("SELECT id, code, is_leaf FROM analytics.icd11_mms_en WHERE code IS NOT NULL AND code <> ''"))
+            }
+            postcoordination = {}
+            for row in conn.execute(text("SELECT icd11_mms_en_id, code, required FROM analytics.icd11_mms_en_postcoordination")):
+                postcoordination.setdefault(row.icd11_mms_en_id, {})[row.code] = bool(row.required)
+        return cls(stems, postcoordination, **kwargs)
+
+    def _cache_key(self, code):
+        return f"{self.release}:{self.tables_version}:{code}"
+
+    async def _lookup_remote(self, codes):
+        """
+        codeinfo + linearization for codes that are not in the local tables.
+
+        Returns:
+            Tuple of ({code: is_leaf, or None if the code is unknown}, set of codes whose lookup failed)
+        """
+        urls = {code: linearization_url(f"codeinfo/{code}", self.api_url, self.release) for code in codes}
+        responses = self.cache.get_many("api", urls.values())
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async with make_async_client(self.concurrency) as client:
+            async def fetch(url):
+                if url not in responses:
+                    async with semaphore:
+                        self.api_requests += 1
+                        responses[url] = await get_json(client, url)
+                    self.cache.put("api", url, responses[url])
+                return responses[url]
+
+            codeinfo = await asyncio.gather(*[fetch(urls[code]) for code in codes], return_exceptions=True)
+            failed = {code for code, info in zip(codes, codeinfo) if isinstance(info, Exception)}
+            stem_urls = {}
+            for code, info in zip(codes, codeinfo):
+                if isinstance(info, dict) and info.get("stemId"):
+                    stem_urls[code] = linearization_url(extract_entity_path(info["stemId"]), self.api_url, self.release)
+            entities = await asyncio.gather(*[fetch(url) for url in stem_urls.values()], return_exceptions=True)
+
+        found = {code: None for code in codes}
+        for code, entity in zip(stem_urls, entities):
+            if isinstance(entity, dict):
+                found[code] = not entity.get("child")
+            elif isinstance(entity, Exception):
+                failed.add(code)
+        return found, failed
+
+    def _validate_cluster(self, code, remote, failed=()):
+        errors, warnings, source = [], [], "local"
+        groups = parse_cluster(code)
+        if not groups:
+            errors.append("Empty code.")
+        for stem, extensions in groups:
+            if stem.startswith("X"):
+                errors.append(f"Extension {stem} used without a stem code.")
+                continue
+            if stem in self.stems:
+                stem_id, is_leaf = self.stems[stem]
+            elif remote.get(stem) is not None:
+                stem_id, is_leaf, source = None, remote[stem], "api"
+            elif stem in failed:
+                errors.append(f"Stem {stem}: not in the local tables and the ICD API lookup failed.")
+                continue
+            else:
+                errors.append(f"Stem {stem}: unknown code.")
+                continue
+            if not is_leaf:
+                errors.append(f"Stem {stem}: Not terminal (has children).")
+
+            if stem_id is None:
+                if extensions:
+                    warnings.append(f"Stem {stem}: extensions not checked (no local postcoordination data).")
+                continue
+            allowed = self.postcoordination.get(stem_id, {})
+            for extension in extensions:
+                if extension not in allowed:
+                    errors.append(f"Extension {extension} not allowed for {stem}.")
+            if any(allowed.values()) and not any(allowed.get(extension) for extension in extensions):
+                errors.append(f"Stem {stem}: requires postcoordination.")
+        return {"code": code, "valid": not errors, "errors": errors, "warnings": warnings, "source": source}
+
+    def validate(self, codes):
+        """
+        Validate a batch of codes (duplicates are validated once).
+
+        Returns:
+            Dictionary code -> {"code", "valid", "errors", "warnings", "source"}
+        """
+        unique_codes = list(dict.fromkeys(code.strip() for code in codes if code and code.strip()))
+        cached = self.cache.get_many("validation", [self._cache_key(code) for code in unique_codes])
+        results = {code: cached[self._cache_key(code)] for code in unique_codes if self._cache_key(code) in cached}
+        pending = [code for code in unique_codes if code not in results]
+
+        unknown_stems = list(dict.fromkeys(
+            stem for code in pending for stem, _ in parse_cluster(code)
+            if stem not in self.stems and not stem.startswith("X")
+        ))
+        remote, failed = asyncio.run(self._lookup_remote(unknown_stems)) if unknown_stems else ({}, set())
+
+        new_results = {code: self._validate_cluster(code, remote, failed) for code in pending}
+        # A failed lookup is not a verdict on the code: validate it again next time
+        self.cache.put_many("validation", {
+            self._cache_key(code): result for code, result in new_results.items()
+            if not any(stem in failed for stem, _ in parse_cluster(code))
+        })
+        results.update(new_results)
+        return {code.strip(): results[code.strip()] for code in codes if code and code.strip()}
+
+
+def write_results(engine, rows, results):
+    """Bulk upsert the QA result of every mapping row into the QA companion table."""
+    with engine.begin() as conn:
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {QA_TABLE} (
+                mapping_id INT NOT NULL,
+                icd11_code VARCHAR(255) NOT NULL,
+                valid TINYINT(1) NOT NULL,
+                errors TEXT NULL,
+                warnings TEXT NULL,
+                source VARCHAR(10) NOT NULL,
+                validated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                PRIMARY KEY (mapping_id)
+            )
+        """))
+        records = [
+            {
+                "mapping_id": row['id'],
+                "icd11_code": row['icd11_code'],
+                "valid": int(result['valid']),
+                "errors": "; ".join(result['errors']) or None,
+                "warnings": "; ".join(result['warnings']) or None,
+                "source": result['source'],
+            }
+            for row in rows
+            for result in [results.get((row['icd11_code'] or "").strip())]
+            if result is not None
+        ]
+        return execute_in_batches(conn, text(f"""
+            INSERT INTO {QA_TABLE} (mapping_id, icd11_code, valid, errors, warnings, source)
+            VALUES (:mapping_id, :icd11_code, :valid, :errors, :warnings, :source)
+            ON DUPLICATE KEY UPDATE icd11_code = VALUES(icd11_code), valid = VALUES(valid), errors = VALUES(errors),
+                warnings = VALUES(warnings), source = VALUES(source)
+        """), records)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='icd_code_validator.py', description='Validate proposed ICD-11 codes in batch')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--status', help="Validate the mappings of analytics.lab_review_icd11_mapping with this review_status")
+    source.add_argument('--codes', nargs='+', help="Codes to validate")
+    parser.add_argument('--cache', default="./assets/icd_cache.sqlite", help="SQLite cache file")
+    parser.add_argument('--api-url', default=ICD_API_URL, help="ICD API base URL")
+    parser.add_argument('--release', default=ICD_RELEASE, help="ICD-11 release")
+    parser.add_argument('--concurrency', type=int, default=30, help="Maximum number of concurrent API requests")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    engine = get_engine()
+    validator = CodeValidator.from_database(
+        engine, cache=ICDCache(args.cache), api_url=args.api_url, release=args.release, concurrency=args.concurrency
+    )
+
+    if args.codes:
+        rows = [{"id": None, "icd11_code": code} for code in args.codes]
+    else:
+        with engine.connect() as conn:
+            rows = conn.execute(
+                text("SELECT id, concept_id, icd11_code FROM analytics.lab_review_icd11_mapping WHERE review_status = :status"),
+                {"status": args.status}
+            ).mappings().all()
+
+    results = validator.validate([row['icd11_code'] or "" for row in rows])
+    errors = [result for result in results.values() if not result['valid']]
+
+    if args.status:
+        written = write_results(engine, rows, results)
+        print(f"QA results for {written} mappings written to {QA_TABLE}")
+    if errors:
+        print(f"QA completed with {len(errors)} invalid codes:")
+        for result in errors:
+            print(f"• {result['code']}: {' '.join(result['errors'])}")
+    else:
+        print("QA completed. No errors.")
+    print(f"{len(rows)} mappings, {len(results)} unique codes, {validator.api_requests} API requests, "
+          f"cache {validator.cache.stats()}, {round(time.time() - start_time, 2)} sec")
+
+
+if __name__ == "__main__":
+    main()
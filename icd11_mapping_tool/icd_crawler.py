@@ -0,0 +1,245 @@
+'''
+Async, resumable crawler for the ICD-11 foundation hierarchy.
+
+Walks the ICD entities breadth-first from the root entity through the local ICD API container
+and streams the flat hierarchy (one row per entity/parent pair) to a CSV file with the columns
+entity_id, code, title, parent_entity_id, parent_code - the same format as the
+icd_flat_hierarchy.csv produced by the Phase 3.1 notebook.
+
+Requests run concurrently over a pooled connection, capped by --concurrency. The frontier, the
+set of crawled entities and the entity -> code lookups are checkpointed to a state file together
+with the output file size, so an interrupted crawl resumes where it stopped (the output is
+truncated back to the last checkpoint, so no rows are duplicated).
+
+An entity whose request (or the code lookup of the entity or one of its parents) fails is put back
+in the frontier and retried up to --max-attempts times; no rows are written for it until it succeeds.
+Entities that still fail are listed under "failed" in the state file and retried by --resume.
+
+Usage:
+python icd_crawler.py -o=./assets/icd_flat_hierarchy.csv --state=./assets/icd_crawl_state.json
+python icd_crawler.py -o=./assets/icd_flat_hierarchy.csv --state=./assets/icd_crawl_state.json --resume
+
+CLI arguments:
+-o, --outputfile: Output CSV file for the flat hierarchy
+--state: Checkpoint file used to resume the crawl (default: <outputfile>.state.json)
+--resume: Resume from the checkpoint instead of starting a new crawl
+--root: Entity ID to start from (default: 448895267, the ICD Entities root)
+--api-url: ICD API base URL (default: $ICD_API_URL or http://icdapi)
+--release: ICD-11 release used to look up MMS codes (default: $ICD_RELEASE or 2025-01)
+--concurrency: Maximum number of concurrent requests (default: 30)
+--checkpoint-every: Number of crawled entities between checkpoints (default: 500)
+--max-attempts: Attempts per entity before it is recorded as failed (default: 3)
+'''
+
+import argparse
+import asyncio
+import csv
+import json
+import os
+import time
+from collections import deque
+
+from tqdm import tqdm
+
+from icd_api import (ICD_API_URL, ICD_RELEASE, ROOT_ENTITY_ID, entity_url, extract_entity_id, get_json,
+                     linearization_url, make_async_client)
+
+COLUMNS = ["entity_id", "code", "title", "parent_entity_id", "parent_code"]
+
+
+class HierarchyCrawler:
+    """Breadth-first crawler with a checkpointed frontier."""
+
+    def __init__(self, output_filename, state_filename, api_url=ICD_API_URL, release=ICD_RELEASE,
+                 concurrency=30, checkpoint_every=500, max_attempts=3):
+        self.output_filename = output_filename
+        self.state_filename = state_filename
+        self.api_url = api_url
+        self.release = release
+        self.concurrency = concurrency
+        self.checkpoint_every = checkpoint_every
+        self.max_attempts = max_attempts
+
+        self.pending = deque()
+        self.in_flight = set()
+        self.seen = set()
+        self.done = set()
+        self.codes = {}
+        self.code_requests = {}
+        self.attempts = {}
+        self.failed = {}  # entity_id -> last error, after max_attempts
+        self.num_rows = 0
+        self.num_errors = 0
+
+    def load_state(self):
+        """Restore the crawl from the state file and truncate the output to the checkpointed size."""
+        with open(self.state_filename, 'r') as f:
+            state = json.load(f)
+        # Entities that failed in the previous run are retried with a fresh set of attempts
+        self.pending = deque(state["frontier"] + list(state.get("failed", {})))
+        self.done = set(state["done"])
+        self.seen = self.done | set(self.pending)
+        self.codes = state["codes"]
+        self.num_rows = state["num_rows"]
+        self.num_errors = state.get("num_errors", 0)
+        with open(self.output_filename, 'r+b') as f:
+            f.truncate(state["output_size"])
+
+    def save_state(self, output_file):
+        """Atomically write the frontier (queued and in-flight entities) and the output size."""
+        output_file.flush()
+        state = {
+            "frontier": list(self.in_flight) + list(self.pending),
+            "done": list(self.done),
+            "failed": self.failed,
+            "codes": self.codes,
+            "num_rows": self.num_rows,
+            "num_errors": self.num_errors,
+            "output_size": output_file.tell(),
+            "api_url": self.api_url,
+            "release": self.release,
+            "timestamp": time.time()
+        }
+        tmp_filename = self.state_filename + ".tmp"
+        with open(tmp_filename, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_filename, self.state_filename)
+
+    async def get_code(self, client, entity_id):
+        """
+        MMS code of an entity ('' if it is not in the linearization), fetched once per entity.
+
+        Raises the request error if the lookup failed, so no row is written with a code that could
+        not be fetched; the failed lookup is not cached and is requested again on the next attempt.
+        """
+        if entity_id in self.codes:
+            return self.codes[entity_id]
+        if entity_id not in self.code_requests:
+            self.code_requests[entity_id] = asyncio.ensure_future(
+                get_json(client, linearization_url(entity_id, self.api_url, self.release)))
+        request = self.code_requests[entity_id]
+        try:
+            data = await request
+        except Exception:
+            if self.code_requests.get(entity_id) is request:
+                del self.code_requests[entity_id]
+            raise
+        self.codes[entity_id] = (data or {}).get("code", "")
+        self.code_requests.pop(entity_id, None)
+        return self.codes[entity_id]
+
+    async def crawl_entity(self, client, entity_id):
+        """Fetch one entity; returns its hierarchy rows and child entity IDs."""
+        data = await get_json(client, entity_url(entity_id, self.api_url))
+        if data is None:
+            return [], []
+        entity_id_str = extract_entity_id(data.get("@id", "")) or entity_id
+        title = data.get("title", {}).get("@value", "")
+        parent_ids = [extract_entity_id(parent_url) for parent_url in data.get("parent", [])]
+        codes = await asyncio.gather(self.get_code(client, entity_id_str),
+                                     *[self.get_code(client, parent_id) for parent_id in parent_ids])
+
+        if not parent_ids:
+            rows = [[entity_id_str, codes[0], title, "", ""]]
+        else:
+            rows = [[entity_id_str, codes[0], title, parent_id, parent_code]
+                    for parent_id, parent_code in zip(parent_ids, codes[1:])]
+        return rows, [extract_entity_id(child_url) for child_url in data.get("child", [])]
+
+    async def run(self, root=ROOT_ENTITY_ID, resume=False):
+        if resume:
+            self.load_state()
+        else:
+            self.pending.append(root)
+            self.seen.add(root)
+            with open(self.output_filename, 'w', newline='', encoding='utf-8') as f:
+                csv.writer(f).writerow(COLUMNS)
+
+        with open(self.output_filename, 'a', newline='', encoding='utf-8') as output_file:
+            writer = csv.writer(output_file)
+            progress = tqdm(total=len(self.done) + len(self.pending), initial=len(self.done),
+                            desc="Crawling ICD hierarchy", unit="entities")
+            since_checkpoint = 0
+
+            async with make_async_client(self.concurrency) as client:
+                tasks = {}
+                while self.pending or tasks:
+                    # Keep up to `concurrency` entities in flight, in BFS order
+                    while self.pending and len(tasks) < self.concurrency:
+                        entity_id = self.pending.popleft()
+                        self.in_flight.add(entity_id)
+                        tasks[asyncio.ensure_future(self.crawl_entity(client, entity_id))] = entity_id
+
+                    finished, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                    for task in finished:
+                        entity_id = tasks.pop(task)
+                        self.in_flight.discard(entity_id)
+                        try:
+                            rows, children = task.result()
+                        except Exception as e:
+                            # Retry the entity later; its subtree is only reached through its children
+                            self.num_errors += 1
+                            self.attempts[entity_id] = self.attempts.get(entity_id, 0) + 1
+                            if self.attempts[entity_id] < self.max_attempts:
+                                self.pending.append(entity_id)
+                            else:
+                                self.failed[entity_id] = str(e) or type(e).__name__
+                                progress.update(1)
+                            continue
+                        self.failed.pop(entity_id, None)
+                        writer.writerows(rows)
+                        self.num_rows += len(rows)
+                        self.done.add(entity_id)
+                        for child_id in children:
+                            if child_id not in self.seen:
+                                self.seen.add(child_id)
+                                self.pending.append(child_id)
+                                progress.total += 1
+                        progress.update(1)
+                        since_checkpoint += 1
+
+                    if since_checkpoint >= self.checkpoint_every:
+                        self.save_state(output_file)
+                        since_checkpoint = 0
+
+            self.save_state(output_file)
+            progress.close()
+
+        return {"entities": len(self.done), "rows": self.num_rows, "errors": self.num_errors,
+                "failed": len(self.failed)}
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='icd_crawler.py', description='Crawl the ICD-11 foundation hierarchy into a flat CSV')
+    parser.add_argument('-o', '--outputfile', required=True, help="Output CSV file for the flat hierarchy")
+    parser.add_argument('--state', help="Checkpoint file used to resume the crawl (default: <outputfile>.state.json)")
+    parser.add_argument('--resume', action='store_true', help="Resume from the checkpoint instead of starting a new crawl")
+    parser.add_argument('--root', default=ROOT_ENTITY_ID, help="Entity ID to start from")
+    parser.add_argument('--api-url', default=ICD_API_URL, help="ICD API base URL")
+    parser.add_argument('--release', default=ICD_RELEASE, help="ICD-11 release used to look up MMS codes")
+    parser.add_argument('--concurrency', type=int, default=30, help="Maximum number of concurrent requests")
+    parser.add_argument('--checkpoint-every', type=int, default=500, help="Number of crawled entities between checkpoints")
+    parser.add_argument('--max-attempts', type=int, default=3, help="Attempts per entity before it is recorded as failed")
+    args = parser.parse_args()
+
+    crawler = HierarchyCrawler(
+        args.outputfile,
+        args.state or args.outputfile + ".state.json",
+        api_url=args.api_url,
+        release=args.release,
+        concurrency=args.concurrency,
+        checkpoint_every=args.checkpoint_every,
+        max_attempts=args.max_attempts
+    )
+    start_time = time.time()
+    stats = asyncio.run(crawler.run(root=args.root, resume=args.resume))
+    elapsed_seconds = time.time() - start_time
+    print(f"✅ Crawled {stats['entities']} entities into {stats['rows']} rows "
+          f"({stats['errors']} errors) in {round(elapsed_seconds, 2)} sec")
+    if stats["failed"]:
+        print(f"  • {stats['failed']} entities failed {args.max_attempts} times and are listed under \"failed\" in "
+              f"{crawler.state_filename}; run again with --resume to retry them")
+
+
+if __name__ == "__main__":
+    main()
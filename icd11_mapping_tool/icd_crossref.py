@@ -0,0 +1,121 @@
+'''
+Batched ICD-10 -> ICD-11 cross-reference lookups with an in-process cache.
+
+icd10_to_icd11_crossref() in README.ipynb runs one query per ICD-10 code and only returns the first
+row of icd11_10To11MapToOneCategory. CrossReferenceResolver returns every target of both WHO tables
+(10To11MapToOneCategory and 10To11MapToMultipleCategories) with its ICD-11 class kind, either by
+loading both tables once into a dictionary (preload=True, best for whole value sets) or by
+answering each batch of codes with one IN (...) query per table. Every answer is kept in memory,
+so repeated codes never reach the database twice.
+
+Usage:
+from icd_crossref import CrossReferenceResolver
+from icd_db import get_engine
+
+resolver = CrossReferenceResolver(get_engine(), preload=True)
+targets = resolver.resolve(["A44.0", "J45.9"])   # {"A44.0": [CrossReference(...), ...], "J45.9": [...]}
+best = resolver.resolve_one("A44.0")              # first one-to-one target, as icd10_to_icd11_crossref()
+
+python icd_crossref.py A44.0 J45.9
+'''
+
+import argparse
+from collections import namedtuple
+
+from sqlalchemy import bindparam, text
+
+CrossReference = namedtuple("CrossReference", ["icd10Code", "icd11Code", "icd11Title", "classKind", "mapping"])
+
+# Table -> mapping kind; one-to-one targets are listed first
+CROSSREF_TABLES = {
+    "icd11_10To11MapToOneCategory": "one",
+    "icd11_10To11MapToMultipleCategories": "multiple",
+}
+
+
+class CrossReferenceResolver:
+    """Resolves ICD-10 codes to all their ICD-11 targets, in batches, with memoization."""
+
+    def __init__(self, engine, preload=False, batch_size=1000):
+        """
+        Args:
+            engine: SQLAlchemy engine for the database with the cross-reference tables
+            preload: Load both tables into memory at once instead of querying per batch
+            batch_size: Maximum number of codes per IN (...) query
+        """
+        self.engine = engine
+        self.batch_size = batch_size
+        self.cache = {}
+        self.queries = 0
+        self.preloaded = False
+        if preload:
+            self.preload()
+
+    def _select(self, table, codes=None):
+        sql = f"SELECT icd10Code, icd11Code, icd11Title, `11ClassKind` AS classKind FROM {table}"
+        if codes is None:
+            return text(sql), {}
+        return text(sql + " WHERE icd10Code IN :codes").bindparams(bindparam("codes", expanding=True)), {"codes": codes}
+
+    def _add_rows(self, found, rows, mapping):
+        for row in rows:
+            targets = found.setdefault(row.icd10Code, [])
+            if row.icd11Code and all(target.icd11Code != row.icd11Code for target in targets):
+                targets.append(CrossReference(row.icd10Code, row.icd11Code, row.icd11Title, row.classKind, mapping))
+
+    def preload(self):
+        """Load every cross-reference into memory (one query per table)."""
+        found = {}
+        with self.engine.connect() as conn:
+            for table, mapping in CROSSREF_TABLES.items():
+                statement, params = self._select(table)
+                self._add_rows(found, conn.execute(statement, params), mapping)
+                self.queries += 1
+        self.cache = found
+        self.preloaded = True
+
+    def resolve(self, icd10_codes):
+        """
+        All ICD-11 targets of each ICD-10 code (one-to-one first, then one-to-many).
+
+        Returns:
+            Dictionary ICD-10 code -> list of CrossReference (empty when there is no cross-reference)
+        """
+        codes = list(dict.fromkeys(code.strip() for code in icd10_codes if code and code.strip()))
+        missing = [] if self.preloaded else [code for code in codes if code not in self.cache]
+        if missing:
+            found = {}
+            with self.engine.connect() as conn:
+                for table, mapping in CROSSREF_TABLES.items():
+                    for start in range(0, len(missing), self.batch_size):
+                        statement, params = self._select(table, missing[start:start + self.batch_size])
+                        self._add_rows(found, conn.execute(statement, params), mapping)
+                        self.queries += 1
+            for code in missing:
+                self.cache[code] = found.get(code, [])
+        return {code: self.cache.get(code, []) for code in codes}
+
+    def resolve_one(self, icd10_code):
+        """First target of an ICD-10 code, or None."""
+        targets = self.resolve([icd10_code]).get(icd10_code.strip(), [])
+        return targets[0] if targets else None
+
+
+def main():
+    from icd_db import get_engine
+
+    parser = argparse.ArgumentParser(prog='icd_crossref.py', description='Resolve ICD-10 codes to ICD-11')
+    parser.add_argument('codes', nargs='+', help="ICD-10 codes")
+    parser.add_argument('--preload', action='store_true', help="Load both cross-reference tables into memory first")
+    args = parser.parse_args()
+
+    resolver = CrossReferenceResolver(get_engine(), preload=args.preload)
+    for icd10_code, targets in resolver.resolve(args.codes).items():
+        if not targets:
+            print(f"⚠️ {icd10_code}: No cross-reference found.")
+        for target in targets:
+            print(f"🔁 {icd10_code} → {target.icd11Code} - {target.icd11Title} ({target.classKind}, {target.mapping})")
+
+
+if __name__ == "__main__":
+    main()
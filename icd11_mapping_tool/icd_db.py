@@ -0,0 +1,36 @@
+'''
+Database connection settings for the ICD-11 mapping tools.
+
+Reads DB_USER, DB_PASS, DB_HOST, DB_PORT and DB_NAME from the environment (or a .env file), with the
+same defaults as the devcontainer.
+'''
+
+import os
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine
+
+load_dotenv()
+
+DB_USER = os.getenv("DB_USER", "root")
+DB_PASS = os.getenv("DB_PASS", "root")
+DB_HOST = os.getenv("DB_HOST", "db-sandbox")
+DB_PORT = os.getenv("DB_PORT", 3306)
+DB_NAME = os.getenv("DB_NAME", "sandbox")
+
+
+def get_database_url(database=None):
+    return f"mysql+pymysql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{database or DB_NAME}"
+
+
+def get_engine(database=None, **kwargs):
+    """SQLAlchemy engine for the mapping database (extra kwargs are passed to create_engine)."""
+    kwargs.setdefault("pool_pre_ping", True)
+    return create_engine(get_database_url(database), **kwargs)
+
+
+def execute_in_batches(conn, statement, records, batch_size=5000):
+    """Run an executemany-style statement over records in batches; returns the number of records."""
+    for start in range(0, len(records), batch_size):
+        conn.execute(statement, records[start:start + batch_size])
+    return len(records)
@@ -0,0 +1,399 @@
+'''
+Compact in-memory index of the ICD-11 hierarchy for leaf / ancestor / descendant queries.
+
+The index is built once from icd_flat_hierarchy.csv (see icd_crawler.py) or from the WHO
+SimpleTabulation file, saved as a single .npz file and loaded in milliseconds. Everything is
+stored in numpy arrays indexed by node number:
+- Parent/child tables in CSR form (every parent of multi-parent foundation entities is kept)
+- Primary parent (first listed parent), depth and a leaf bitmap
+- Euler-tour intervals of the primary tree, so "is A an ancestor of B" is O(1) and the
+  descendants of a node are one contiguous slice
+- A binary-lifting table for lowest common ancestor queries in O(log n)
+
+Nodes can be looked up by entity ID (or linearization path such as '927970860/unspecified') or by
+ICD-11 code, and most queries take a whole batch at once, e.g. checking that 27k proposed codes are
+terminal is a dictionary lookup and an array index.
+
+Usage:
+python icd_hierarchy_index.py --flat=./assets/icd_flat_hierarchy.csv -o=./assets/icd_hierarchy_index.npz
+python icd_hierarchy_index.py --tabulation=./SimpleTabulation-ICD-11-MMS-en.xlsx -o=./assets/icd_mms_index.npz
+python icd_hierarchy_index.py --index=./assets/icd_mms_index.npz --codes 1C11.0 1C11 XA0060
+
+from icd_hierarchy_index import ICDHierarchyIndex
+
+index = ICDHierarchyIndex.load("./assets/icd_mms_index.npz")
+terminal = index.is_leaf(["1C11.0", "1C11"])     # array([ True, False])
+index.ancestors("1C11.0", as_codes=True)         # ['1C11', '1C1', '01']
+
+CLI arguments:
+--flat: Flat hierarchy CSV (entity_id, code, title, parent_entity_id, parent_code)
+--tabulation: SimpleTabulation-ICD-11-MMS-en .xlsx or .txt file
+--index: Previously saved index (.npz)
+-o, --outputfile: Save the index to this .npz file
+--codes: Codes or entity IDs to look up in the index
+'''
+
+import argparse
+import re
+import time
+
+import numpy as np
+import pandas as pd
+
+
+class ICDHierarchyIndex:
+    """Array-backed ICD-11 hierarchy with O(1) leaf/ancestor tests and O(log n) LCA."""
+
+    def __init__(self, entity_ids, codes, titles, parent_ptr, parent_idx, leaf=None):
+        """
+        Args:
+            entity_ids: Entity ID (or linearization path) of each node
+            codes: ICD-11 code of each node ('' when the entity has no code)
+            titles: Title of each node
+            parent_ptr, parent_idx: CSR parent table; the parents of node i are
+                parent_idx[parent_ptr[i]:parent_ptr[i + 1]], the first one being the primary parent
+            leaf: Optional leaf flags (e.g. isLeaf from SimpleTabulation); defaults to "has no children"
+        """
+        self.entity_ids = np.asarray(entity_ids, dtype=str)
+        self.codes = np.asarray(codes, dtype=str)
+        self.titles = np.asarray(titles, dtype=str)
+        self.parent_ptr = np.asarray(parent_ptr, dtype=np.int64)
+        self.parent_idx = np.asarray(parent_idx, dtype=np.int32)
+        n = len(self.entity_ids)
+
+        # Child table: the parent table transposed
+        child_of = np.repeat(np.arange(n, dtype=np.int32), np.diff(self.parent_ptr))
+        order = np.argsort(self.parent_idx, kind="stable")
+        self.child_idx = child_of[order]
+        self.child_ptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.parent_idx, minlength=n), out=self.child_ptr[1:])
+
+        has_parent = np.diff(self.parent_ptr) > 0
+        self.parent = np.full(n, -1, dtype=np.int32)
+        self.parent[has_parent] = self.parent_idx[self.parent_ptr[:-1][has_parent]]
+        self.leaf = np.diff(self.child_ptr) == 0 if leaf is None else np.asarray(leaf, dtype=bool)
+
+        self._build_tree()
+        self._build_lookup()
+
+    def _build_tree(self):
+        """Depth, Euler-tour intervals and binary-lifting table of the primary tree."""
+        n = len(self.parent)
+        children_of = [[] for _ in range(n)]
+        for node, parent in enumerate(self.parent.tolist()):
+            if parent >= 0:
+                children_of[parent].append(node)
+
+        self.depth = np.zeros(n, dtype=np.int32)
+        self.tin = np.zeros(n, dtype=np.int32)
+        self.tout = np.zeros(n, dtype=np.int32)
+        self.euler_order = np.zeros(n, dtype=np.int32)
+        depth, tin, tout, euler_order = [0] * n, [0] * n, [0] * n, [0] * n
+        timer = 0
+        for root in np.flatnonzero(self.parent < 0).tolist():
+            stack = [(root, False)]
+            while stack:
+                node, exiting = stack.pop()
+                if exiting:
+                    tout[node] = timer
+                    continue
+                tin[node] = timer
+                euler_order[timer] = node
+                timer += 1
+                stack.append((node, True))
+                for child in reversed(children_of[node]):
+                    depth[child] = depth[node] + 1
+                    stack.append((child, False))
+        if timer != n:
+            raise ValueError("The primary parent table contains a cycle")
+        self.depth[:], self.tin[:], self.tout[:], self.euler_order[:] = depth, tin, tout, euler_order
+
+        levels = max(1, int(self.depth.max(initial=0)).bit_length())
+        self.up = np.empty((levels, n), dtype=np.int32)
+        self.up[0] = np.where(self.parent < 0, np.arange(n), self.parent)
+        for k in range(1, levels):
+            self.up[k] = self.up[k - 1][self.up[k - 1]]
+
+    def _build_lookup(self):
+        self.entity_lookup = {entity_id: i for i, entity_id in enumerate(self.entity_ids.tolist())}
+        self.code_lookup = {}
+        for i, code in enumerate(self.codes.tolist()):
+            if code and code not in self.code_lookup:
+                self.code_lookup[code] = i
+
+    def __len__(self):
+        return len(self.entity_ids)
+
+    # ----- Building -----
+
+    @classmethod
+    def from_edges(cls, nodes, edges, leaf=None):
+        """
+        Build from node records and (child entity ID, parent entity ID) edges.
+
+        Args:
+            nodes: Dictionary entity ID -> (code, title), in the order nodes should be numbered
+            edges: Iterable of (child, parent) pairs; the first pair of a child gives its primary parent
+            leaf: Optional dictionary entity ID -> leaf flag
+        """
+        nodes = dict(nodes)
+        parents = {}
+        for child, parent in edges:
+            for entity_id in (child, parent):
+                nodes.setdefault(entity_id, ("", ""))
+            if parent not in parents.setdefault(child, []):
+                parents[child].append(parent)
+
+        entity_ids = list(nodes)
+        position = {entity_id: i for i, entity_id in enumerate(entity_ids)}
+        counts = [len(parents.get(entity_id, [])) for entity_id in entity_ids]
+        parent_ptr = np.zeros(len(entity_ids) + 1, dtype=np.int64)
+        np.cumsum(counts, out=parent_ptr[1:])
+        parent_idx = [position[parent] for entity_id in entity_ids for parent in parents.get(entity_id, [])]
+
+        return cls(
+            entity_ids,
+            [nodes[entity_id][0] for entity_id in entity_ids],
+            [nodes[entity_id][1] for entity_id in entity_ids],
+            parent_ptr,
+            np.asarray(parent_idx, dtype=np.int32),
+            leaf=None if leaf is None else [bool(leaf.get(entity_id, True)) for entity_id in entity_ids]
+        )
+
+    @classmethod
+    def from_flat_hierarchy(cls, filename):
+        """Build from icd_flat_hierarchy.csv (one row per entity/parent pair)."""
+        flat = pd.read_csv(filename, dtype=str).fillna("")
+        nodes = {}
+        for entity_id, code, title in zip(flat['entity_id'], flat['code'], flat['title']):
+            nodes.setdefault(entity_id, (code, title))
+        for parent_id, parent_code in zip(flat['parent_entity_id'], flat['parent_code']):
+            if parent_id and parent_id not in nodes:
+                nodes[parent_id] = (parent_code, "")
+        edges = [(child, parent) for child, parent in zip(flat['entity_id'], flat['parent_entity_id']) if parent]
+        return cls.from_edges(nodes, edges)
+
+    @classmethod
+    def from_simple_tabulation(cls, filename):
+        """
+        Build the MMS tree from the WHO SimpleTabulation file (.xlsx or tab-separated .txt).
+
+        Rows are in hierarchical order and the depth of each row is the number of leading dashes of
+        its title, so every row's parent is the closest previous row one level up. Nodes are keyed by
+        the linearization path (e.g. '1673130746' or '927970860/unspecified').
+        """
+        if str(filename).endswith((".xlsx", ".xls")):
+            tab = pd.read_excel(filename, dtype=str)
+        else:
+            tab = pd.read_csv(filename, sep="\t", dtype=str)
+        tab = tab.fillna("")
+
+        nodes, edges, leaf = {}, [], {}
+        stack = []
+        for uri, code, title, is_leaf in zip(tab['Linearization URI'], tab['Code'], tab['Title'], tab['isLeaf']):
+            entity_path = uri.split("/mms/")[-1]
+            prefix = re.match(r'^([-]\s*)*', title).group(0)
+            depth = prefix.count("-")
+            nodes[entity_path] = (code, title[len(prefix):].strip())
+            leaf[entity_path] = is_leaf.strip().lower() == "true"
+            del stack[depth:]
+            if stack:
+                edges.append((entity_path, stack[-1]))
+            stack.append(entity_path)
+        return cls.from_edges(nodes, edges, leaf=leaf)
+
+    def save(self, filename):
+        np.savez_compressed(
+            filename,
+            entity_ids=self.entity_ids, codes=self.codes, titles=self.titles,
+            parent_ptr=self.parent_ptr, parent_idx=self.parent_idx, leaf=self.leaf,
+            child_ptr=self.child_ptr, child_idx=self.child_idx, parent=self.parent,
+            depth=self.depth, tin=self.tin, tout=self.tout, euler_order=self.euler_order, up=self.up
+        )
+
+    @classmethod
+    def load(cls, filename):
+        """Load a saved index without recomputing the tree arrays."""
+        data = np.load(filename)
+        index = cls.__new__(cls)
+        for name in data.files:
+            setattr(index, name, data[name])
+        index._build_lookup()
+        return index
+
+    # ----- Lookup -----
+
+    def node(self, key):
+        """Node number of an entity ID, linearization path or code (-1 if unknown)."""
+        if isinstance(key, (int, np.integer)):
+            return int(key)
+        node = self.entity_lookup.get(key)
+        return self.code_lookup.get(key, -1) if node is None else node
+
+    def nodes(self, keys):
+        """Node numbers of a batch of keys (-1 where unknown)."""
+        if isinstance(keys, np.ndarray) and keys.dtype.kind in "iu":
+            return keys
+        if isinstance(keys, (str, int, np.integer)):
+            return np.asarray(self.node(keys))
+        return np.fromiter((self.node(key) for key in keys), dtype=np.int64, count=len(keys))
+
+    def contains(self, keys):
+        return self.nodes(keys) >= 0
+
+    def _labels(self, nodes, as_codes):
+        return (self.codes if as_codes else self.entity_ids)[nodes].tolist()
+
+    # ----- Queries -----
+
+    def is_leaf(self, keys):
+        """Leaf flags for a batch of keys (False for unknown keys)."""
+        nodes = self.nodes(keys)
+        return (nodes >= 0) & self.leaf[np.maximum(nodes, 0)]
+
+    def children(self, key, as_codes=False):
+        node = self.node(key)
+        if node < 0:
+            return []
+        return self._labels(self.child_idx[self.child_ptr[node]:self.child_ptr[node + 1]], as_codes)
+
+    def parents(self, key, as_codes=False):
+        node = self.node(key)
+        if node < 0:
+            return []
+        return self._labels(self.parent_idx[self.parent_ptr[node]:self.parent_ptr[node + 1]], as_codes)
+
+    def ancestors(self, key, all_parents=False, as_codes=False):
+        """
+        Ancestors from the closest to the root.
+
+        By default only the primary-parent chain (O(depth)); with all_parents=True every ancestor
+        through any parent of multi-parent entities.
+        """
+        node = self.node(key)
+        if node < 0:
+            return []
+        if not all_parents:
+            chain = []
+            node = self.parent[node]
+            while node >= 0:
+                chain.append(node)
+                node = self.parent[node]
+            return self._labels(np.asarray(chain, dtype=np.int64), as_codes)
+        return self._labels(self._closure(node, self.parent_ptr, self.parent_idx), as_codes)
+
+    def descendants(self, key, all_parents=False, leaves_only=False, as_codes=False):
+        """
+        Descendants in pre-order.
+
+        By default the primary tree, returned as one slice of the Euler tour; with all_parents=True
+        also the descendants reached through secondary parents.
+        """
+        node = self.node(key)
+        if node < 0:
+            return []
+        if all_parents:
+            nodes = self._closure(node, self.child_ptr, self.child_idx)
+        else:
+            nodes = self.euler_order[self.tin[node] + 1:self.tout[node]]
+        if leaves_only:
+            nodes = nodes[self.leaf[nodes]]
+        return self._labels(nodes, as_codes)
+
+    def leaf_descendants(self, key, as_codes=False):
+        """Terminal descendants through any parent (the node itself if it is a leaf)."""
+        node = self.node(key)
+        if node < 0:
+            return []
+        if self.leaf[node]:
+            return self._labels(np.asarray([node]), as_codes)
+        return self.descendants(node, all_parents=True, leaves_only=True, as_codes=as_codes)
+
+    @staticmethod
+    def _closure(node, ptr, idx):
+        """Nodes reachable from `node` in a CSR table, breadth-first."""
+        seen = {node}
+        frontier = [node]
+        reached = []
+        while frontier:
+            next_frontier = []
+            for current in frontier:
+                for other in idx[ptr[current]:ptr[current + 1]].tolist():
+                    if other not in seen:
+                        seen.add(other)
+                        reached.append(other)
+                        next_frontier.append(other)
+            frontier = next_frontier
+        return np.asarray(reached, dtype=np.int64)
+
+    def is_ancestor(self, ancestor_keys, descendant_keys):
+        """True where the first node is the second node or one of its primary-tree ancestors."""
+        u, v = self.nodes(ancestor_keys), self.nodes(descendant_keys)
+        known = (u >= 0) & (v >= 0)
+        u, v = np.maximum(u, 0), np.maximum(v, 0)
+        return known & (self.tin[u] <= self.tin[v]) & (self.tout[v] <= self.tout[u])
+
+    def lca(self, keys_a, keys_b, as_codes=False):
+        """
+        Lowest common ancestor in the primary tree, for single keys or batches.
+
+        Returns:
+            Node number(s) (-1 where the nodes are unknown or in different trees), or codes if as_codes
+        """
+        a, b = np.atleast_1d(self.nodes(keys_a)), np.atleast_1d(self.nodes(keys_b))
+        known = (a >= 0) & (b >= 0)
+        a, b = np.maximum(a, 0), np.maximum(b, 0)
+
+        # Lift a to the highest ancestor that is not an ancestor of b; its parent is the LCA
+        x = a.copy()
+        for k in reversed(range(len(self.up))):
+            lifted = self.up[k][x]
+            x = np.where(self.is_ancestor(lifted, b), x, lifted)
+        result = self.parent[x].astype(np.int64)
+        result = np.where(self.is_ancestor(b, a), b, result)
+        result = np.where(self.is_ancestor(a, b), a, result)
+        result = np.where(known, result, -1)
+
+        if as_codes:
+            result = [str(self.codes[node]) if node >= 0 else "" for node in result.tolist()]
+        if isinstance(keys_a, (str, int, np.integer)):
+            return result[0]
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='icd_hierarchy_index.py', description='Build and query the ICD-11 hierarchy index')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--flat', help="Flat hierarchy CSV (entity_id, code, title, parent_entity_id, parent_code)")
+    source.add_argument('--tabulation', help="SimpleTabulation-ICD-11-MMS-en .xlsx or .txt file")
+    source.add_argument('--index', help="Previously saved index (.npz)")
+    parser.add_argument('-o', '--outputfile', help="Save the index to this .npz file")
+    parser.add_argument('--codes', nargs='*', default=[], help="Codes or entity IDs to look up")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    if args.flat:
+        index = ICDHierarchyIndex.from_flat_hierarchy(args.flat)
+    elif args.tabulation:
+        index = ICDHierarchyIndex.from_simple_tabulation(args.tabulation)
+    else:
+        index = ICDHierarchyIndex.load(args.index)
+    print(f"Index with {len(index)} nodes ({int(index.leaf.sum())} leaves, max depth {int(index.depth.max(initial=0))}) "
+          f"ready in {round(time.time() - start_time, 3)} sec")
+
+    if args.outputfile:
+        index.save(args.outputfile)
+        print(f"✅ Index saved to: {args.outputfile}")
+
+    for key, is_leaf in zip(args.codes, index.is_leaf(args.codes)):
+        node = index.node(key)
+        if node < 0:
+            print(f"• {key}: not found")
+            continue
+        ancestors = " > ".join(code or entity_id for code, entity_id in
+                               zip(reversed(index.ancestors(node, as_codes=True)), reversed(index.ancestors(node))))
+        print(f"• {key}: {index.titles[node]} | {'terminal' if is_leaf else 'not terminal'} | {ancestors}")
+
+
+if __name__ == "__main__":
+    main()
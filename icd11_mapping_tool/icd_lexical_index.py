@@ -0,0 +1,291 @@
+'''
+Offline lexical search over ICD-11 titles, synonyms and index terms (BM25 + character trigrams).
+
+The index is built once from analytics.icd11_mms_en_name (every FSN and synonym of every
+icd11_mms_en entry) and saved as a single .npz file, so lexical candidate generation runs
+in-process without the ICD API container:
+- Names are tokenized into lowercase words and stored in an inverted index (CSR posting lists with
+  term frequencies), scored with BM25
+- Query words that are not in the vocabulary are expanded to the closest vocabulary words by
+  character trigram similarity, so misspellings ("diabetis", "hypertensoin") still match
+- Scores are aggregated per ICD-11 code (best matching name) and every result carries its code,
+  FSN, leaf flag, the matched name and a highlight of the matched words
+
+Usage:
+python icd_lexical_index.py --build -o=./assets/icd_lexical_index.npz
+python icd_lexical_index.py --index=./assets/icd_lexical_index.npz --query "carrion disease"
+python icd_lexical_index.py --index=./assets/icd_lexical_index.npz -i=./ciel_diagnoses.csv --name-column=name
+    -o=./output/icd11_lexical_candidates.csv --top=10 --leaf-only
+
+from icd_lexical_index import ICDLexicalIndex
+
+index = ICDLexicalIndex.load("./assets/icd_lexical_index.npz")
+index.search_many(["carrion disease", "diabetis type 2"], top_k=5)
+
+CLI arguments:
+--build: Build the index from analytics.icd11_mms_en_name / analytics.icd11_mms_en
+--index: Previously saved index (.npz)
+--query: Query to search (printed)
+-i, --inputfile: CSV file with the terms to search in batch
+--name-column: Column with the terms (default: name)
+-o, --outputfile: .npz file with --build, otherwise the CSV file for the batch results
+--top: Number of results per query (default: 10)
+--leaf-only: Only return terminal (leaf) codes
+'''
+
+import argparse
+import json
+import math
+import re
+import time
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall((text or "").lower())
+
+
+def trigrams(term):
+    padded = f"  {term} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class ICDLexicalIndex:
+    """BM25 inverted index over ICD-11 names with trigram expansion of unknown query words."""
+
+    def __init__(self, terms, posting_ptr, posting_docs, posting_tf, doc_length, doc_entity, doc_name, doc_name_type,
+                 entity_codes, entity_titles, entity_leaf, k1=1.2, b=0.75):
+        self.terms = np.asarray(terms, dtype=str)
+        self.posting_ptr = np.asarray(posting_ptr, dtype=np.int64)
+        self.posting_docs = np.asarray(posting_docs, dtype=np.int32)
+        self.posting_tf = np.asarray(posting_tf, dtype=np.float32)
+        self.doc_length = np.asarray(doc_length, dtype=np.float32)
+        self.doc_entity = np.asarray(doc_entity, dtype=np.int32)
+        self.doc_name = np.asarray(doc_name, dtype=str)
+        self.doc_name_type = np.asarray(doc_name_type, dtype=str)
+        self.entity_codes = np.asarray(entity_codes, dtype=str)
+        self.entity_titles = np.asarray(entity_titles, dtype=str)
+        self.entity_leaf = np.asarray(entity_leaf, dtype=bool)
+        self.k1 = float(k1)
+        self.b = float(b)
+        self._prepare()
+
+    def _prepare(self):
+        """Vocabulary lookup, IDF, length normalisation and the trigram index of the vocabulary."""
+        self.term_lookup = {term: i for i, term in enumerate(self.terms.tolist())}
+        n_docs = len(self.doc_length)
+        document_frequency = np.diff(self.posting_ptr)
+        self.idf = np.log(1 + (n_docs - document_frequency + 0.5) / (document_frequency + 0.5)).astype(np.float32)
+        average_length = float(self.doc_length.mean()) if n_docs else 1.0
+        self.length_norm = (self.k1 * (1 - self.b + self.b * self.doc_length / average_length)).astype(np.float32)
+
+        self.trigram_lookup = {}
+        for term_id, term in enumerate(self.terms.tolist()):
+            for trigram in trigrams(term):
+                self.trigram_lookup.setdefault(trigram, []).append(term_id)
+
+    # ----- Building -----
+
+    @classmethod
+    def from_records(cls, records, **kwargs):
+        """
+        Build from (code, name, name_type, is_leaf) records; the 'fsn' name of a code is its title.
+        """
+        entity_lookup, entity_codes, entity_titles, entity_leaf = {}, [], [], []
+        doc_entity, doc_name, doc_name_type, doc_tokens = [], [], [], []
+        for code, name, name_type, is_leaf in records:
+            if not code or not name:
+                continue
+            if code not in entity_lookup:
+                entity_lookup[code] = len(entity_codes)
+                entity_codes.append(code)
+                entity_titles.append(name)
+                entity_leaf.append(bool(is_leaf))
+            entity = entity_lookup[code]
+            if name_type == "fsn":
+                entity_titles[entity] = name
+            doc_entity.append(entity)
+            doc_name.append(name)
+            doc_name_type.append(name_type)
+            doc_tokens.append(Counter(tokenize(name)))
+
+        term_lookup = {}
+        postings = []
+        for doc, counts in enumerate(doc_tokens):
+            for term, tf in counts.items():
+                term_id = term_lookup.setdefault(term, len(term_lookup))
+                postings.append((term_id, doc, tf))
+        postings = np.asarray(postings, dtype=np.int64).reshape(-1, 3)
+        postings = postings[np.lexsort((postings[:, 1], postings[:, 0]))]
+        posting_ptr = np.zeros(len(term_lookup) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(postings[:, 0], minlength=len(term_lookup)), out=posting_ptr[1:])
+
+        return cls(
+            list(term_lookup), posting_ptr, postings[:, 1], postings[:, 2],
+            [sum(counts.values()) for counts in doc_tokens], doc_entity, doc_name, doc_name_type,
+            entity_codes, entity_titles, entity_leaf, **kwargs
+        )
+
+    @classmethod
+    def from_database(cls, engine, **kwargs):
+        """Build from analytics.icd11_mms_en_name joined with analytics.icd11_mms_en."""
+        from sqlalchemy import text
+
+        with engine.connect() as conn:
+            rows = conn.execute(text("""
+                SELECT m.code, n.name, n.name_type, m.is_leaf
+                FROM analytics.icd11_mms_en_name n
+                JOIN analytics.icd11_mms_en m ON m.id = n.icd11_mms_en_id
+                WHERE m.code IS NOT NULL AND m.code <> ''
+                ORDER BY m.id, n.name_type, n.name
+            """)).fetchall()
+        return cls.from_records(rows, **kwargs)
+
+    def save(self, filename):
+        np.savez_compressed(
+            filename,
+            terms=self.terms, posting_ptr=self.posting_ptr, posting_docs=self.posting_docs, posting_tf=self.posting_tf,
+            doc_length=self.doc_length, doc_entity=self.doc_entity, doc_name=self.doc_name,
+            doc_name_type=self.doc_name_type, entity_codes=self.entity_codes, entity_titles=self.entity_titles,
+            entity_leaf=self.entity_leaf, k1=self.k1, b=self.b
+        )
+
+    @classmethod
+    def load(cls, filename):
+        data = np.load(filename)
+        return cls(**{name: data[name] for name in data.files})
+
+    # ----- Searching -----
+
+    def expand(self, token, max_expansions=3, min_similarity=0.5):
+        """(term id, weight) pairs for a query word: itself if known, else its closest words by trigrams."""
+        term_id = self.term_lookup.get(token)
+        if term_id is not None:
+            return [(term_id, 1.0)]
+        query_trigrams = trigrams(token)
+        shared = Counter(other for trigram in query_trigrams for other in self.trigram_lookup.get(trigram, ()))
+        expansions = []
+        for other, count in shared.most_common(50):
+            similarity = count / (len(query_trigrams) + len(trigrams(self.terms[other])) - count)
+            if similarity >= min_similarity:
+                expansions.append((other, similarity))
+        expansions.sort(key=lambda expansion: -expansion[1])
+        return expansions[:max_expansions]
+
+    def search(self, query, top_k=10, leaf_only=False):
+        """
+        Best ICD-11 codes for a query.
+
+        Returns:
+            List of {"code", "title", "is_leaf", "score", "name", "name_type", "highlight"}, best first
+        """
+        weighted_terms = {}
+        for token in set(tokenize(query)):
+            for term_id, weight in self.expand(token):
+                weighted_terms[term_id] = max(weight, weighted_terms.get(term_id, 0.0))
+        if not weighted_terms:
+            return []
+
+        docs, contributions = [], []
+        for term_id, weight in weighted_terms.items():
+            start, end = self.posting_ptr[term_id], self.posting_ptr[term_id + 1]
+            posting_docs = self.posting_docs[start:end]
+            tf = self.posting_tf[start:end]
+            docs.append(posting_docs)
+            contributions.append(weight * self.idf[term_id] * tf * (self.k1 + 1) / (tf + self.length_norm[posting_docs]))
+        docs = np.concatenate(docs)
+        unique_docs, inverse = np.unique(docs, return_inverse=True)
+        doc_scores = np.bincount(inverse, weights=np.concatenate(contributions))
+
+        # Best name per code
+        order = np.argsort(-doc_scores, kind="stable")
+        ranked_docs = unique_docs[order]
+        entities = self.doc_entity[ranked_docs]
+        if leaf_only:
+            keep = self.entity_leaf[entities]
+            ranked_docs, entities, order = ranked_docs[keep], entities[keep], order[keep]
+        _, first = np.unique(entities, return_index=True)
+        first.sort()
+        first = first[:top_k]
+
+        matched_terms = {self.terms[term_id] for term_id in weighted_terms}
+        results = []
+        for position in first:
+            doc, entity = ranked_docs[position], entities[position]
+            name = str(self.doc_name[doc])
+            results.append({
+                "code": str(self.entity_codes[entity]),
+                "title": str(self.entity_titles[entity]),
+                "is_leaf": bool(self.entity_leaf[entity]),
+                "score": round(float(doc_scores[order[position]]), 4),
+                "name": name,
+                "name_type": str(self.doc_name_type[doc]),
+                "highlight": self.highlight(name, matched_terms),
+            })
+        return results
+
+    @staticmethod
+    def highlight(name, matched_terms):
+        """Wrap the matched words of a name in <em> tags, as the ICD API search does."""
+        return re.sub(r"[A-Za-z0-9]+",
+                      lambda match: f"<em>{match.group(0)}</em>" if match.group(0).lower() in matched_terms else match.group(0),
+                      name)
+
+    def search_many(self, queries, top_k=10, leaf_only=False):
+        """Search a batch of queries; identical queries are searched once."""
+        results = {query: self.search(query, top_k, leaf_only) for query in dict.fromkeys(queries)}
+        return [results[query] for query in queries]
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='icd_lexical_index.py', description='Offline BM25 + trigram search over ICD-11 names')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--build', action='store_true', help="Build the index from analytics.icd11_mms_en_name")
+    source.add_argument('--index', help="Previously saved index (.npz)")
+    parser.add_argument('--query', help="Query to search")
+    parser.add_argument('-i', '--inputfile', help="CSV file with the terms to search in batch")
+    parser.add_argument('--name-column', default="name", help="Column with the terms")
+    parser.add_argument('-o', '--outputfile', help=".npz file with --build, otherwise the CSV file for the batch results")
+    parser.add_argument('--top', type=int, default=10, help="Number of results per query")
+    parser.add_argument('--leaf-only', action='store_true', help="Only return terminal (leaf) codes")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    if args.build:
+        from icd_db import get_engine
+        index = ICDLexicalIndex.from_database(get_engine())
+        if args.outputfile:
+            index.save(args.outputfile)
+        print(f"✅ Index with {len(index.doc_name)} names, {len(index.entity_codes)} codes and {len(index.terms)} words "
+              f"built in {round(time.time() - start_time, 2)} sec" + (f", saved to: {args.outputfile}" if args.outputfile else ""))
+        return
+
+    index = ICDLexicalIndex.load(args.index)
+    if args.query:
+        for result in index.search(args.query, args.top, args.leaf_only):
+            print(f"• {result['code']} - {result['title']} ({result['score']}, {'leaf' if result['is_leaf'] else 'not leaf'}): {result['highlight']}")
+
+    if args.inputfile:
+        df_input = pd.read_csv(args.inputfile, dtype=str)
+        queries = df_input[args.name_column].fillna("").astype(str).tolist()
+        search_start = time.time()
+        results = index.search_many(queries, args.top, args.leaf_only)
+        search_seconds = time.time() - search_start
+        df_input['lexical_code'] = [candidates[0]['code'] if candidates else None for candidates in results]
+        df_input['lexical_title'] = [candidates[0]['title'] if candidates else None for candidates in results]
+        df_input['lexical_score'] = [candidates[0]['score'] if candidates else None for candidates in results]
+        df_input['lexical_candidates'] = [json.dumps(candidates) for candidates in results]
+        if args.outputfile:
+            df_input.to_csv(args.outputfile, index=False)
+        print(f"✅ {len(queries)} queries in {round(search_seconds, 2)} sec "
+              f"({math.floor(len(queries) / search_seconds) if search_seconds else len(queries)} queries/sec)"
+              + (f", saved to: {args.outputfile}" if args.outputfile else ""))
+
+
+if __name__ == "__main__":
+    main()
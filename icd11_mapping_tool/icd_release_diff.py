@@ -0,0 +1,466 @@
+'''
+Diff two ICD-11 releases and refresh only what changed.
+
+Compares the SimpleTabulation files (MMS) of two releases and, optionally, two foundation hierarchy
+snapshots (icd_flat_hierarchy.csv, see icd_crawler.py), and classifies every entity as added,
+removed, retitled, recoded, re-parented or leaf-changed. The change set drives incremental updates
+instead of a full Phase 3.1 rebuild:
+- analytics.icd11_mms_en: changed rows are updated in place, new rows inserted, removed rows (and
+  their names and postcoordination options) deleted
+- analytics.icd11_mms_en_name: FSN and synonyms are fetched from the ICD API for changed entities only;
+  entities whose fetch failed keep their names and are flagged names_failed in the change set
+- analytics.icd11_mms_en_hierarchy: rows of changed foundation entities are replaced, and the
+  parent_code of their children follows recoded parents
+- Qdrant collections: points of removed or changed concepts (including blocks and chapters without a
+  code) are deleted by entity_id_residual and the changed FSNs are re-embedded, with stable point IDs
+  derived from the code (or the key) and text and the same payload as Phase 3.1
+  (including the leaf_postcoordination_options read from analytics.icd11_mms_en_postcoordination)
+
+Entities whose postcoordination options must be extracted again are listed in the change set
+(column 'postcoordination'), to be rerun with the Phase 3.1 extraction for those stems only.
+
+Usage:
+python icd_release_diff.py --old=./2024-01/SimpleTabulation-ICD-11-MMS-en.xlsx --new=./2025-01/SimpleTabulation-ICD-11-MMS-en.xlsx
+    -o=./assets/icd_release_changes.csv
+python icd_release_diff.py --old=... --new=... --old-hierarchy=./2024-01/icd_flat_hierarchy.csv
+    --new-hierarchy=./2025-01/icd_flat_hierarchy.csv --apply-db --apply-qdrant --release=2025-01
+python icd_release_diff.py -o=./assets/icd_release_changes.csv --retry-names --release=2025-01
+
+CLI arguments:
+--old / --new: SimpleTabulation files (.xlsx or .txt) of the previous and the new release
+--old-hierarchy / --new-hierarchy: Optional flat foundation hierarchy snapshots of both releases
+-o, --outputfile: CSV file with the change set (default: ./assets/icd_release_changes.csv)
+--apply-db: Apply the changes to the MySQL tables
+--apply-qdrant: Re-embed the changed concepts in the Qdrant collections (reads the postcoordination options of the
+    changed concepts from the database, so run it after --apply-db and the postcoordination re-extraction)
+--retry-names: Only fetch the names of the entities flagged names_failed in the change set (-o) again
+--collections: model=collection pairs for --apply-qdrant (default: the four Phase 3.1 collections)
+--qdrant-host / --qdrant-port: Qdrant server (default: localhost:6333)
+--api-url: ICD API base URL (default: $ICD_API_URL or http://icdapi)
+--release: ICD-11 release of the new files, used for ICD API calls (default: $ICD_RELEASE or 2025-01)
+'''
+
+import argparse
+import asyncio
+import re
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from icd_api import ICD_API_URL, ICD_RELEASE, get_json, linearization_url, make_async_client
+from icd_hierarchy_index import ICDHierarchyIndex
+
+CHANGE_TYPES = ["added", "removed", "retitled", "recoded", "reparented", "leaf_changed"]
+
+DEFAULT_COLLECTIONS = {
+    "sentence-transformers/all-MiniLM-L6-v2": "icd11_concepts_minilm",
+    "sentence-transformers/all-mpnet-base-v2": "icd11_concepts_mpnet",
+    "pritamdeka/S-BioBert-snli-multinli-stsb": "icd11_concepts_biobert",
+    "cambridgeltl/SapBERT-from-PubMedBERT-fulltext": "icd11_concepts_sapbert",
+}
+
+
+def release_frame(index):
+    """One row per node of a hierarchy index: key, code, title, parent key and leaf flag."""
+    parent = index.parent
+    return pd.DataFrame({
+        "key": index.entity_ids,
+        "code": index.codes,
+        "title": index.titles,
+        "parent": np.where(parent >= 0, index.entity_ids[np.maximum(parent, 0)], ""),
+        "is_leaf": index.leaf,
+    })
+
+
+def diff_frames(old, new, scope):
+    """Compare two release frames; returns only the changed keys with one flag column per change type."""
+    merged = old.merge(new, on="key", how="outer", suffixes=("_old", "_new"), indicator=True)
+    for column in ("code", "title", "parent"):
+        for suffix in ("_old", "_new"):
+            merged[column + suffix] = merged[column + suffix].fillna("")
+    both = merged['_merge'] == "both"
+    merged['added'] = merged['_merge'] == "right_only"
+    merged['removed'] = merged['_merge'] == "left_only"
+    merged['retitled'] = both & (merged['title_old'] != merged['title_new'])
+    merged['recoded'] = both & (merged['code_old'] != merged['code_new'])
+    merged['reparented'] = both & (merged['parent_old'] != merged['parent_new'])
+    merged['leaf_changed'] = both & (merged['is_leaf_old'].fillna(False) != merged['is_leaf_new'].fillna(False))
+    changed = merged[merged[CHANGE_TYPES].any(axis=1)].drop(columns="_merge").copy()
+    changed.insert(0, "scope", scope)
+    # MMS stems whose postcoordination options may have changed: new, recoded or with a changed subtree
+    changed['postcoordination'] = (scope == "mms") & (
+        changed['added'] | changed['recoded'] | changed['leaf_changed'] | changed['reparented'])
+    return changed.reset_index(drop=True)
+
+
+def diff_tabulations(old_filename, new_filename):
+    """MMS changes between two SimpleTabulation files (keys are linearization paths)."""
+    return diff_frames(release_frame(ICDHierarchyIndex.from_simple_tabulation(old_filename)),
+                       release_frame(ICDHierarchyIndex.from_simple_tabulation(new_filename)), "mms")
+
+
+def diff_hierarchies(old_filename, new_filename):
+    """
+    Foundation changes between two flat hierarchy snapshots (keys are entity IDs).
+
+    Multi-parent entities are compared on their full, sorted set of parents.
+    """
+    frames = []
+    for filename in (old_filename, new_filename):
+        flat = pd.read_csv(filename, dtype=str).fillna("")
+        grouped = flat.groupby("entity_id", sort=False).agg(
+            code=("code", "first"), title=("title", "first"),
+            parent=("parent_entity_id", lambda parents: "|".join(sorted(set(parents) - {""}))))
+        grouped['is_leaf'] = ~grouped.index.isin(set(flat['parent_entity_id']))
+        frames.append(grouped.reset_index().rename(columns={"entity_id": "key"}))
+    return diff_frames(frames[0], frames[1], "foundation")
+
+
+def read_tabulation_rows(filename):
+    """SimpleTabulation rows with the column names of analytics.icd11_mms_en (as in Phase 3.1)."""
+    def normalize_column_name(name):
+        name = name.strip().replace(" ", "_")
+        s1 = re.sub(r'(.)([A-Z][a-z]+)', r'\1_\2', name)
+        s2 = re.sub(r'([a-z0-9])([A-Z])', r'\1_\2', s1)
+        return s2.lower()
+
+    if str(filename).endswith((".xlsx", ".xls")):
+        tab = pd.read_excel(filename, dtype=str)
+    else:
+        tab = pd.read_csv(filename, sep="\t", dtype=str)
+    tab.columns = [normalize_column_name(column) for column in tab.columns]
+    tab['key'] = tab['linearization_uri'].fillna("").str.split("/mms/").str[-1]
+    for column in ("is_residual", "is_leaf"):
+        tab[column] = tab[column].fillna("").str.strip().str.lower() == "true"
+    return tab
+
+
+MMS_COLUMNS = [
+    'foundation_uri', 'linearization_uri', 'code', 'block_id', 'title', 'class_kind', 'depth_in_kind', 'is_residual',
+    'chapter_no', 'browser_link', 'is_leaf', 'primary_tabulation', 'grouping1', 'grouping2', 'grouping3', 'grouping4',
+    'grouping5'
+]
+
+# Linearization path of an icd11_mms_en row (the release-independent key of the diff)
+KEY_SQL = "SUBSTRING_INDEX(linearization_uri, '/mms/', -1)"
+
+
+def _in_batches(conn, sql, name, values, params=None, batch_size=1000):
+    """Run a statement with an expanding IN parameter over batches of values; returns all fetched rows."""
+    from sqlalchemy import bindparam, text
+
+    statement = text(sql).bindparams(bindparam(name, expanding=True))
+    rows = []
+    for start in range(0, len(values), batch_size):
+        result = conn.execute(statement, dict(params or {}, **{name: values[start:start + batch_size]}))
+        if result.returns_rows:
+            rows.extend(result.fetchall())
+    return rows
+
+
+async def fetch_names(keys, api_url=ICD_API_URL, release=ICD_RELEASE, concurrency=30):
+    """
+    FSN and synonyms (index terms) of linearization entities, as in Phase 3.1.
+
+    Returns:
+        ({key: [(name, name_type)]}, failed keys): a key fails if its request raised (5xx or transport
+        errors after the retries) or returned no document (any 4xx, e.g. 401 or 429)
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    async with make_async_client(concurrency) as client:
+        async def fetch(key):
+            async with semaphore:
+                data = await get_json(client, linearization_url(key, api_url, release))
+            if not data:
+                raise LookupError(f"No linearization entity for {key}")
+            fsn = data.get("title", {}).get("@value")
+            names = [(fsn, "fsn")] if fsn else []
+            synonyms = {term.get("label", {}).get("@value") for term in data.get("indexTerm", [])}
+            names += [(synonym, "synonym") for synonym in sorted(synonyms - {fsn, None})]
+            return names
+
+        results = await asyncio.gather(*[fetch(key) for key in keys], return_exceptions=True)
+    names = {key: result for key, result in zip(keys, results) if not isinstance(result, Exception)}
+    return names, [key for key in keys if key not in names]
+
+
+def refresh_names(conn, keys, api_url=ICD_API_URL, release=ICD_RELEASE):
+    """
+    Replace the rows of analytics.icd11_mms_en_name of MMS entities with their names from the ICD API.
+
+    Only the entities whose names were fetched are touched, so an API outage keeps the existing names.
+
+    Returns:
+        (number of inserted names, keys whose names could not be fetched)
+    """
+    from sqlalchemy import text
+
+    from icd_db import execute_in_batches
+
+    ids = {key: id_value for id_value, key in _in_batches(
+        conn, f"SELECT id, {KEY_SQL} FROM analytics.icd11_mms_en WHERE {KEY_SQL} IN :keys", "keys", list(keys))}
+    if not ids:
+        return 0, []
+    names, failed = asyncio.run(fetch_names(list(ids), api_url, release))
+    if names:
+        _in_batches(conn, "DELETE FROM analytics.icd11_mms_en_name WHERE icd11_mms_en_id IN :ids", "ids",
+                    [ids[key] for key in names])
+    inserted = execute_in_batches(conn, text("""
+        INSERT IGNORE INTO analytics.icd11_mms_en_name (icd11_mms_en_id, name, name_type)
+        VALUES (:icd11_mms_en_id, :name, :name_type)
+    """), [{"icd11_mms_en_id": ids[key], "name": name, "name_type": name_type}
+           for key, entity_names in names.items() for name, name_type in entity_names])
+    return inserted, failed
+
+
+def apply_to_database(engine, changes, new_tabulation, new_hierarchy=None, api_url=ICD_API_URL, release=ICD_RELEASE):
+    """
+    Apply an MMS (and optional foundation) change set to the MySQL tables.
+
+    Returns:
+        Dictionary with the number of inserted, updated and deleted rows per table, and the keys whose
+        names could not be fetched from the ICD API (icd11_mms_en_name_failed; their names are unchanged)
+    """
+    from sqlalchemy import text
+
+    from icd_db import execute_in_batches
+
+    counts = {}
+    mms = changes[changes['scope'] == "mms"]
+    tab = read_tabulation_rows(new_tabulation).set_index('key')
+    added_keys = mms.loc[mms['added'], 'key'].tolist()
+    updated_keys = mms.loc[~mms['added'] & ~mms['removed'], 'key'].tolist()
+    removed_keys = mms.loc[mms['removed'], 'key'].tolist()
+
+    def records(keys):
+        rows = tab.loc[[key for key in keys if key in tab.index], MMS_COLUMNS]
+        rows = rows.astype(object).where(pd.notnull(rows), None)
+        return [dict(row, key=key) for key, row in zip(rows.index, rows.to_dict(orient="records"))]
+
+    with engine.begin() as conn:
+        removed_ids = [row[0] for row in _in_batches(conn, f"SELECT id FROM analytics.icd11_mms_en WHERE {KEY_SQL} IN :keys",
+                                                     "keys", removed_keys)]
+        if removed_ids:
+            for table in ("analytics.icd11_mms_en_name", "analytics.icd11_mms_en_postcoordination"):
+                _in_batches(conn, f"DELETE FROM {table} WHERE icd11_mms_en_id IN :ids", "ids", removed_ids)
+            _in_batches(conn, "DELETE FROM analytics.icd11_mms_en WHERE id IN :ids", "ids", removed_ids)
+        counts['icd11_mms_en_deleted'] = len(removed_ids)
+
+        # Resolve the keys to ids once (the key expression can't use an index), then update by primary key
+        updated_ids = {key: id_value for id_value, key in _in_batches(
+            conn, f"SELECT id, {KEY_SQL} FROM analytics.icd11_mms_en WHERE {KEY_SQL} IN :keys", "keys", updated_keys)}
+        assignments = ", ".join(f"{column} = :{column}" for column in MMS_COLUMNS)
+        counts['icd11_mms_en_updated'] = execute_in_batches(conn, text(
+            f"UPDATE analytics.icd11_mms_en SET {assignments} WHERE id = :id"
+        ), [dict(record, id=updated_ids[record['key']]) for record in records(updated_ids)])
+        counts['icd11_mms_en_inserted'] = execute_in_batches(conn, text(
+            f"INSERT INTO analytics.icd11_mms_en ({', '.join(MMS_COLUMNS)}) "
+            f"VALUES ({', '.join(':' + column for column in MMS_COLUMNS)})"
+        ), records(added_keys))
+
+        # Names of new and retitled entities; failed fetches are returned for a retry (see --retry-names)
+        name_keys = mms.loc[mms['added'] | mms['retitled'], 'key'].tolist()
+        counts['icd11_mms_en_name_inserted'], counts['icd11_mms_en_name_failed'] = refresh_names(
+            conn, name_keys, api_url, release)
+
+        foundation = changes[changes['scope'] == "foundation"]
+        if new_hierarchy is not None and len(foundation):
+            flat = pd.read_csv(new_hierarchy, dtype=str)
+            changed_ids = foundation['key'].tolist()
+            _in_batches(conn, "DELETE FROM icd11_mms_en_hierarchy WHERE entity_id IN :ids", "ids", changed_ids)
+            new_rows = flat[flat['entity_id'].isin(set(changed_ids))]
+            counts['icd11_mms_en_hierarchy_replaced'] = execute_in_batches(conn, text("""
+                INSERT INTO icd11_mms_en_hierarchy (entity_id, code, title, parent_entity_id, parent_code)
+                VALUES (:entity_id, :code, :title, :parent_entity_id, :parent_code)
+            """), new_rows.astype(object).where(pd.notnull(new_rows), None).to_dict(orient="records"))
+            recoded = foundation[foundation['recoded']]
+            execute_in_batches(conn, text(
+                "UPDATE icd11_mms_en_hierarchy SET parent_code = :code WHERE parent_entity_id = :key"
+            ), [{"code": code, "key": key} for key, code in zip(recoded['key'], recoded['code_new'])])
+    return counts
+
+
+def code_type(code):
+    """Payload code_type of a code, as in Phase 3.1: foundation (no code), extension (X...) or stem."""
+    if not code:
+        return "foundation"
+    return "extension" if str(code).startswith("X") else "stem"
+
+
+def load_postcoordination_options(engine, keys):
+    """
+    leaf_postcoordination_options payload of MMS entities, as built by Phase 3.1: the options of each stem
+    in analytics.icd11_mms_en_postcoordination with the is_leaf and entity_id_residual of the option's code.
+
+    Returns:
+        Dictionary key -> list of {"code", "code_type", "title", "is_leaf", "entity_id_residual"}
+    """
+    stem_key = KEY_SQL.replace("linearization_uri", "m.linearization_uri")
+    option_key = KEY_SQL.replace("linearization_uri", "o.linearization_uri")
+    options = {}
+    with engine.connect() as conn:
+        rows = _in_batches(conn, f"""
+            SELECT {stem_key} AS stem_key, p.code, p.code_type, p.title, o.is_leaf, {option_key} AS entity_id_residual
+            FROM analytics.icd11_mms_en_postcoordination p
+            JOIN analytics.icd11_mms_en m ON m.id = p.icd11_mms_en_id
+            LEFT JOIN analytics.icd11_mms_en o ON o.code = p.code
+            WHERE {stem_key} IN :keys
+            ORDER BY p.id
+        """, "keys", list(keys))
+    for row in rows:
+        if row.code is None:
+            continue
+        options.setdefault(row.stem_key, []).append({
+            "code": row.code,
+            "code_type": row.code_type,
+            "title": row.title,
+            "is_leaf": bool(row.is_leaf),
+            "entity_id_residual": row.entity_id_residual,
+        })
+    return options
+
+
+def point_id(code, text):
+    """Stable Qdrant point ID for a (code, text) pair."""
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"icd11:{code}:{text}"))
+
+
+def apply_to_qdrant(changes, new_tabulation, engine, collections=None, host="localhost", port=6333, batch_size=64):
+    """
+    Delete the points of removed / changed concepts and upsert re-embedded FSNs of the changed concepts.
+
+    Stale points are found by their entity_id_residual (the key of the concept), so concepts without a
+    code (blocks and chapters, embedded with code_type 'foundation' as in Phase 3.1) are refreshed too.
+    The payload of every point matches the Phase 3.1 FSN points, with the concept's postcoordination
+    options loaded from the database (engine).
+
+    Returns:
+        Dictionary collection -> number of upserted points
+    """
+    from qdrant_client import QdrantClient
+    from qdrant_client.models import FieldCondition, Filter, FilterSelector, MatchAny, PointStruct
+    from sentence_transformers import SentenceTransformer
+
+    mms = changes[changes['scope'] == "mms"]
+    stale_keys = sorted(set(mms['key']))
+    tab = read_tabulation_rows(new_tabulation).set_index('key')
+    refreshed = tab.loc[[key for key in mms.loc[~mms['removed'], 'key'] if key in tab.index]]
+    codes = refreshed['code'].astype(object).where(refreshed['code'].notnull(), None).tolist()
+    texts = refreshed['title'].fillna("").str.replace(r'^([-]\s*)+', '', regex=True).str.strip().tolist()
+    options = load_postcoordination_options(engine, refreshed.index.tolist()) if len(refreshed) else {}
+
+    client = QdrantClient(host=host, port=port)
+    counts = {}
+    for model_name, collection in (collections or DEFAULT_COLLECTIONS).items():
+        for start in range(0, len(stale_keys), 1000):
+            client.delete(collection_name=collection, points_selector=FilterSelector(filter=Filter(must=[
+                FieldCondition(key="entity_id_residual", match=MatchAny(any=stale_keys[start:start + 1000]))])))
+        model = SentenceTransformer(model_name)
+        upserted = 0
+        for start in range(0, len(texts), batch_size):
+            batch = refreshed.iloc[start:start + batch_size]
+            vectors = model.encode(texts[start:start + batch_size], batch_size=batch_size, show_progress_bar=False)
+            points = []
+            for (key, row), code, text_value, vector in zip(batch.iterrows(), codes[start:start + batch_size],
+                                                            texts[start:start + batch_size], vectors):
+                points.append(PointStruct(id=point_id(code or key, text_value), vector=vector.tolist(), payload={
+                    "concept_name": text_value,
+                    "code": code,
+                    "entity_id_residual": key,
+                    "code_type": code_type(code),
+                    "name_type": "fsn",
+                    "is_leaf": bool(row['is_leaf']),
+                    "leaf_postcoordination_options": options.get(key, []),
+                }))
+            client.upsert(collection_name=collection, points=points)
+            upserted += len(points)
+        counts[collection] = upserted
+    return counts
+
+
+def retry_names(changes_filename, api_url=ICD_API_URL, release=ICD_RELEASE):
+    """Refresh the names of the entities flagged names_failed in a saved change set, and update the flags."""
+    from icd_db import get_engine
+
+    changes = pd.read_csv(changes_filename, dtype={"key": str}, keep_default_na=False)
+    if 'names_failed' not in changes:
+        print(f"• No names_failed entities in {changes_filename}")
+        return
+    flagged = changes['names_failed'].astype(str).str.lower() == "true"
+    with get_engine().begin() as conn:
+        inserted, failed = refresh_names(conn, changes.loc[flagged, 'key'].tolist(), api_url, release)
+    changes['names_failed'] = flagged & changes['key'].isin(set(failed))
+    changes.to_csv(changes_filename, index=False)
+    print(f"✅ {inserted} names inserted for {int(flagged.sum()) - len(failed)} entities ({len(failed)} still failed)")
+
+
+def parse_collections(value):
+    """'model=collection,model=collection' -> {model: collection}"""
+    if not value:
+        return None
+    return dict(item.split("=", 1) for item in value.split(","))
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='icd_release_diff.py', description='Diff two ICD-11 releases and refresh incrementally')
+    parser.add_argument('--old', help="SimpleTabulation file of the previous release")
+    parser.add_argument('--new', help="SimpleTabulation file of the new release")
+    parser.add_argument('--old-hierarchy', help="Flat foundation hierarchy snapshot of the previous release")
+    parser.add_argument('--new-hierarchy', help="Flat foundation hierarchy snapshot of the new release")
+    parser.add_argument('-o', '--outputfile', default="./assets/icd_release_changes.csv", help="CSV file with the change set")
+    parser.add_argument('--apply-db', action='store_true', help="Apply the changes to the MySQL tables")
+    parser.add_argument('--apply-qdrant', action='store_true',
+                        help="Re-embed the changed concepts in the Qdrant collections (postcoordination options are read "
+                        "from the database)")
+    parser.add_argument('--retry-names', action='store_true',
+                        help="Fetch the names of the entities flagged names_failed in the change set (-o) again")
+    parser.add_argument('--collections', help="model=collection pairs for --apply-qdrant")
+    parser.add_argument('--qdrant-host', default="localhost", help="Qdrant host")
+    parser.add_argument('--qdrant-port', type=int, default=6333, help="Qdrant port")
+    parser.add_argument('--api-url', default=ICD_API_URL, help="ICD API base URL")
+    parser.add_argument('--release', default=ICD_RELEASE, help="ICD-11 release of the new files")
+    args = parser.parse_args()
+    if not args.retry_names and not (args.old and args.new):
+        parser.error("--old and --new are required (unless --retry-names)")
+
+    start_time = time.time()
+    if args.retry_names:
+        retry_names(args.outputfile, args.api_url, args.release)
+        print(f"Total time: {round(time.time() - start_time, 2)} sec")
+        return
+
+    changes = diff_tabulations(args.old, args.new)
+    if args.old_hierarchy and args.new_hierarchy:
+        changes = pd.concat([changes, diff_hierarchies(args.old_hierarchy, args.new_hierarchy)], ignore_index=True)
+    changes.to_csv(args.outputfile, index=False)
+
+    print(f"✅ Change set saved to: {args.outputfile} ({round(time.time() - start_time, 2)} sec)")
+    for scope, scope_changes in changes.groupby("scope"):
+        summary = ", ".join(f"{int(scope_changes[change_type].sum())} {change_type}" for change_type in CHANGE_TYPES)
+        print(f"• {scope}: {summary}")
+    print(f"• {int(changes['postcoordination'].sum())} stems to re-extract postcoordination for")
+
+    if args.apply_db or args.apply_qdrant:
+        from icd_db import get_engine
+        engine = get_engine()
+    if args.apply_db:
+        counts = apply_to_database(engine, changes, args.new,
+                                   args.new_hierarchy if args.old_hierarchy else None, args.api_url, args.release)
+        failed = counts.pop('icd11_mms_en_name_failed')
+        print(f"✅ Database updated: {counts}")
+        if failed:
+            changes['names_failed'] = (changes['scope'] == "mms") & changes['key'].isin(set(failed))
+            changes.to_csv(args.outputfile, index=False)
+            print(f"• The names of {len(failed)} entities could not be fetched and were left unchanged; they are "
+                  f"flagged names_failed in {args.outputfile}, run again with --retry-names to retry them")
+    if args.apply_qdrant:
+        counts = apply_to_qdrant(changes, args.new, engine, parse_collections(args.collections), args.qdrant_host,
+                                 args.qdrant_port)
+        print(f"✅ Qdrant collections updated: {counts}")
+    print(f"Total time: {round(time.time() - start_time, 2)} sec")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+'''
+Bulk (re)load of the ICD-11 name, hierarchy and postcoordination tables through staging tables.
+
+Phase 3.1 drops and recreates analytics.icd11_mms_en_name, icd11_mms_en_hierarchy and
+analytics.icd11_mms_en_postcoordination, then inserts their rows in small batches, so readers see a
+missing or half-filled table while it runs. load_table() instead:
+- creates an empty <table>__staging with its primary key only
+- streams the rows into it with multi-row INSERTs (pymysql executemany, --method=insert) or through
+  a temporary tab-separated file and LOAD DATA LOCAL INFILE (--method=load)
+- counts the rows stored: rows dropped as duplicate keys (except duplicate names, ignored as in Phase 3.1)
+  or with an empty NOT NULL column stop the load before the swap, unless --force
+- adds the secondary indexes and foreign keys once, after the load
+- swaps it in with a single RENAME TABLE (table -> table__old, staging -> table) and drops the old table
+
+Rows can come from any iterable of tuples in column order (e.g. the names or postcoordination rows
+built in the notebook) or from CSV files with the table's columns.
+
+Usage:
+python icd_table_loader.py --hierarchy=./assets/icd_flat_hierarchy.csv
+python icd_table_loader.py --names=./assets/icd11_mms_en_name.csv --postcoordination=./assets/icd11_mms_en_postcoordination.csv
+    --method=load --batch-size=20000
+
+from icd_table_loader import load_table
+load_table(engine, "analytics.icd11_mms_en_name", rows)   # rows: (icd11_mms_en_id, name, name_type) tuples
+
+CLI arguments:
+--names: CSV file with icd11_mms_en_id, name, name_type
+--hierarchy: CSV file with entity_id, code, title, parent_entity_id, parent_code (icd_flat_hierarchy.csv)
+--postcoordination: CSV file with icd11_mms_en_id, code_type, code, title, required
+--method: insert (multi-row INSERTs) or load (LOAD DATA LOCAL INFILE) (default: insert)
+--batch-size: Rows per INSERT batch / CSV chunk (default: 10000)
+--database: Database name (default: $DB_NAME)
+--force: Swap a table in even if rows were dropped as duplicate keys or had an empty NOT NULL column
+'''
+
+import argparse
+import os
+import tempfile
+import time
+
+import pandas as pd
+from sqlalchemy import text
+
+from icd_db import get_engine
+
+# Table -> (loaded columns with their type, auto-increment id, primary key, secondary indexes, foreign keys)
+TABLES = {
+    "analytics.icd11_mms_en_name": (
+        [("icd11_mms_en_id", "INT NOT NULL"), ("name", "VARCHAR(200) NOT NULL"), ("name_type", "VARCHAR(10) NOT NULL")],
+        False,
+        "PRIMARY KEY (icd11_mms_en_id, name, name_type)",
+        [],
+        ["FOREIGN KEY (icd11_mms_en_id) REFERENCES analytics.icd11_mms_en(id)"]
+    ),
+    "icd11_mms_en_hierarchy": (
+        [("entity_id", "VARCHAR(50) NOT NULL"), ("code", "VARCHAR(50) NULL"), ("title", "TEXT NULL"),
+         ("parent_entity_id", "VARCHAR(50) NULL"), ("parent_code", "VARCHAR(50) NULL")],
+        True,
+        "PRIMARY KEY (id)",
+        [("idx_entity_id", "entity_id"), ("idx_parent_entity_id", "parent_entity_id"), ("idx_code", "code")],
+        []
+    ),
+    "analytics.icd11_mms_en_postcoordination": (
+        [("icd11_mms_en_id", "INT NOT NULL"), ("code_type", "VARCHAR(20) NOT NULL"), ("code", "VARCHAR(16) NOT NULL"),
+         ("title", "TEXT NOT NULL"), ("required", "TINYINT(1) NOT NULL")],
+        True,
+        "PRIMARY KEY (id)",
+        [("idx_icd11_mms_en_id", "icd11_mms_en_id"), ("idx_code", "code")],
+        []
+    ),
+}
+
+# Tables whose duplicate rows are dropped on purpose (INSERT IGNORE in Phase 3.1); any other dropped row aborts the load
+DEDUPLICATED_TABLES = {"analytics.icd11_mms_en_name"}
+
+BOOLEAN_VALUES = {"true": 1, "1": 1, "false": 0, "0": 0}
+
+
+def quote(table):
+    """`schema`.`table` for a (possibly schema-qualified) table name."""
+    return ".".join(f"`{part}`" for part in table.split("."))
+
+
+def create_staging(conn, table):
+    """Create an empty <table>__staging with the primary key only; returns its name."""
+    columns, auto_id, primary_key, _, _ = TABLES[table]
+    staging = f"{table}__staging"
+    column_sql = ", ".join((["`id` INT NOT NULL AUTO_INCREMENT"] if auto_id else [])
+                           + [f"`{name}` {ddl}" for name, ddl in columns] + [primary_key])
+    conn.execute(text(f"DROP TABLE IF EXISTS {quote(staging)}"))
+    conn.execute(text(f"CREATE TABLE {quote(staging)} ({column_sql}) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"))
+    return staging
+
+
+def insert_rows(conn, staging, columns, rows, batch_size=10000):
+    """Multi-row INSERTs: pymysql rewrites each executemany batch into a few large INSERT statements."""
+    names = [name for name, _ in columns]
+    sql = (f"INSERT IGNORE INTO {quote(staging)} ({', '.join(f'`{name}`' for name in names)}) "
+           f"VALUES ({', '.join(['%s'] * len(names))})")
+    loaded, batch = 0, []
+    for row in rows:
+        batch.append(tuple(row))
+        if len(batch) >= batch_size:
+            conn.exec_driver_sql(sql, batch)
+            loaded += len(batch)
+            batch = []
+    if batch:
+        conn.exec_driver_sql(sql, batch)
+        loaded += len(batch)
+    return loaded
+
+
+def _tsv_field(value):
+    if value is None:
+        return "\\N"
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def load_rows(conn, staging, columns, rows):
+    """Write the rows to a temporary tab-separated file and load it with LOAD DATA LOCAL INFILE."""
+    names = [name for name, _ in columns]
+    loaded = 0
+    with tempfile.NamedTemporaryFile('w', suffix=".tsv", encoding="utf-8", delete=False) as f:
+        for row in rows:
+            f.write("\t".join(_tsv_field(value) for value in row) + "\n")
+            loaded += 1
+    try:
+        conn.execute(text(f"""
+            LOAD DATA LOCAL INFILE :filename
+            IGNORE INTO TABLE {quote(staging)}
+            CHARACTER SET utf8mb4
+            FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\'
+            LINES TERMINATED BY '\\n'
+            ({', '.join(f'`{name}`' for name in names)})
+        """), {"filename": f.name})
+    finally:
+        os.remove(f.name)
+    return loaded
+
+
+def count_null_violations(rows, columns, counts):
+    """Pass the rows through, counting in counts['null_rows'] those with None in a NOT NULL column."""
+    required = [i for i, (_, ddl) in enumerate(columns) if "NOT NULL" in ddl]
+    for row in rows:
+        if any(row[i] is None for i in required):
+            counts['null_rows'] += 1
+        yield row
+
+
+def check_stored(conn, table, staging, sent, null_rows):
+    """
+    Compare the rows stored in the staging table with the rows sent (INSERT IGNORE / LOAD DATA ... IGNORE
+    drop duplicate keys silently and store NULLs of NOT NULL columns as '' or 0).
+
+    Returns:
+        (number of stored rows, list of problems that should stop the swap)
+    """
+    stored = conn.execute(text(f"SELECT COUNT(*) FROM {quote(staging)}")).scalar()
+    problems = []
+    if stored != sent and table not in DEDUPLICATED_TABLES:
+        problems.append(f"{sent - stored} of {sent} rows were dropped as duplicate keys")
+    if null_rows:
+        problems.append(f"{null_rows} rows have an empty value in a NOT NULL column (stored as '' or 0)")
+    return stored, problems
+
+
+def add_indexes(conn, table, staging):
+    """Add the secondary indexes and foreign keys of a table to its loaded staging table."""
+    _, _, _, indexes, foreign_keys = TABLES[table]
+    clauses = [f"ADD INDEX `{name}` (`{column}`)" for name, column in indexes]
+    clauses += [f"ADD {foreign_key}" for foreign_key in foreign_keys]
+    if clauses:
+        conn.execute(text(f"ALTER TABLE {quote(staging)} {', '.join(clauses)}"))
+
+
+def swap_in(conn, table, staging):
+    """Atomically replace the table with its staging table, then drop the previous version."""
+    schema, _, name = table.rpartition(".")
+    exists = conn.execute(text(
+        "SELECT COUNT(*) FROM information_schema.tables "
+        "WHERE table_schema = COALESCE(NULLIF(:schema, ''), DATABASE()) AND table_name = :name"
+    ), {"schema": schema, "name": name}).scalar()
+    old = f"{table}__old"
+    conn.execute(text(f"DROP TABLE IF EXISTS {quote(old)}"))
+    if exists:
+        conn.execute(text(f"RENAME TABLE {quote(table)} TO {quote(old)}, {quote(staging)} TO {quote(table)}"))
+        conn.execute(text(f"DROP TABLE {quote(old)}"))
+    else:
+        conn.execute(text(f"RENAME TABLE {quote(staging)} TO {quote(table)}"))
+
+
+def load_table(engine, table, rows, method="insert", batch_size=10000, force=False):
+    """
+    Load rows into a staging table, index it and swap it in for the table.
+
+    The rows stored in the staging table are counted before the swap: if rows were dropped as duplicate
+    keys (except in DEDUPLICATED_TABLES) or had an empty NOT NULL column, the staging table is dropped
+    and the table is left as it was, unless force is set.
+
+    Args:
+        engine: SQLAlchemy engine (with connect_args={"local_infile": True} for method="load")
+        table: One of TABLES
+        rows: Iterable of tuples in the column order of TABLES[table]
+        method: "insert" (multi-row INSERTs) or "load" (LOAD DATA LOCAL INFILE)
+        batch_size: Rows per INSERT batch
+        force: Swap the table in even if rows were dropped or had an empty NOT NULL column
+
+    Returns:
+        Dictionary with the table, number of rows sent and stored, the problems found (if forced) and
+        elapsed seconds (load, index, total)
+
+    Raises:
+        RuntimeError: if rows were dropped or had an empty NOT NULL column (and not force)
+    """
+    columns = TABLES[table][0]
+    start_time = time.time()
+    counts = {"null_rows": 0}
+    rows = count_null_violations(rows, columns, counts)
+    with engine.connect() as conn:
+        staging = create_staging(conn, table)
+        conn.commit()
+        if method == "load":
+            sent = load_rows(conn, staging, columns, rows)
+        else:
+            sent = insert_rows(conn, staging, columns, rows, batch_size)
+        conn.commit()
+        load_seconds = time.time() - start_time
+
+        stored, problems = check_stored(conn, table, staging, sent, counts['null_rows'])
+        if problems and not force:
+            conn.execute(text(f"DROP TABLE {quote(staging)}"))
+            conn.commit()
+            raise RuntimeError(f"{table} was not swapped in: {'; '.join(problems)} "
+                               f"(use force=True or --force to swap it in anyway)")
+
+        add_indexes(conn, table, staging)
+        index_seconds = time.time() - start_time - load_seconds
+        swap_in(conn, table, staging)
+        conn.commit()
+    return {"table": table, "sent": sent, "rows": stored, "problems": problems, "load_seconds": round(load_seconds, 2),
+            "index_seconds": round(index_seconds, 2), "seconds": round(time.time() - start_time, 2)}
+
+
+def rows_from_csv(filename, table, chunk_size=10000):
+    """Stream the rows of a CSV file (with the table's column names) as tuples in column order."""
+    columns = TABLES[table][0]
+    names = [name for name, _ in columns]
+    booleans = [name for name, ddl in columns if ddl.startswith(("TINYINT(1)", "BOOLEAN"))]
+    for chunk in pd.read_csv(filename, dtype=str, chunksize=chunk_size, encoding="utf-8", keep_default_na=False,
+                             na_values=[""]):
+        chunk = chunk[names]
+        for name in booleans:
+            chunk[name] = chunk[name].str.strip().str.lower().map(BOOLEAN_VALUES)
+        yield from chunk.astype(object).where(pd.notnull(chunk), None).itertuples(index=False, name=None)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='icd_table_loader.py', description='Bulk load ICD-11 tables through staging tables')
+    parser.add_argument('--names', help="CSV file for analytics.icd11_mms_en_name")
+    parser.add_argument('--hierarchy', help="CSV file for icd11_mms_en_hierarchy")
+    parser.add_argument('--postcoordination', help="CSV file for analytics.icd11_mms_en_postcoordination")
+    parser.add_argument('--method', choices=["insert", "load"], default="insert", help="Multi-row INSERTs or LOAD DATA LOCAL INFILE")
+    parser.add_argument('--batch-size', type=int, default=10000, help="Rows per INSERT batch / CSV chunk")
+    parser.add_argument('--database', help="Database name (default: $DB_NAME)")
+    parser.add_argument('--force', action='store_true',
+                        help="Swap a table in even if rows were dropped as duplicate keys or had an empty NOT NULL column")
+    args = parser.parse_args()
+
+    sources = {
+        "analytics.icd11_mms_en_name": args.names,
+        "icd11_mms_en_hierarchy": args.hierarchy,
+        "analytics.icd11_mms_en_postcoordination": args.postcoordination,
+    }
+    sources = {table: filename for table, filename in sources.items() if filename}
+    if not sources:
+        parser.error("Provide at least one of --names, --hierarchy or --postcoordination")
+
+    engine = get_engine(args.database, connect_args={"local_infile": True} if args.method == "load" else {})
+    start_time = time.time()
+    failed = []
+    for table, filename in sources.items():
+        try:
+            result = load_table(engine, table, rows_from_csv(filename, table, args.batch_size), args.method,
+                                args.batch_size, args.force)
+        except RuntimeError as e:
+            print(f"• {e}")
+            failed.append(table)
+            continue
+        print(f"• {table}: {result['rows']} of {result['sent']} rows stored in {result['load_seconds']} sec, "
+              f"indexed in {result['index_seconds']} sec")
+        for problem in result['problems']:
+            print(f"  • Warning: {problem}")
+    if failed:
+        print(f"❌ ERROR: {len(failed)} table(s) not swapped in: {', '.join(failed)}")
+        raise SystemExit(1)
+    print(f"✅ Tables swapped in after {round(time.time() - start_time, 2)} sec")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+'''
+Resumable, batched paraphrase generation for the Phase 3.2 Alpaca dataset.
+
+Script version of the paraphrase cell of Phase 3.1 (dmis-lab/meerkat-7b-v1.0 over the CIEL records
+of icd11_alpaca_v2.jsonl), with the same record selection, prompt and filters:
+- only records whose line contains "ciel" and not "synonym"; code from the first <code> tag of
+  "output", term from <input> (or the first line after 'Clinical concept to map:') of "input"
+- paraphrases are cut at the first line, cleaned of prefixes like "1. ", "• ", "- ", and dropped
+  when empty, equal to the term, longer than 3x its word count or repeated
+- up to 2 distinct paraphrases per term, written as {"code", "input", "paraphrase"} lines
+
+Prompts are generated in batches. Records are read in windows of --bucket-window batches and
+sorted by prompt length within the window, so each batch pads to a similar length (left padding).
+Every batch is appended to the output as soon as it is generated, and its terms are recorded in
+<output>.done. A re-run skips the terms already done, including those that produced no valid
+paraphrase; a last line cut off by a crash is truncated and its term processed again. Throughput
+(records/min) and the projected time to finish are logged as it goes.
+
+Usage:
+python paraphrase_dataset.py -i=./icd11_alpaca_v2.jsonl -o=./paraphrased_dataset.jsonl
+python paraphrase_dataset.py -i=./icd11_alpaca_v2.jsonl -o=./paraphrased_dataset.jsonl --batch-size=16 --beams=5
+
+CLI arguments:
+-i, --inputfile: Alpaca JSONL file (default: ./icd11_alpaca_v2.jsonl)
+-o, --outputfile: Paraphrase JSONL file, appended to on resume (default: ./paraphrased_dataset.jsonl)
+--model: Causal LM used for paraphrasing (default: dmis-lab/meerkat-7b-v1.0)
+--batch-size: Prompts per generate() call (default: 8)
+--bucket-window: Batches read and sorted by prompt length together (default: 32)
+--beams: Number of beams (default: 5)
+--return-sequences: Sequences returned per prompt (default: 4)
+--max-new-tokens: Maximum generated tokens per sequence (default: 96)
+--max-paraphrases: Maximum paraphrases kept per term (default: 2)
+--log-every: Log throughput and ETA every N batches (default: 10)
+--limit: Only process the first N pending terms
+'''
+
+import argparse
+import json
+import os
+import re
+import time
+from itertools import islice
+
+PROMPT_TEMPLATE = (
+    "Paraphrase the following medical term, preserving the meaning and "
+    "qualifiers:\n{term}\nParaphrases:"
+)
+
+
+def clean_prefix(text):
+    """Remove prefixes like '1. ', '• ', '- ' at the start of the string."""
+    return re.sub(r"^\s*(\d+[\.\)]|[-•])\s*", "", text).strip()
+
+
+def extract_code(output_field):
+    match = re.search(r"<code>([^<]+)</code>", output_field)
+    return match.group(1).strip() if match else None
+
+
+def extract_term(input_field):
+    match = re.search(r"<input>(.*?)</input>", input_field)
+    if match:
+        return match.group(1).strip()
+    # Fallback for older input format
+    return input_field.split("Clinical concept to map:")[1].splitlines()[0].strip()
+
+
+def read_terms(filename):
+    """Yield the unique (code, term) pairs of the CIEL, non-synonym records."""
+    seen = set()
+    with open(filename, 'r', encoding='utf-8') as f:
+        for line in f:
+            if "ciel" not in line or "synonym" in line:
+                continue
+            record = json.loads(line)
+            code = extract_code(record.get("output", ""))
+            if not code:
+                continue
+            try:
+                term = extract_term(record.get("input", ""))
+            except IndexError:
+                continue
+            if (code, term) not in seen:
+                seen.add((code, term))
+                yield code, term
+
+
+def read_jsonl(filename):
+    """
+    Records of a JSONL file appended to by run().
+
+    An undecodable last line without a newline was cut off by a crash mid-write: it is truncated from the
+    file (so the next append starts on a new line) and its term is processed again.
+    """
+    records = []
+    with open(filename, 'r+b') as f:
+        offset = 0
+        for line in f:
+            if line.strip():
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    if line.endswith(b"\n"):
+                        raise
+                    f.truncate(offset)
+                    print(f"• Truncated the incomplete last line of {filename}")
+                    return records
+            offset += len(line)
+        if offset and not line.endswith(b"\n"):
+            f.write(b"\n")
+    return records
+
+
+def read_done(output_filename):
+    """(code, term) pairs already processed: those in the output and those recorded in <output>.done."""
+    done = set()
+    if os.path.exists(output_filename):
+        done.update((record["code"], record["input"]) for record in read_jsonl(output_filename))
+    if os.path.exists(output_filename + ".done"):
+        done.update(tuple(record) for record in read_jsonl(output_filename + ".done"))
+    return done
+
+
+# Streaming filter stages over the decoded sequences of one term
+def first_lines(texts):
+    for text in texts:
+        yield text.strip().split("\n")[0]
+
+
+def cleaned(texts):
+    for text in texts:
+        yield clean_prefix(text).strip(" .")
+
+
+def valid(texts, term):
+    max_len = 3 * len(term.split())
+    seen = set()
+    for text in texts:
+        if not text or text.lower() == term.lower() or len(text.split()) > max_len or text in seen:
+            continue
+        seen.add(text)
+        yield text
+
+
+def filter_paraphrases(term, texts, max_paraphrases=2):
+    return list(islice(valid(cleaned(first_lines(texts)), term), max_paraphrases))
+
+
+def length_buckets(terms, tokenizer, batch_size, bucket_window):
+    """Group pending (code, term) pairs into batches of similar prompt length."""
+    terms = iter(terms)
+    while True:
+        window = list(islice(terms, batch_size * bucket_window))
+        if not window:
+            return
+        lengths = [len(ids) for ids in tokenizer([PROMPT_TEMPLATE.format(term=term) for _, term in window])["input_ids"]]
+        window = [item for _, item in sorted(zip(lengths, window), key=lambda pair: pair[0])]
+        for start in range(0, len(window), batch_size):
+            yield window[start:start + batch_size]
+
+
+class Paraphraser:
+    """Batched beam-search paraphrasing with a causal LM."""
+
+    def __init__(self, model_id="dmis-lab/meerkat-7b-v1.0", beams=5, return_sequences=4, max_new_tokens=96):
+        import torch
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+
+        self.torch = torch
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.tokenizer = AutoTokenizer.from_pretrained(model_id, padding_side="left")
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        self.model = AutoModelForCausalLM.from_pretrained(model_id, torch_dtype=torch.float16).to(self.device)
+        self.model.eval()
+        self.beams = beams
+        self.return_sequences = return_sequences
+        self.max_new_tokens = max_new_tokens
+
+    def generate(self, terms):
+        """Decoded continuations of each term's prompt; one list of return_sequences texts per term."""
+        prompts = [PROMPT_TEMPLATE.format(term=term) for term in terms]
+        inputs = self.tokenizer(prompts, return_tensors="pt", padding=True).to(self.device)
+        with self.torch.inference_mode():
+            outputs = self.model.generate(
+                **inputs,
+                max_new_tokens=self.max_new_tokens,
+                num_beams=self.beams,
+                num_return_sequences=self.return_sequences,
+                do_sample=False,
+                eos_token_id=self.tokenizer.eos_token_id,
+                pad_token_id=self.tokenizer.pad_token_id,
+            )
+        # With left padding every prompt ends at the same position
+        texts = self.tokenizer.batch_decode(outputs[:, inputs["input_ids"].shape[1]:], skip_special_tokens=True)
+        n = self.return_sequences
+        return [texts[i * n:(i + 1) * n] for i in range(len(terms))]
+
+
+def run(input_filename, output_filename, paraphraser, batch_size=8, bucket_window=32, max_paraphrases=2,
+        log_every=10, limit=None):
+    """Generate paraphrases for the pending terms, appending each batch to the output; returns counters."""
+    done = read_done(output_filename)
+    pending = [item for item in read_terms(input_filename) if item not in done]
+    if limit:
+        pending = pending[:limit]
+    print(f"• {len(done)} terms already done, {len(pending)} pending")
+
+    counts = {"terms": 0, "paraphrases": 0, "without_paraphrase": 0}
+    start_time = time.time()
+    with open(output_filename, 'a', encoding='utf-8') as f_out, open(output_filename + ".done", 'a', encoding='utf-8') as f_done:
+        batches = length_buckets(pending, paraphraser.tokenizer, batch_size, bucket_window)
+        for batch_number, batch in enumerate(batches, start=1):
+            generated = paraphraser.generate([term for _, term in batch])
+            for (code, term), texts in zip(batch, generated):
+                paraphrases = filter_paraphrases(term, texts, max_paraphrases)
+                for paraphrase in paraphrases:
+                    f_out.write(json.dumps({"code": code, "input": term, "paraphrase": paraphrase}, ensure_ascii=False) + "\n")
+                f_done.write(json.dumps([code, term], ensure_ascii=False) + "\n")
+                counts['paraphrases'] += len(paraphrases)
+                counts['without_paraphrase'] += not paraphrases
+            counts['terms'] += len(batch)
+            f_out.flush()
+            f_done.flush()
+
+            if batch_number % log_every == 0 or counts['terms'] == len(pending):
+                elapsed_minutes = (time.time() - start_time) / 60
+                rate = counts['terms'] / elapsed_minutes if elapsed_minutes else 0.0
+                eta_minutes = (len(pending) - counts['terms']) / rate if rate else 0.0
+                print(f"• {counts['terms']}/{len(pending)} terms, {counts['paraphrases']} paraphrases, "
+                      f"{rate:.1f} records/min, ETA {eta_minutes:.1f} min")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='paraphrase_dataset.py', description='Generate paraphrases of the CIEL terms of the Alpaca dataset')
+    parser.add_argument('-i', '--inputfile', default="./icd11_alpaca_v2.jsonl", help="Alpaca JSONL file")
+    parser.add_argument('-o', '--outputfile', default="./paraphrased_dataset.jsonl", help="Paraphrase JSONL file")
+    parser.add_argument('--model', default="dmis-lab/meerkat-7b-v1.0", help="Causal LM used for paraphrasing")
+    parser.add_argument('--batch-size', type=int, default=8, help="Prompts per generate() call")
+    parser.add_argument('--bucket-window', type=int, default=32, help="Batches read and sorted by prompt length together")
+    parser.add_argument('--beams', type=int, default=5, help="Number of beams")
+    parser.add_argument('--return-sequences', type=int, default=4, help="Sequences returned per prompt")
+    parser.add_argument('--max-new-tokens', type=int, default=96, help="Maximum generated tokens per sequence")
+    parser.add_argument('--max-paraphrases', type=int, default=2, help="Maximum paraphrases kept per term")
+    parser.add_argument('--log-every', type=int, default=10, help="Log throughput and ETA every N batches")
+    parser.add_argument('--limit', type=int, help="Only process the first N pending terms")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    paraphraser = Paraphraser(args.model, args.beams, args.return_sequences, args.max_new_tokens)
+    counts = run(args.inputfile, args.outputfile, paraphraser, args.batch_size, args.bucket_window,
+                 args.max_paraphrases, args.log_every, args.limit)
+    print(f"✅ {counts['terms']} terms processed ({counts['paraphrases']} paraphrases, "
+          f"{counts['without_paraphrase']} without a valid paraphrase), saved to: {args.outputfile}")
+    print(f"Total time: {round(time.time() - start_time, 2)} sec")
+
+
+if __name__ == "__main__":
+    main()
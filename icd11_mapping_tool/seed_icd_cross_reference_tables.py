@@ -0,0 +1,224 @@
+'''
+Load the WHO ICD-10 <-> ICD-11 cross-reference files into MySQL, in parallel and with indexes.
+
+Python counterpart of seed_icd_cross_reference_tables.sh, using the SQLAlchemy/pymysql settings of
+icd_db.py (DB_* environment variables). For every mapping file:
+- The table is (re)created without indexes, loaded, then indexed on its lookup columns
+  (icd10Code, icd11Code, Foundation and Linearization URIs), which is much faster than
+  maintaining the indexes during the load
+- Files are loaded concurrently, one connection per table, with LOAD DATA LOCAL INFILE or with
+  streamed batched INSERTs (--method=insert, for servers with local_infile disabled)
+- The row count of each table is checked against the number of data lines of its file
+
+Re-running is idempotent: tables whose row count already matches their file and that already have
+their indexes are skipped (use --force to reload them).
+
+Usage:
+python seed_icd_cross_reference_tables.py --input-dir=./mapping
+python seed_icd_cross_reference_tables.py --input-dir=./mapping --method=insert --workers=5 --force
+
+CLI arguments:
+--input-dir: Directory with the WHO mapping .txt files (default: ./mapping)
+--method: load (LOAD DATA LOCAL INFILE) or insert (batched INSERTs) (default: load)
+--workers: Number of tables loaded in parallel (default: 5)
+--batch-size: Rows per INSERT batch with --method=insert (default: 5000)
+--database: Database name (default: $DB_NAME)
+--force: Reload tables even if they are already complete
+'''
+
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from sqlalchemy import text
+
+from icd_db import get_engine
+
+# Table -> (file, columns, indexed columns)
+TABLES = {
+    "icd11_10To11MapToMultipleCategories": (
+        "10To11MapToMultipleCategories.txt",
+        [("10ClassKind", 16), ("Depth", 1), ("icd10Code", 7), ("icd10Chapter", 5), ("icd10Title", 186),
+         ("11ClassKind", 10), ("Depth_11", 1), ("ICD_11_Foundation_URI", 39), ("Linearization_release_URI", 67),
+         ("icd11Code", 28), ("icd11Chapter", 122), ("icd11Title", 403)],
+        ["icd10Code", "icd11Code", "ICD_11_Foundation_URI", "Linearization_release_URI"]
+    ),
+    "icd11_10To11MapToOneCategory": (
+        "10To11MapToOneCategory.txt",
+        [("10ClassKind", 16), ("10DepthInKind", 1), ("icd10Code", 7), ("icd10Chapter", 5), ("icd10Title", 186),
+         ("11ClassKind", 10), ("11DepthInKind", 1), ("ICD_11_FoundationURI", 39), ("Linearization_releaseURI", 67),
+         ("icd11Code", 28), ("icd11Chapter", 122), ("icd11Title", 403)],
+        ["icd10Code", "icd11Code", "ICD_11_FoundationURI", "Linearization_releaseURI"]
+    ),
+    "icd11_11To10MapToOneCategory": (
+        "11To10MapToOneCategory.txt",
+        [("Linearization_release_URI", 67), ("icd11Code", 7), ("icd11Chapter", 152), ("icd11Title", 212),
+         ("icd10Code", 10), ("icd10Chapter", 129), ("icd10Title", 160)],
+        ["icd11Code", "icd10Code", "Linearization_release_URI"]
+    ),
+    "icd11_foundation_10To11MapToOneCategory": (
+        "foundation_10To11MapToOneCategory.txt",
+        [("10ClassKind", 8), ("10DepthInKind", 1), ("icd10Code", 7), ("icd10Chapter", 5), ("icd10Title", 186),
+         ("ICD_11_FoundationURI", 39), ("icd11Title", 299), ("2024_Jan_21", 10), ("Unknown", 2)],
+        ["icd10Code", "ICD_11_FoundationURI"]
+    ),
+    "icd11_foundation_11To10MapToOneCategory": (
+        "foundation_11To10MapToOneCategory.txt",
+        [("Foundation_URI", 39), ("icd11Code", 7), ("icd11Chapter", 299), ("icd11Title", 300), ("icd10Code", 187),
+         ("icd10Title", 200)],
+        ["Foundation_URI", "icd11Code", "icd10Code"]
+    ),
+}
+
+VIEW_SQL = """
+CREATE OR REPLACE VIEW vw_icd10_codes AS
+SELECT
+    DISTINCT `cr`.`icd10Code` AS `code`,
+    `cr`.`icd10Title` AS `name`
+FROM
+    `icd11_10To11MapToMultipleCategories` `cr`
+"""
+
+
+def count_data_lines(filename):
+    """Number of non-empty lines after the header."""
+    with open(filename, 'rb') as f:
+        next(f, None)
+        return sum(1 for line in f if line.strip())
+
+
+def index_name(column):
+    return f"idx_{column}"
+
+
+def table_is_complete(conn, table, indexed_columns, expected_rows):
+    exists = conn.execute(text(
+        "SELECT COUNT(*) FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = :table"
+    ), {"table": table}).scalar()
+    if not exists:
+        return False
+    indexes = {row[0] for row in conn.execute(text(
+        "SELECT DISTINCT index_name FROM information_schema.statistics WHERE table_schema = DATABASE() AND table_name = :table"
+    ), {"table": table})}
+    if any(index_name(column) not in indexes for column in indexed_columns):
+        return False
+    return conn.execute(text(f"SELECT COUNT(*) FROM `{table}`")).scalar() == expected_rows
+
+
+def create_table(conn, table, columns):
+    column_sql = ",\n".join(f"`{name}` VARCHAR({size})" for name, size in columns)
+    conn.execute(text(f"DROP TABLE IF EXISTS `{table}`"))
+    conn.execute(text(f"CREATE TABLE `{table}` (\n{column_sql}\n)"))
+
+
+def load_data_infile(conn, table, filename):
+    conn.execute(text(f"""
+        LOAD DATA LOCAL INFILE :filename
+        INTO TABLE `{table}`
+        FIELDS TERMINATED BY '\\t'
+        LINES TERMINATED BY '\\n'
+        IGNORE 1 ROWS
+    """), {"filename": os.path.abspath(filename)})
+
+
+def load_batched_inserts(conn, table, columns, filename, batch_size=5000):
+    """Stream the file and insert it in batches, with the same field handling as LOAD DATA."""
+    names = [name for name, _ in columns]
+    placeholders = ", ".join(f":c{i}" for i in range(len(names)))
+    statement = text(f"INSERT INTO `{table}` ({', '.join(f'`{name}`' for name in names)}) VALUES ({placeholders})")
+
+    batch = []
+    with open(filename, 'r', encoding='utf-8') as f:
+        next(f, None)
+        for line in f:
+            if not line.strip():
+                continue
+            fields = line.rstrip("\n").split("\t")
+            fields += [""] * (len(names) - len(fields))
+            batch.append({f"c{i}": value for i, value in enumerate(fields[:len(names)])})
+            if len(batch) >= batch_size:
+                conn.execute(statement, batch)
+                batch = []
+    if batch:
+        conn.execute(statement, batch)
+
+
+def seed_table(engine, table, input_dir, method="load", batch_size=5000, force=False):
+    """
+    Create, load, index and check one table.
+
+    Returns:
+        Dictionary with the table, status, expected and loaded rows and elapsed seconds
+    """
+    filename, columns, indexed_columns = TABLES[table]
+    full_path = os.path.join(input_dir, filename)
+    if not os.path.exists(full_path):
+        return {"table": table, "status": f"file not found: {full_path}"}
+
+    start_time = time.time()
+    expected_rows = count_data_lines(full_path)
+    with engine.connect() as conn:
+        if not force and table_is_complete(conn, table, indexed_columns, expected_rows):
+            return {"table": table, "status": "skipped (complete)", "expected": expected_rows, "loaded": expected_rows,
+                    "seconds": round(time.time() - start_time, 2)}
+
+        create_table(conn, table, columns)
+        conn.commit()
+        if method == "load":
+            load_data_infile(conn, table, full_path)
+        else:
+            load_batched_inserts(conn, table, columns, full_path, batch_size)
+        conn.commit()
+
+        # Indexes are created once, after the load
+        index_sql = ", ".join(f"ADD INDEX `{index_name(column)}` (`{column}`)" for column in indexed_columns)
+        conn.execute(text(f"ALTER TABLE `{table}` {index_sql}"))
+        loaded_rows = conn.execute(text(f"SELECT COUNT(*) FROM `{table}`")).scalar()
+        conn.commit()
+
+    status = "ok" if loaded_rows == expected_rows else "row count mismatch"
+    return {"table": table, "status": status, "expected": expected_rows, "loaded": loaded_rows,
+            "seconds": round(time.time() - start_time, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='seed_icd_cross_reference_tables.py', description='Load the ICD-10/ICD-11 cross-reference tables')
+    parser.add_argument('--input-dir', default="./mapping", help="Directory with the WHO mapping .txt files")
+    parser.add_argument('--method', choices=["load", "insert"], default="load", help="LOAD DATA LOCAL INFILE or batched INSERTs")
+    parser.add_argument('--workers', type=int, default=len(TABLES), help="Number of tables loaded in parallel")
+    parser.add_argument('--batch-size', type=int, default=5000, help="Rows per INSERT batch with --method=insert")
+    parser.add_argument('--database', help="Database name (default: $DB_NAME)")
+    parser.add_argument('--force', action='store_true', help="Reload tables even if they are already complete")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    engine = get_engine(args.database, pool_size=args.workers, connect_args={"local_infile": True})
+    results = []
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = {
+            executor.submit(seed_table, engine, table, args.input_dir, args.method, args.batch_size, args.force): table
+            for table in TABLES
+        }
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {"table": futures[future], "status": f"error: {e}"}
+            results.append(result)
+            print(f"• {result['table']}: {result['status']}"
+                  + (f" ({result['loaded']}/{result['expected']} rows, {result['seconds']} sec)" if "loaded" in result else ""))
+
+    failed = [result['table'] for result in results if result['status'] not in ("ok", "skipped (complete)")]
+    if "icd11_10To11MapToMultipleCategories" not in failed:
+        with engine.begin() as conn:
+            conn.execute(text(VIEW_SQL))
+
+    if failed:
+        print(f"❌ ERROR: {len(failed)} table(s) not loaded: {', '.join(failed)}")
+        raise SystemExit(1)
+    print(f"✅ Cross-reference tables ready in {round(time.time() - start_time, 2)} sec")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+'''
+Offline benchmark suite for the mapping scripts, with recorded baselines and regression checks.
+
+Every benchmark runs on synthetic data of configurable size and top-n, without network access:
+- match: match() end to end (input read, chunking, $match request, candidate processing, output
+  frame) against an in-process stub $match server that generates deterministic candidates
+- evaluate: eval.evaluate_subset() on a synthetic match.py output
+- prompt: prompts.format_llm_judge_prompt() for each row and its top-n candidates
+- rank: MedicalTermRanker.rank_terms() over top-n candidates (skipped when the cross-encoder
+  model cannot be loaded, e.g. without transformers or a cached model)
+
+Each case is timed over --repeat runs (best run reported) and then run once more under tracemalloc
+for the peak Python memory. Results are written to a JSON baseline file with ops/sec (rows, prompts
+or rankings per second), latency per run and per op, and peak memory. The compare command flags
+cases whose throughput dropped or peak memory grew by more than --threshold.
+
+Usage:
+python benchmark.py run --sizes=1000,100000 --topn=5,50 -o=./benchmarks/baseline.json
+python benchmark.py run --sizes=1000 --benchmarks=match,evaluate --repeat=5 -o=./benchmarks/current.json
+python benchmark.py compare ./benchmarks/baseline.json ./benchmarks/current.json --threshold=0.10
+
+CLI arguments (run):
+--benchmarks: Comma-separated benchmarks to run (default: match,evaluate,prompt,rank)
+--sizes: Comma-separated numbers of rows (default: 1000,100000)
+--topn: Comma-separated top-n values (default: 5,50)
+--repeat: Timed runs per case (default: 3)
+--max-prompt-rows: Maximum rows formatted by the prompt benchmark (default: 10000)
+--max-rank-rows: Maximum rankings done by the rank benchmark (default: 200)
+--chunk: match() chunk size (default: 200)
+-o, --outputfile: JSON file for the results (default: ./benchmarks/baseline.json)
+
+CLI arguments (compare):
+baseline, current: JSON result files of two runs
+--threshold: Relative throughput drop or memory growth flagged as a regression (default: 0.10)
+'''
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+
+BENCHMARKS = ["match", "evaluate", "prompt", "rank"]
+
+WORDS = ["hemoglobin", "glucose", "serum", "plasma", "blood", "urine", "creatinine", "cholesterol", "count",
+         "automated", "mass", "volume", "fraction", "platelets", "sodium", "potassium", "panel", "ratio"]
+
+
+def synthetic_name(rng, num_words=4):
+    return " ".join(rng.choice(WORDS) for _ in range(num_words))
+
+
+def synthetic_candidates(row_number, name, limit):
+    """Deterministic $match candidates of a row: LOINC-like codes with decreasing scores, in shuffled order."""
+    rng = random.Random(row_number)
+    candidates = []
+    for j in range(limit):
+        prefix = "LP" if j % 3 == 1 else ""
+        candidates.append({
+            "id": f"{prefix}{row_number}-{j}",
+            "display_name": f"{name} {WORDS[j % len(WORDS)]}",
+            "concept_class": "Test",
+            "datatype": "Numeric",
+            "source": "LOINC",
+            "retired": False,
+            "search_meta": {"search_score": round(1.0 / (j + 1) + rng.random() * 1e-3, 6),
+                            "match_type": "very_high" if j == 0 else "low"},
+        })
+    rng.shuffle(candidates)
+    return candidates
+
+
+def synthetic_input(num_rows, seed=0):
+    """Input rows as match.py expects them, with the correct map among the candidates for most rows."""
+    rng = random.Random(seed)
+    return pd.DataFrame({
+        "name": [synthetic_name(rng) for _ in range(num_rows)],
+        "loinc_code": [f"{i + 1}-{rng.randrange(8)}" if i % 10 else "new" for i in range(num_rows)],
+    })
+
+
+def synthetic_match_output(num_rows, top_n, seed=0):
+    """A match.py output frame with top_n code/name/score columns."""
+    rng = random.Random(seed)
+    df = synthetic_input(num_rows, seed)
+    columns = {}
+    for i in range(top_n):
+        columns[f"{i+1:02d}_code"] = [f"{row + 1}-{(i + rng.randrange(2)) % top_n}" for row in range(num_rows)]
+        columns[f"{i+1:02d}_name"] = df["name"]
+        columns[f"{i+1:02d}_score"] = [round(1.0 / (i + 1), 4)] * num_rows
+    return pd.concat([df, pd.DataFrame(columns)], axis=1)
+
+
+class StubMatchHandler(BaseHTTPRequestHandler):
+    """Answers $match requests with synthetic_candidates() for every row."""
+
+    row_offset = 0
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        limit = int(parse_qs(urlparse(self.path).query).get("limit", ["5"])[0])
+        response = []
+        for row in body["rows"]:
+            row_number = int(row.get("row_number", 0))
+            response.append({"row": row, "results": synthetic_candidates(row_number, row.get("name", ""), limit)})
+        data = json.dumps(response).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@contextlib.contextmanager
+def stub_match_server():
+    """Run the stub $match server on a free local port; yields its $match URL."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubMatchHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}/concepts/$match/"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def measure(function, repeat):
+    """Time function() `repeat` times, then once under tracemalloc; returns (run seconds, peak MB)."""
+    seconds = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start_time)
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return seconds, peak / 1024 / 1024
+
+
+def bench_match(num_rows, top_n, args, workdir):
+    from match import match
+
+    input_filename = os.path.join(workdir, f"match_{num_rows}.csv")
+    if not os.path.exists(input_filename):
+        df = synthetic_input(num_rows)
+        df.insert(0, "row_number", range(1, num_rows + 1))
+        df.to_csv(input_filename, index=False)
+
+    with stub_match_server() as api_match_url:
+        def run():
+            with contextlib.redirect_stdout(io.StringIO()):
+                match(api_match_url=api_match_url, input_filename=input_filename, max_chunk_size=args.chunk,
+                      top_n=top_n, correct_map_column="loinc_code")
+        return num_rows, measure(run, args.repeat)
+
+
+def bench_evaluate(num_rows, top_n, args, workdir):
+    from eval import evaluate_subset
+
+    df = synthetic_match_output(num_rows, top_n)
+    return num_rows, measure(lambda: evaluate_subset(df, "loinc_code", top_n=top_n), args.repeat)
+
+
+def bench_prompt(num_rows, top_n, args, workdir):
+    from prompts import format_llm_judge_prompt
+
+    num_rows = min(num_rows, args.max_prompt_rows)
+    rng = random.Random(0)
+    rows = [{"name": synthetic_name(rng), "concept_class": "Test", "datatype": "Numeric"} for _ in range(num_rows)]
+    candidates = [synthetic_candidates(i, row["name"], top_n) for i, row in enumerate(rows)]
+
+    def run():
+        for row, row_candidates in zip(rows, candidates):
+            format_llm_judge_prompt(row, row_candidates)
+    return num_rows, measure(run, args.repeat)
+
+
+def bench_rank(num_rows, top_n, args, workdir):
+    from match import load_ranker
+
+    num_rows = min(num_rows, args.max_rank_rows)
+    ranker = load_ranker()
+    rng = random.Random(0)
+    queries = [synthetic_name(rng) for _ in range(num_rows)]
+    pools = [[(candidate["id"], candidate["display_name"]) for candidate in synthetic_candidates(i, query, top_n)]
+             for i, query in enumerate(queries)]
+
+    def run():
+        # A fresh in-memory cache per run, so every run scores the pairs with the model
+        ranker.cache.memory.clear()
+        for query, pool in zip(queries, pools):
+            ranker.rank_terms(query, pool)
+    return num_rows, measure(run, args.repeat)
+
+
+BENCHMARK_FUNCTIONS = {
+    "match": bench_match,
+    "evaluate": bench_evaluate,
+    "prompt": bench_prompt,
+    "rank": bench_rank,
+}
+
+
+def case_id(benchmark, num_rows, top_n):
+    return f"{benchmark}/rows={num_rows}/topn={top_n}"
+
+
+def run_benchmarks(args):
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for benchmark in args.benchmarks:
+            for num_rows in args.sizes:
+                for top_n in args.topn:
+                    key = case_id(benchmark, num_rows, top_n)
+                    try:
+                        ops, (seconds, peak_mb) = BENCHMARK_FUNCTIONS[benchmark](num_rows, top_n, args, workdir)
+                    except Exception as e:
+                        results[key] = {"status": f"skipped: {type(e).__name__}: {e}"}
+                        print(f"• {key}: {results[key]['status']}")
+                        continue
+                    best = min(seconds)
+                    results[key] = {
+                        "status": "ok",
+                        "ops": ops,
+                        "ops_per_sec": round(ops / best, 2) if best else None,
+                        "best_sec": round(best, 4),
+                        "median_sec": round(statistics.median(seconds), 4),
+                        "latency_us_per_op": round(best / ops * 1e6, 2) if ops else None,
+                        "peak_mb": round(peak_mb, 2),
+                    }
+                    print(f"• {key}: {results[key]['ops_per_sec']} ops/sec, {results[key]['best_sec']} sec best, "
+                          f"{results[key]['latency_us_per_op']} µs/op, {results[key]['peak_mb']} MB peak")
+    return {
+        "created": datetime.now().isoformat(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "settings": {"repeat": args.repeat, "chunk": args.chunk, "max_prompt_rows": args.max_prompt_rows,
+                     "max_rank_rows": args.max_rank_rows},
+        "results": results,
+    }
+
+
+def compare(baseline, current, threshold=0.10):
+    """
+    Compare two result files.
+
+    Returns:
+        List of (case, metric, baseline value, current value, relative change, regression flag)
+    """
+    rows = []
+    for key, current_result in current["results"].items():
+        baseline_result = baseline["results"].get(key)
+        if not baseline_result or baseline_result.get("status") != "ok" or current_result.get("status") != "ok":
+            continue
+        for metric, higher_is_better in (("ops_per_sec", True), ("peak_mb", False)):
+            old, new = baseline_result.get(metric), current_result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            regression = change < -threshold if higher_is_better else change > threshold
+            rows.append((key, metric, old, new, change, regression))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='benchmark.py', description='Offline benchmarks for the mapping scripts')
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run the benchmarks and record the results")
+    run_parser.add_argument('--benchmarks', default=",".join(BENCHMARKS), help="Comma-separated benchmarks to run")
+    run_parser.add_argument('--sizes', default="1000,100000", help="Comma-separated numbers of rows")
+    run_parser.add_argument('--topn', default="5,50", help="Comma-separated top-n values")
+    run_parser.add_argument('--repeat', type=int, default=3, help="Timed runs per case")
+    run_parser.add_argument('--max-prompt-rows', type=int, default=10000, help="Maximum rows formatted by the prompt benchmark")
+    run_parser.add_argument('--max-rank-rows', type=int, default=200, help="Maximum rankings done by the rank benchmark")
+    run_parser.add_argument('--chunk', type=int, default=200, help="match() chunk size")
+    run_parser.add_argument('-o', '--outputfile', default="./benchmarks/baseline.json", help="JSON file for the results")
+
+    compare_parser = subparsers.add_parser("compare", help="Flag regressions between two result files")
+    compare_parser.add_argument('baseline', help="Baseline JSON result file")
+    compare_parser.add_argument('current', help="Current JSON result file")
+    compare_parser.add_argument('--threshold', type=float, default=0.10,
+                                help="Relative throughput drop or memory growth flagged as a regression")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        args.benchmarks = [name.strip() for name in args.benchmarks.split(",") if name.strip()]
+        unknown = [name for name in args.benchmarks if name not in BENCHMARK_FUNCTIONS]
+        if unknown:
+            parser.error(f"Unknown benchmarks: {', '.join(unknown)}")
+        args.sizes = [int(size) for size in args.sizes.split(",")]
+        args.topn = [int(top_n) for top_n in args.topn.split(",")]
+        output = run_benchmarks(args)
+        directory = os.path.dirname(args.outputfile)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(args.outputfile, 'w') as f:
+            json.dump(output, f, indent=4)
+        print(f"\nResults saved to: {args.outputfile}")
+        return
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    rows = compare(baseline, current, args.threshold)
+    regressions = [row for row in rows if row[5]]
+    for key, metric, old, new, change, regression in rows:
+        print(f"{'REGRESSION' if regression else 'ok':<10} {key} {metric}: {old} -> {new} ({change:+.1%})")
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) beyond {args.threshold:.0%}")
+        sys.exit(1)
+    print(f"\nNo regressions beyond {args.threshold:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -28,6 +28,11 @@ python3 mapeval.py --csv=./samples/batch01.csv -t=[your-token-here]
     -e=https://api.dev.openconceptlab.org --endpoint=/concepts/\$match/ -v=1
     --outputfile=./output/batch01_output.json --summaryfile=./output/batch01_output_summary.csv
 
+5. Stream the per-row analytics of every run to a columnar file (./output/analytics/<key>.parquet,
+   or .npz without pyarrow) instead of keeping the candidate scores in the JSON output:
+python3 mapeval.py --csv=./samples/batch01.csv -t=[your-token-here] --analyticsdir=./output/analytics
+    --summaryfile=./output/batch01_output_summary.csv
+
 Further documentation:
 https://docs.openconceptlab.org/en/latest/oclapi/apireference/match.html
 '''
@@ -35,28 +40,20 @@ import argparse
 import time
 from datetime import datetime
 import json
-import requests
-import pandas as pd
+import os
+from ocl_mapping import MatchClient, TopNEvaluator, chunked, json_loads, prepare_rows, read_table, sort_candidates
 
 def mapeval(key="", api_token="", api_match_url="", input_filename="", target_repo="",
             correct_map_column_name="", column_map={}, semantic=False, max_chunk_size=200,
-            knn_num_candidates=1000, top_n_threshold=5, knearest=5, verbosity=0):
+            knn_num_candidates=1000, top_n_threshold=5, knearest=5, verbosity=0,
+            analytics_filename="", analytics_format="auto"):
     start_time = time.time()
 
     # CONSTANTS
     list_algorithm_keys = ["id", "name", "synonyms", "description", "concept_class", "datatype",
                            "same_as_map_codes", "other_map_codes"]
-    params = {
-        "includeSearchMeta": True,
-        "semantic": semantic,
-        "limit": top_n_threshold,
-        "kNearest": knearest,
-        "numCandidates": knn_num_candidates,
-        "bestMatch": False
-    }
-    headers = {}
-    if api_token:
-        headers["Authorization"] = "Token %s" % (api_token)
+    client = MatchClient(api_match_url, target_repo, api_token=api_token, semantic=semantic,
+                         knn_num_candidates=knn_num_candidates, knearest=knearest, limit=top_n_threshold)
 
     # Print script configuration
     if verbosity:
@@ -78,59 +75,46 @@ def mapeval(key="", api_token="", api_match_url="", input_filename="", target_re
             print("  Column Mapping: ", json.dumps(column_map, indent=4))
 
     # Load input file
-    import_file_type = input_filename.split('.')[-1]  # e.g. csv, xlsx
-    if import_file_type == 'csv':
-        df = pd.read_csv(input_filename)
-    elif import_file_type == 'xlsx':
-        df = pd.read_excel(input_filename)
-    else:
-        print("unknown file type", import_file_type)
-        exit()
+    df = read_table(input_filename)
 
     # Process import file: Change column names, convert to dictionary and chunk
     df.rename(columns=column_map, inplace=True)
-    data = json.loads(df.to_json(orient="records"))  # serialize/deserialize to get rid of funky datatypes
-    list_of_chunked_data = [data[i * max_chunk_size:(i + 1) * max_chunk_size] for i in range((len(data) + max_chunk_size - 1) // max_chunk_size)]
+    data = json_loads(df.to_json(orient="records"))  # serialize/deserialize to get rid of funky datatypes
+    list_of_chunked_data = chunked(data, max_chunk_size)
     if verbosity:
         print("\nINPUT FILE:")
         print("  Total Rows: ", len(df))
         print("  # Chunks: ", len(list_of_chunked_data))
 
     # Match and evaluate one chunk at a time
-    num_correct_matches_in_top_n = [0] * top_n_threshold
-    num_auto_match = 0 # 'search_meta.match_type=very_high'
-    num_excluded = 0
-    num_new_concept_proposed = 0
+    evaluator = TopNEvaluator(correct_map_column_name, top_n_threshold)
     chunk_num = 0
-    unmatched = []
     row_num = 0
     row_results = []
     cumulative_chunk_elapsed_time = 0
+
+    # Per-row analytics are streamed to a columnar file when analytics_filename is set
+    analytics_writer = None
+    if analytics_filename:
+        # Lazy import: numpy/pandas (and pyarrow) are only needed for the analytics files
+        from row_analytics import RowAnalyticsWriter
+        analytics_writer = RowAnalyticsWriter(analytics_filename, top_n_threshold, analytics_format)
     print("\nMATCHING:")
     for chunk in list_of_chunked_data:
         chunk_match_count = 0
-        new_chunk = []
-        for row in chunk:
-            row['name'] = row.get('name', None) or ""
-            row['synonyms'] = [row['name']]
-            row.pop('id', None)
-            new_chunk.append(row)
+        chunk_analytics = []
+        new_chunk = prepare_rows(chunk)
 
         # Request match results
         chunk_num += 1
-        payload = {
-            "rows": new_chunk,
-            "target_repo_url": target_repo
-        }
         if verbosity:
             print(f"Chunk #: {chunk_num} ({len(new_chunk)} rows)")
-            print(f"  {api_match_url} {json.dumps(params)}")
+            print(f"  {api_match_url} {json.dumps(client.params)}")
         chunk_start_time = time.time()
-        r = requests.post(api_match_url, json=payload, params=params, headers=headers)
+        response = client.match(new_chunk, chunk_num=chunk_num)
         chunk_elapsed_time = time.time() - chunk_start_time
         cumulative_chunk_elapsed_time += chunk_elapsed_time
         chunk_average_time_per_row = chunk_elapsed_time / len(new_chunk)
-        response = r.json()
         if verbosity:
             print ("  Chunk Match Time: ", round(chunk_elapsed_time, 2), " (", round(chunk_average_time_per_row, 2), "sec/row )")
 
@@ -139,36 +123,39 @@ def mapeval(key="", api_token="", api_match_url="", input_filename="", target_re
             row_num += 1
 
             # Sort row_matches["results"] by search_meta["search_score"]
-            row_matches["results"] = sorted(row_matches["results"], key=lambda candidate: candidate["search_meta"]["search_score"], reverse=True)
+            row_matches["results"] = sort_candidates(row_matches["results"])
 
             # Evaluate top-n metric
-            if correct_map_column_name:
-                if not row_matches["row"][correct_map_column_name]:
-                    num_excluded += 1
-                elif str(row_matches["row"][correct_map_column_name]).lower() == "new":
-                    num_new_concept_proposed += 1
-                else:
-                    matched_candidate_index = next((index for index, candidate in enumerate(row_matches["results"]) if str(row_matches["row"][correct_map_column_name]) == str(candidate["id"])), None)
-                    if matched_candidate_index is not None:
-                        matched_candidate = row_matches["results"][matched_candidate_index]
-                        if verbosity >= 2:
-                            print(str(matched_candidate["id"]), " ", sep="", end="")
-                        if matched_candidate['search_meta']['match_type'] == 'very_high':
-                            num_auto_match += 1
-                        for i in range(matched_candidate_index, top_n_threshold):
-                            num_correct_matches_in_top_n[i] += 1
-                        chunk_match_count += 1
-                    else:
-                        unmatched.append(row_matches['row'])
+            row_status, correct_rank, matched_candidate = evaluator.evaluate(row_matches["row"], row_matches["results"])
+            if row_status == "matched":
+                if verbosity >= 2:
+                    print(str(matched_candidate["id"]), " ", sep="", end="")
+                chunk_match_count += 1
 
             # Sort candidate by search_meta["search_score"] - remove after this is applied in the API
             candidate_scores = [candidate["search_meta"]["search_score"] for candidate in row_matches["results"]]
 
             # Store candidate scores for analytics
-            row_results.append(candidate_scores.copy())
-
+            if analytics_writer is not None:
+                chunk_analytics.append({
+                    "row_num": row_num,
+                    "status": row_status,
+                    "correct_rank": correct_rank,
+                    "correct_match_type": matched_candidate["search_meta"].get("match_type", "") if matched_candidate else "",
+                    "top_match_type": row_matches["results"][0]["search_meta"].get("match_type", "") if row_matches["results"] else "",
+                    "num_candidates": len(candidate_scores),
+                    "scores": candidate_scores,
+                })
+            else:
+                row_results.append(candidate_scores.copy())
+
+        if analytics_writer is not None:
+            analytics_writer.append(chunk_analytics)
         print("  Chunk Match Count: ", f"{chunk_match_count} out of {len(new_chunk)}  ({round((chunk_match_count/len(new_chunk)) * 100, 2)}%)")
 
+    if analytics_writer is not None:
+        analytics_writer.close()
+
     # Results
     elapsed_seconds = time.time() - start_time
     chunk_average_time_per_row = cumulative_chunk_elapsed_time / len(df)
@@ -176,28 +163,28 @@ def mapeval(key="", api_token="", api_match_url="", input_filename="", target_re
         "key": key,
         "timestamp": datetime.now().isoformat(),
         "total_rows": len(df),
-        "num_auto_matches": num_auto_match,
-        "num_correct_matches_in_top_n": num_correct_matches_in_top_n,
-        "num_excluded_rows": num_excluded,
-        "num_new_concept_proposed": num_new_concept_proposed,
+        **evaluator.metrics(),
         "total_elapsed_seconds": elapsed_seconds,
         "total_match_seconds": cumulative_chunk_elapsed_time,
         "total_processing_seconds": elapsed_seconds - cumulative_chunk_elapsed_time,
         "average_match_seconds_per_row": chunk_average_time_per_row,
-        "row_candidate_scores": row_results
     }
+    if analytics_writer is not None:
+        results["row_analytics_file"] = analytics_writer.path
+    else:
+        results["row_candidate_scores"] = row_results
 
     # Report results
     if verbosity:
         print("\nRESULTS:")
         print("  total_rows:", len(df))
-        print("  num_auto_matches: ", num_auto_match)
+        print("  num_auto_matches: ", evaluator.num_auto_match)
         print("  num_correct_matches_in_top_n: ", end="")
-        for i, value in enumerate(num_correct_matches_in_top_n, start=1):
+        for i, value in enumerate(evaluator.num_correct_matches_in_top_n, start=1):
             print(f"{i}:{value}", end=" ")
-        print("\n  num_excluded_rows: ", num_excluded)
-        print("  num_new_concept_proposed: ", num_new_concept_proposed)
-        print("  num_to_match: ", len(df) - num_new_concept_proposed - num_excluded)
+        print("\n  num_excluded_rows: ", evaluator.num_excluded)
+        print("  num_new_concept_proposed: ", evaluator.num_new_concept_proposed)
+        print("  num_to_match: ", len(df) - evaluator.num_new_concept_proposed - evaluator.num_excluded)
         print(f"  Total Elapsed Seconds: {round(elapsed_seconds, 2)} sec")
         print(f"  Total Match Seconds: {round(cumulative_chunk_elapsed_time,2)} sec")
         print(f"  Total Processing Seconds: {round(results['total_processing_seconds'],2)} sec")
@@ -205,34 +192,12 @@ def mapeval(key="", api_token="", api_match_url="", input_filename="", target_re
 
     # Print unmatched rows
     if verbosity >= 3:
-        print("\n\nUNMATCHED:", len(unmatched))
-        print(json.dumps(unmatched, indent=4))
+        print("\n\nUNMATCHED:", len(evaluator.unmatched))
+        print(json.dumps(evaluator.unmatched, indent=4))
 
     return results
 
 
-# CLI
-parser = argparse.ArgumentParser(prog='mapeval.py', description='Evaluate the performance of a matching algorithm')
-parser.add_argument('-k', '--key', help="Key to identify the run")
-parser.add_argument('-t', '--token', required=True, help="OCL API token")
-parser.add_argument('-i', '--inputfile', help="File of input data to be mapped")
-parser.add_argument('-r', '--repo', help="Map target repo, e.g. /orgs/CIEL/sources/CIEL/v2024-10-04/", default="/orgs/CIEL/sources/CIEL/v2024-10-04/")
-parser.add_argument('-e', '--env', default="http://localhost:8000", help="OCL API environment, e.g. https://api.qa.openconceptlab.org")
-parser.add_argument('--endpoint', default="/concepts/$match/", help="$match endpoint, e.g. /concepts/$match/")
-parser.add_argument('--correctmap', default="correct_map_concept_id", help="Column name of the correct map")
-parser.add_argument('--columnmap_filename', help="JSON file containing column mappings")
-parser.add_argument('-s', '--semantic', default='false', choices=['true', 'false'])
-parser.add_argument('-c', '--chunk', type=int, default=200, help="Max chunk size to send to $match algorithm at a time")
-parser.add_argument('--numcandidates', type=int, default=5000, help="Approximate number of nearest neighbor candidates to consider on each shard")
-parser.add_argument('--knearest', type=int, default=5, help="Number of nearest neighbors to consider for each row")
-parser.add_argument('-n', '--topn', type=int, default=5, help="Number of results to consider for top-n test")
-parser.add_argument('-v', '--verbosity', type=int, default=0)
-parser.add_argument('-o', '--outputfile', help="Analytics output file to write the results")
-parser.add_argument('--csv', help="CSV file with rows of mapeval parameters")
-parser.add_argument('--summaryfile', help="Summary output CSV file")
-args = parser.parse_args()
-
-
 # Function to run mapeval with given arguments
 def run_mapeval_with_args(args):
     # Convert columnmap_filename argument to dictionary, if provided
@@ -256,98 +221,133 @@ def run_mapeval_with_args(args):
         knn_num_candidates=int(args.numcandidates),
         top_n_threshold=int(args.topn),
         knearest=int(args.knearest),  # Pass knearest to mapeval
-        verbosity=int(args.verbosity)
+        verbosity=int(args.verbosity),
+        analytics_filename=os.path.join(args.analyticsdir, str(args.key)) if args.analyticsdir else "",
+        analytics_format=args.analyticsformat
     )
 
     run_results["args"] = vars(args)
     return run_results
 
 
-# Run mapeval for each CSV row or just a single set of CLI arguments
-mapeval_results = []
-if args.csv:
-    verbosity = int(args.verbosity)
-    csv_df = pd.read_csv(args.csv)
-    csv_row_number = 0
-    if verbosity:
-        print(f"\nCSV mode: {args.csv}")
-    for index, row in csv_df.iterrows():
-        csv_row_number += 1
-
-        # Skip row if 'skip' is set to True in the CSV
-        if row.get('skip', False):
-            if verbosity:
-                print(f"\ncsv-row[{csv_row_number}]:{row.get('key', '')}  SKIPPED")
-            continue
-
-        # Set arguments for the current row
-        row_args = argparse.Namespace(
-            key=row.get('key', f"mapeval_{csv_row_number}"),
-            token=row.get('token', args.token),
-            inputfile=row.get('inputfile', args.inputfile),
-            repo=row.get('repo', args.repo),
-            env=row.get('env', args.env),
-            endpoint=row.get('endpoint', args.endpoint),
-            correctmap=row.get('correctmap', args.correctmap),
-            columnmap_filename=row.get('columnmap_filename', args.columnmap_filename),
-            semantic=row.get('semantic', args.semantic),
-            chunk=row.get('chunk', args.chunk),
-            numcandidates=row.get('numcandidates', args.numcandidates),
-            topn=row.get('topn', args.topn),
-            knearest=row.get('knearest', args.knearest),
-            verbosity=verbosity
-        )
-
-        # Run mapeval with the current row arguments
+def main():
+    parser = argparse.ArgumentParser(prog='mapeval.py', description='Evaluate the performance of a matching algorithm')
+    parser.add_argument('-k', '--key', help="Key to identify the run")
+    parser.add_argument('-t', '--token', required=True, help="OCL API token")
+    parser.add_argument('-i', '--inputfile', help="File of input data to be mapped")
+    parser.add_argument('-r', '--repo', help="Map target repo, e.g. /orgs/CIEL/sources/CIEL/v2024-10-04/", default="/orgs/CIEL/sources/CIEL/v2024-10-04/")
+    parser.add_argument('-e', '--env', default="http://localhost:8000", help="OCL API environment, e.g. https://api.qa.openconceptlab.org")
+    parser.add_argument('--endpoint', default="/concepts/$match/", help="$match endpoint, e.g. /concepts/$match/")
+    parser.add_argument('--correctmap', default="correct_map_concept_id", help="Column name of the correct map")
+    parser.add_argument('--columnmap_filename', help="JSON file containing column mappings")
+    parser.add_argument('-s', '--semantic', default='false', choices=['true', 'false'])
+    parser.add_argument('-c', '--chunk', type=int, default=200, help="Max chunk size to send to $match algorithm at a time")
+    parser.add_argument('--numcandidates', type=int, default=5000, help="Approximate number of nearest neighbor candidates to consider on each shard")
+    parser.add_argument('--knearest', type=int, default=5, help="Number of nearest neighbors to consider for each row")
+    parser.add_argument('-n', '--topn', type=int, default=5, help="Number of results to consider for top-n test")
+    parser.add_argument('-v', '--verbosity', type=int, default=0)
+    parser.add_argument('-o', '--outputfile', help="Analytics output file to write the results")
+    parser.add_argument('--csv', help="CSV file with rows of mapeval parameters")
+    parser.add_argument('--summaryfile', help="Summary output CSV file")
+    parser.add_argument('--analyticsdir', help="Directory for per-row analytics files (<key>.parquet or <key>.npz) of each run")
+    parser.add_argument('--analyticsformat', default="auto", choices=['auto', 'parquet', 'npz'],
+                        help="Per-row analytics file format (auto: parquet if pyarrow is installed, else npz)")
+    args = parser.parse_args()
+
+    # Lazy import to keep CLI startup (e.g. --help) fast
+    import pandas as pd
+
+    # Run mapeval for each CSV row or just a single set of CLI arguments
+    mapeval_results = []
+    if args.csv:
+        verbosity = int(args.verbosity)
+        csv_df = pd.read_csv(args.csv)
+        csv_row_number = 0
         if verbosity:
-            print(f"\ncsv-row[{csv_row_number}]:{row.get('key', '')}")
-        mapeval_results.append(run_mapeval_with_args(row_args))
-else:
-    if not hasattr(args, 'key') or not args.key:
-        args.key = "mapeval"
-    mapeval_results.append(run_mapeval_with_args(args))
-
-# Generate summary results of the entire run e.g. {"summary": [...], "results": [...]}
-overall_summary = []
-for result in mapeval_results:
-    result_summary = {}
-    result_summary["key"] = result.get("key", "")
-    result_summary["total_rows"] = result.get("total_rows", 0)
-    for i, value in enumerate(result["num_correct_matches_in_top_n"]):
-        result_summary[f"top_{i+1}"] = value
-    result_summary["num_auto_matches"] = result.get("num_auto_matches", 0)
-    result_summary["total_elapsed_seconds"] = result.get("total_elapsed_seconds", 0)
-    result_summary["average_match_seconds_per_row"] = result.get("average_match_seconds_per_row", 0)
-    for key in result.keys():
-        if key in ["key", "total_rows", "num_auto_matches", "total_elapsed_seconds",
-                   "average_match_seconds_per_row", "args", "row_candidate_scores",
-                   "num_correct_matches_in_top_n", "timestamp"]:
-            continue
-        elif isinstance(result[key], list) or isinstance(result[key], dict):
-            continue
-        result_summary[key] = result[key]
-    for key in result["args"].keys():
-        if key in ["key", "token"]:
-            continue
-        result_summary[f"args_{key}"] = result["args"][key]
-    result_summary["timestamp"] = result.get("timestamp", "")
-    overall_summary.append(result_summary)
-if args.verbosity >= 2:
-    print("\nOVERALL SUMMARY:")
-    print(json.dumps(overall_summary, indent=4))
-
-# Write summary output file as CSV (if specified)
-if args.summaryfile:
-    summary_df = pd.DataFrame(overall_summary)
-    summary_df.to_csv(args.summaryfile, index=False)
-
-# Write analytics output file (of the entire run)
-final_output = {"summary": overall_summary, "results": mapeval_results}
-if args.outputfile:
-    with open(args.outputfile, 'w') as f:
-        f.write(json.dumps(final_output, indent=4))
-
-# Print results of the entire run
-if args.verbosity >= 2:
-    print("\nFINAL RESULTS:")
-    print(json.dumps(mapeval_results, indent=4))
+            print(f"\nCSV mode: {args.csv}")
+        for index, row in csv_df.iterrows():
+            csv_row_number += 1
+
+            # Skip row if 'skip' is set to True in the CSV
+            if row.get('skip', False):
+                if verbosity:
+                    print(f"\ncsv-row[{csv_row_number}]:{row.get('key', '')}  SKIPPED")
+                continue
+
+            # Set arguments for the current row
+            row_args = argparse.Namespace(
+                key=row.get('key', f"mapeval_{csv_row_number}"),
+                token=row.get('token', args.token),
+                inputfile=row.get('inputfile', args.inputfile),
+                repo=row.get('repo', args.repo),
+                env=row.get('env', args.env),
+                endpoint=row.get('endpoint', args.endpoint),
+                correctmap=row.get('correctmap', args.correctmap),
+                columnmap_filename=row.get('columnmap_filename', args.columnmap_filename),
+                semantic=row.get('semantic', args.semantic),
+                chunk=row.get('chunk', args.chunk),
+                numcandidates=row.get('numcandidates', args.numcandidates),
+                topn=row.get('topn', args.topn),
+                knearest=row.get('knearest', args.knearest),
+                verbosity=verbosity,
+                analyticsdir=args.analyticsdir,
+                analyticsformat=args.analyticsformat
+            )
+
+            # Run mapeval with the current row arguments
+            if verbosity:
+                print(f"\ncsv-row[{csv_row_number}]:{row.get('key', '')}")
+            mapeval_results.append(run_mapeval_with_args(row_args))
+    else:
+        if not hasattr(args, 'key') or not args.key:
+            args.key = "mapeval"
+        mapeval_results.append(run_mapeval_with_args(args))
+
+    # Generate summary results of the entire run e.g. {"summary": [...], "results": [...]}
+    overall_summary = []
+    for result in mapeval_results:
+        result_summary = {}
+        result_summary["key"] = result.get("key", "")
+        result_summary["total_rows"] = result.get("total_rows", 0)
+        for i, value in enumerate(result["num_correct_matches_in_top_n"]):
+            result_summary[f"top_{i+1}"] = value
+        result_summary["num_auto_matches"] = result.get("num_auto_matches", 0)
+        result_summary["total_elapsed_seconds"] = result.get("total_elapsed_seconds", 0)
+        result_summary["average_match_seconds_per_row"] = result.get("average_match_seconds_per_row", 0)
+        for key in result.keys():
+            if key in ["key", "total_rows", "num_auto_matches", "total_elapsed_seconds",
+                       "average_match_seconds_per_row", "args", "row_candidate_scores",
+                       "num_correct_matches_in_top_n", "timestamp"]:
+                continue
+            elif isinstance(result[key], list) or isinstance(result[key], dict):
+                continue
+            result_summary[key] = result[key]
+        for key in result["args"].keys():
+            if key in ["key", "token"]:
+                continue
+            result_summary[f"args_{key}"] = result["args"][key]
+        result_summary["timestamp"] = result.get("timestamp", "")
+        overall_summary.append(result_summary)
+    if args.verbosity >= 2:
+        print("\nOVERALL SUMMARY:")
+        print(json.dumps(overall_summary, indent=4))
+
+    # Write summary output file as CSV (if specified)
+    if args.summaryfile:
+        summary_df = pd.DataFrame(overall_summary)
+        summary_df.to_csv(args.summaryfile, index=False)
+
+    # Write analytics output file (of the entire run)
+    final_output = {"summary": overall_summary, "results": mapeval_results}
+    if args.outputfile:
+        with open(args.outputfile, 'w') as f:
+            f.write(json.dumps(final_output, indent=4))
+
+    # Print results of the entire run
+    if args.verbosity >= 2:
+        print("\nFINAL RESULTS:")
+        print(json.dumps(mapeval_results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -12,17 +12,29 @@ python match.py -t=[your-token-here] -i=./samples/sample01.csv -o=./output/resul
 3. With top-n calculation (adds a "top-n" column showing which candidate matched the correct map):
 python match.py -t=[your-token-here] -i=./samples/sample01.csv -o=./output/results.csv -r=/orgs/CIEL/sources/CIEL/v2024-10-04/ -e=https://api.dev.openconceptlab.org --correctmap=loinc_code -n=5
 
-4. With LOINC type filtering (only return LOINC Part codes):
-python match.py -t=[your-token-here] -i=./samples/sample01.csv -o=./output/results.csv -r=/orgs/CIEL/sources/CIEL/v2024-10-04/ -e=https://api.dev.openconceptlab.org --filter-loinc-type=Part --filter-fetch-factor=3
+4. With LOINC type filtering (only return LOINC Part codes; rows left short are re-queried with a limit growing 3x, up to 50;
+   with -v=1 the candidates requested are printed next to what --filter-fetch-strategy=fixed would request):
+python match.py -t=[your-token-here] -i=./samples/sample01.csv -o=./output/results.csv -r=/orgs/CIEL/sources/CIEL/v2024-10-04/ -e=https://api.dev.openconceptlab.org --filter-loinc-type=Part --filter-fetch-factor=3 --filter-fetch-max=50
 
 5. With both top-n calculation and LOINC filtering:
 python match.py -t=[your-token-here] -i=./samples/sample01.csv -o=./output/results.csv -r=/orgs/CIEL/sources/CIEL/v2024-10-04/ -e=https://api.dev.openconceptlab.org --correctmap=loinc_code --filter-loinc-type=LOINC -n=10
 
+6. With a local cross-encoder rerank of the $match candidates (or --rerank-url=http://localhost:8765 to use a running rank_server.py):
+python match.py -t=[your-token-here] -i=./samples/sample01.csv -o=./output/results.csv -r=/orgs/CIEL/sources/CIEL/v2024-10-04/ -e=https://api.dev.openconceptlab.org --correctmap=loinc_code --rerank
+
+7. Against two versions of a repository in one run (one column group and top-n column per version, e.g. CIEL_v2024-10-04_01_code):
+python match.py -t=[your-token-here] -i=./samples/sample01.csv -o=./output/results.csv -r=/orgs/CIEL/sources/CIEL/v2024-10-04/,/orgs/CIEL/sources/CIEL/v2025-02-12/ -e=https://api.dev.openconceptlab.org --correctmap=correct_map_concept_id
+
+8. Nightly incremental refresh (the first run matches every row; later runs only re-query new or changed rows):
+python match.py -t=[your-token-here] -i=./samples/sample01.csv -o=./output/results.csv --baseline=./output/results.csv -r=/orgs/CIEL/sources/CIEL/v2024-10-04/ -e=https://api.dev.openconceptlab.org --baseline-key=id --change-report=./output/changes.json
+
 CLI arguments:
 -i, --inputfile: Input file
 -e, --env: environment, e.g. https://api.dev.openconceptlab.org
 -t, --token: OCL API token
--r, --repo: Target repository, e.g. /orgs/CIEL/sources/CIEL/v2024-10-04/
+-r, --repo: Target repository, e.g. /orgs/CIEL/sources/CIEL/v2024-10-04/, or a comma-separated list of repositories; each chunk
+    is sent to all of them concurrently and the output gets one prefixed group of columns per repository
+--repo-labels: Comma-separated column prefixes for the repositories (default: source and version, e.g. CIEL_v2024-10-04)
 --endpoint: $match endpoint, e.g. /concepts/$match/
 -s, --semantic: Semantic search
 -v, --verbosity: Verbosity
@@ -34,132 +46,126 @@ CLI arguments:
 --columnmap_filename: JSON file containing mapping columns in the input file to fields that the $match endpoint expects
 --correctmap: Column name containing the correct map for top-n calculation (adds a top-n column to output)
 --filter-loinc-type: Filter candidates by LOINC code type (LOINC, Part, Group, List, Answers)
---filter-fetch-factor: Multiplier for fetching extra candidates when filtering (default: 2.0)
+--filter-fetch-factor: Multiplier for fetching extra candidates when filtering or reranking (default: 2.0); adaptive
+    re-queries grow the limit by this factor, but at least 2x
+--filter-fetch-strategy: adaptive (re-query only rows left short after LOINC filtering, with a limit growing by
+    max(filter-fetch-factor, 2); every re-query fetches the whole candidate list again) or fixed (always fetch
+    top-n x filter-fetch-factor) (default: adaptive)
+--filter-fetch-max: Maximum $match limit for adaptive re-queries (default: 10 x top-n)
+--rerank: Rerank the $match candidates of each row with the local cross-encoder (MedicalTermRanker)
+--rerank-url: Rerank using a running cross-encoder rank server instead of loading the model in-process
+--rerank-batch-size: Number of (row, candidate) pairs per cross-encoder forward pass (default: 64)
+--rerank-cache: SQLite file to cache cross-encoder pair scores across runs (local --rerank only)
+--baseline: Previous output file (may be the output file itself); only rows that are new or changed since then (by a hash
+    of their fields after the column map and the run settings, saved in a match-hash column) are re-matched
+--baseline-key: Input column identifying a row across runs, to report re-matched rows as new or changed
+--change-report: JSON file listing the re-matched and removed rows of an incremental run
+--trace: Write a Chrome trace JSON of the pipeline stages and counters (open in chrome://tracing or ui.perfetto.dev)
+--profile: Profile the run with cprofile or pyinstrument
+--profile-output: File for the profile (.prof for cprofile, .html for pyinstrument; default: print to console)
 '''
 
 import argparse
 import time
 import json
-import requests
-import pandas as pd
 import sys
 import os
-from prompts import format_llm_judge_prompt, parse_llm_response
+from concurrent.futures import ThreadPoolExecutor
+from ocl_mapping import (HASH_COLUMN, Baseline, MatchClient, ResultBuffer, change_report, chunked, correct_map_status,
+                         correct_rank, filter_candidates, get_llm_recommendation, json_dumps, json_loads, llm_failed,
+                         load_ranker,
+                         prepare_rows, read_table, refetch_short_rows, rerank_candidates, row_hashes, run_fingerprint,
+                         sort_candidates, write_table)
+from tracing import Tracer, profiled
 
 
-def matches_loinc_type(code, loinc_type):
+def label_targets(target_repos, labels=None):
     """
-    Check if a LOINC code matches the specified type based on prefix.
-    
-    LOINC Code Types:
-    - LOINC: Regular codes (no special prefix like LP, LG, LL, LA)
-    - Part: LP prefix
-    - Group: LG prefix
-    - List: LL prefix
-    - Answers: LA prefix
+    Column prefixes of several target repositories: the given labels, or the source and version of each
+    repo (e.g. CIEL_v2024-10-04 for /orgs/CIEL/sources/CIEL/v2024-10-04/); duplicates get their position.
     """
-    if not code or not loinc_type:
-        return True
-    
-    code = str(code).strip()
-    
-    if loinc_type == "LOINC":
-        # Regular LOINC codes don't start with the special prefixes
-        return not any(code.startswith(prefix) for prefix in ["LP", "LG", "LL", "LA"])
-    elif loinc_type == "Part":
-        return code.startswith("LP")
-    elif loinc_type == "Group":
-        return code.startswith("LG")
-    elif loinc_type == "List":
-        return code.startswith("LL")
-    elif loinc_type == "Answers":
-        return code.startswith("LA")
-    
-    return True
-
-
-def get_llm_recommendation(row_data, candidates, api_key, model="claude-3-5-sonnet-20241022", debug=False):
-    """
-    Get LLM recommendation for the best candidate match.
-    
-    Returns:
-        Tuple of (recommendation_id, rationale) or (None, error_message)
-    """
-    try:
-        # Lazy import to avoid requiring anthropic when not using LLM features
-        import anthropic
-        
-        client = anthropic.Anthropic(api_key=api_key)
-        
-        # Format the prompt
-        system_prompt, user_prompt = format_llm_judge_prompt(row_data, candidates, debug=debug)
-        
-        if debug:
-            print("\n" + "="*80)
-            print("DEBUG: LLM PROMPT")
-            print("="*80)
-            print("System Prompt:")
-            print(system_prompt[:500] + "..." if len(system_prompt) > 500 else system_prompt)
-            print("\nUser Prompt:")
-            print(user_prompt)
-            print("="*80 + "\n")
-        
-        # Call the API
-        message = client.messages.create(
-            model=model,
-            max_tokens=2000,
-            temperature=0,
-            system=system_prompt,
-            messages=[
-                {"role": "user", "content": user_prompt}
-            ]
-        )
-        
-        response_text = message.content[0].text
-        
-        if debug:
-            print("\n" + "="*80)
-            print("DEBUG: LLM RESPONSE")
-            print("="*80)
-            print(response_text)
-            print("="*80 + "\n")
-        
-        # Parse the response
-        recommendation, rationale = parse_llm_response(response_text)
-        
-        return recommendation, rationale
-        
-    except ImportError:
-        return None, "anthropic package not installed. Run: pip install anthropic"
-    except Exception as e:
-        return None, f"LLM evaluation error: {str(e)}"
+    if not labels:
+        labels = []
+        for repo in target_repos:
+            parts = [part for part in repo.split("/") if part]
+            if len(parts) >= 4 and parts[0] in ("orgs", "users"):
+                parts = parts[3:]  # drop /orgs/<owner>/sources/
+            labels.append("_".join(parts) or repo)
+    if len(labels) != len(target_repos):
+        raise ValueError(f"Expected {len(target_repos)} target labels, got {len(labels)}")
+    return [f"{label}_{i + 1}" if labels.count(label) > 1 else label for i, label in enumerate(labels)]
 
 
 def match(api_token="", api_match_url="", input_filename="", target_repo="",
           column_map={}, semantic=False, max_chunk_size=200,
           knn_num_candidates=1000, knearest=5, top_n=5, verbosity=0,
           correct_map_column="", filter_loinc_type="", filter_fetch_factor=2.0,
-          anthropic_api_key="", anthropic_model="claude-3-5-sonnet-20241022", debug=False):
+          filter_fetch_strategy="adaptive", filter_fetch_max=0,
+          anthropic_api_key="", anthropic_model="claude-3-5-sonnet-20241022", debug=False,
+          rerank=False, rerank_url="", rerank_batch_size=64, rerank_cache="", tracer=None,
+          target_labels=None, baseline_filename="", baseline_key_column="", change_report_filename="",
+          input_df=None, ranker=None, fail_on_error=False):
+    """
+    Match the rows of the input file against one or more target repositories.
+
+    With a list of target repositories, the input is read and chunked once, every chunk is sent to all
+    targets concurrently and the output gets one group of candidate (and top-n) columns per target,
+    prefixed with its label (see label_targets).
+
+    With a baseline_filename (incremental mode), the output gets a match-hash column and only the rows
+    whose hash is not in the baseline (a previous output, which may be the output file itself) are sent
+    to $match and the LLM judge; the results of the other rows are carried over. Rows whose $match request,
+    rerank or LLM judge failed get a blank match-hash, so the next run matches them again. The re-matched
+    and removed rows are written to change_report_filename, if given.
+
+    input_df (rows to match instead of reading input_filename) and ranker (a preloaded cross-encoder)
+    let a long-running caller, such as a match_queue.py worker, reuse them across calls; with
+    fail_on_error a failed $match request raises instead of leaving the rows of its chunk empty.
+    """
+    # Lazy imports to keep CLI startup (e.g. --help) fast
+    import pandas as pd
+    import requests
+
     start_time = time.time()
+    tracer = tracer or Tracer(enabled=False)
+    target_repos = list(target_repo) if isinstance(target_repo, (list, tuple)) else [target_repo]
+    labels = label_targets(target_repos, target_labels) if len(target_repos) > 1 else [""]
+
+    # Check if cross-encoder reranking is enabled
+    use_rerank = rerank or bool(rerank_url)
 
     # API request parameters
     # When filtering, fetch more candidates to ensure we get enough after filtering
-    fetch_limit = int(top_n * filter_fetch_factor) if filter_loinc_type else top_n
-    
-    params = {
-        "includeSearchMeta": True,
-        "semantic": semantic,
-        "limit": fetch_limit,
-        "kNearest": knearest,
-        "numCandidates": knn_num_candidates,
-        "bestMatch": False
-    }
-    headers = {}
-    if api_token:
-        headers["Authorization"] = "Token %s" % (api_token)
+    # When reranking, fetch more candidates so the cross-encoder can promote them into the top-n
+    fetch_limit = int(top_n * filter_fetch_factor) if filter_loinc_type or use_rerank else top_n
+
+    # Adaptive filtering: start with the number of candidates needed and only re-query the rows
+    # left short after filtering, growing the limit by filter_fetch_factor (at least 2x, so a
+    # factor close to 1 does not take a re-query per extra candidate) up to filter_fetch_max
+    adaptive_fetch = bool(filter_loinc_type) and filter_fetch_strategy == "adaptive"
+    fixed_fetch_limit = fetch_limit
+    fetch_growth = max(filter_fetch_factor, 2.0)
+    target_count = int(top_n * filter_fetch_factor) if use_rerank else top_n
+    if adaptive_fetch:
+        fetch_limit = target_count
+        filter_fetch_max = max(filter_fetch_max or top_n * 10, fetch_limit)
 
     # Check if LLM evaluation is enabled
     use_llm = bool(anthropic_api_key)
+
+    # One $match client, result buffer and fetch counters per target
+    targets = [
+        {
+            "repo": repo,
+            "label": label,
+            "prefix": f"[{label}] " if label else "",
+            "client": MatchClient(api_match_url, repo, api_token=api_token, semantic=semantic,
+                                  knn_num_candidates=knn_num_candidates, knearest=knearest, limit=fetch_limit,
+                                  tracer=tracer),
+            "fetch_stats": {"requests": 0, "refetched_rows": 0, "requested_candidates": 0, "short_rows": 0},
+        }
+        for repo, label in zip(target_repos, labels)
+    ]
     
     # Print script configuration
     if verbosity:
@@ -168,13 +174,19 @@ def match(api_token="", api_match_url="", input_filename="", target_repo="",
         if api_token:
             print("  API token: *******")
         print("  Input Filename: ", input_filename)
-        print("  Target Repository: ", target_repo)
+        print("  Target Repository: ", ", ".join(target_repos))
+        if len(targets) > 1:
+            print("  Target Labels: ", ", ".join(labels))
         print("  Semantic Search: ", semantic)
         print("  Top-N candidates to save: ", top_n)
         if filter_loinc_type:
             print("  LOINC Type Filter: ", filter_loinc_type)
+        if filter_loinc_type or use_rerank:
             print("  Filter Fetch Factor: ", filter_fetch_factor)
             print("  Fetching up to: ", fetch_limit, "candidates per row")
+        if adaptive_fetch:
+            print("  Filter Fetch Strategy: adaptive, re-querying short rows up to", filter_fetch_max,
+                  f"candidates (limit x {fetch_growth} per re-query)")
         print("  Max Chunk Size: ", max_chunk_size)
         print("  kNN Number of Candidates: ", knn_num_candidates)
         print("  k-Nearest: ", knearest)
@@ -183,178 +195,285 @@ def match(api_token="", api_match_url="", input_filename="", target_repo="",
             print("  LLM Evaluation: Enabled")
             print("  Anthropic Model: ", anthropic_model)
             print("  Debug Mode: ", debug)
+        if use_rerank:
+            print("  Cross-Encoder Rerank: ", rerank_url or "local model")
+            print("  Rerank Batch Size: ", rerank_batch_size)
         if column_map:
             print("  Column Mapping: ", json.dumps(column_map, indent=4))
 
+    def result_frames(results_per_target):
+        """Output columns of the targets' results (prefixed with the target labels if there are several)."""
+        frames = [results.to_frame() for results in results_per_target]
+        if len(targets) > 1:
+            frames = [frame.add_prefix(f"{target['label']}_") for target, frame in zip(targets, frames)]
+        return frames
+
     # Load input file
-    import_file_type = input_filename.split('.')[-1]  # e.g. csv, xlsx
-    if import_file_type == 'csv':
-        df = pd.read_csv(input_filename)
-    elif import_file_type == 'xlsx':
-        df = pd.read_excel(input_filename)
-    else:
-        print("Error: Unknown file type", import_file_type)
-        sys.exit(1)
+    with tracer.span("read_input", file=input_filename):
+        input_df = read_table(input_filename) if input_df is None else input_df
+    tracer.count("rows", len(input_df))
 
-    
-    # Process import file: Change column names, convert to dictionary and chunk
-    df.rename(columns=column_map, inplace=True)
-    data = json.loads(df.to_json(orient="records"))  # serialize/deserialize to get rid of funky datatypes
-    list_of_chunked_data = [data[i * max_chunk_size:(i + 1) * max_chunk_size] 
-                            for i in range((len(data) + max_chunk_size - 1) // max_chunk_size)]
+    # Process import file: Change column names (the input keeps its original names for the output),
+    # convert to dictionary
+    with tracer.span("to_json"):
+        df = input_df.rename(columns=column_map)
+        data = json_loads(df.to_json(orient="records"))  # serialize/deserialize to get rid of funky datatypes
+
+    # Incremental mode: only match the rows that are not in the baseline with the same hash
+    row_indices = list(range(len(data)))
+    baseline = None
+    if baseline_filename:
+        with tracer.span("baseline", file=baseline_filename):
+            fingerprint = run_fingerprint({
+                "api_match_url": api_match_url, "target_repos": target_repos, "labels": labels,
+                "semantic": semantic, "knn_num_candidates": knn_num_candidates, "knearest": knearest,
+                "top_n": top_n, "correct_map_column": correct_map_column, "filter_loinc_type": filter_loinc_type,
+                "fetch_limit": fetch_limit, "filter_fetch_strategy": filter_fetch_strategy,
+                "filter_fetch_max": filter_fetch_max, "rerank": use_rerank,
+                "anthropic_model": anthropic_model if use_llm else "",
+            })
+            hashes = row_hashes(data, fingerprint)
+            result_columns = [column for frame in result_frames(
+                [ResultBuffer(0, top_n, rerank=use_rerank, top_n_column=bool(correct_map_column), llm=use_llm)
+                 for _ in targets]) for column in frame.columns]
+            baseline = Baseline(baseline_filename, result_columns, baseline_key_column)
+            row_indices = [i for i, row_hash in enumerate(hashes) if row_hash not in baseline]
+            keys = input_df[baseline_key_column].astype(str).tolist() if baseline_key_column in input_df.columns else None
+            report = change_report(baseline, hashes, keys)
+
+        print("\nINCREMENTAL:")
+        if baseline.reason:
+            print(f"  Matching all rows: {baseline.reason}")
+        if baseline.num_failed:
+            print(f"  {baseline.num_failed} baseline rows without {HASH_COLUMN} (their matching failed) are matched again")
+        elif baseline.fingerprints != {fingerprint}:
+            print("  Run settings changed since the baseline: re-matching the rows of other settings")
+        print(f"  {len(data) - len(row_indices)} unchanged rows carried over, {len(row_indices)} rows to match, "
+              f"{sum(1 for entry in report if entry['status'] == 'removed')} baseline rows removed")
+        if change_report_filename:
+            with open(change_report_filename, 'w') as f:
+                f.write(json.dumps({"baseline": baseline_filename, "input": input_filename, "total_rows": len(data),
+                                    "carried_over": len(data) - len(row_indices), "rows": report}, indent=4))
+            print(f"  Change report saved to: {change_report_filename}")
+
+    list_of_chunked_indices = chunked(row_indices, max_chunk_size)
     
     if verbosity:
         print("\nINPUT FILE:")
         print("  Total Rows: ", len(df))
-        print("  # Chunks: ", len(list_of_chunked_data))
+        print("  # Chunks: ", len(list_of_chunked_indices))
+
+    # Load the cross-encoder once for the whole run
+    with tracer.span("load_ranker"):
+        if ranker is None and rerank and not rerank_url:
+            ranker = load_ranker(rerank_cache)
 
     # Initialize results storage
-    all_results = []
+    for target in targets:
+        target["results"] = ResultBuffer(len(data), top_n, rerank=use_rerank, top_n_column=bool(correct_map_column),
+                                         llm=use_llm)
+    # Rows whose $match request, rerank or LLM judge failed (for any target): no match-hash, so an
+    # incremental run matches them again instead of carrying their incomplete results over
+    failed_rows = set()
     chunk_num = 0
     cumulative_chunk_elapsed_time = 0
-    
-    print("\nMATCHING:")
-    for chunk_index, chunk in enumerate(list_of_chunked_data):
-        # Prepare chunk data
-        new_chunk = []
-        for row in chunk:
-            row['name'] = row.get('name', None) or ""
-            row['synonyms'] = [row['name']]
-            row.pop('id', None)
-            new_chunk.append(row)
-
-        # Request match results
-        chunk_num += 1
-        payload = {
-            "rows": new_chunk,
-            "target_repo_url": target_repo
-        }
-        
-        if verbosity:
-            print(f"Chunk #: {chunk_num} ({len(new_chunk)} rows)")
-            print(f"  {api_match_url} {json.dumps(params)}")
-        
-        chunk_start_time = time.time()
+    cumulative_rerank_elapsed_time = 0
+
+    def fetch_target(target, rows, encoded_rows, chunk_num):
+        """
+        Request the candidates of a chunk from one target.
+
+        Returns:
+            Tuple of ($match response or None if the request failed, error messages); errors are printed
+            by the caller so the output of concurrent targets does not interleave
+        """
+        client, fetch_stats = target["client"], target["fetch_stats"]
         try:
-            r = requests.post(api_match_url, json=payload, params=params, headers=headers)
-            r.raise_for_status()
-            response = r.json()
+            response = client.match(rows, chunk_num=chunk_num, encoded_rows=encoded_rows)
+            fetch_stats["requests"] += 1
+            fetch_stats["requested_candidates"] += len(rows) * fetch_limit
         except requests.exceptions.RequestException as e:
-            print(f"  Error in chunk {chunk_num}: {str(e)}")
-            # Add empty results for this chunk
-            for i in range(len(new_chunk)):
-                all_results.append({})
-            continue
-        
-        chunk_elapsed_time = time.time() - chunk_start_time
-        cumulative_chunk_elapsed_time += chunk_elapsed_time
-        chunk_average_time_per_row = chunk_elapsed_time / len(new_chunk)
-        
-        if verbosity:
-            print(f"  Chunk Match Time: {round(chunk_elapsed_time, 4)} sec ({round(chunk_average_time_per_row, 4)} sec/row)")
-
-        # Process results for each row in the chunk
-        for row_index, row_matches in enumerate(response):
-            # Get the original row index
-            original_row_index = chunk_index * max_chunk_size + row_index
-            
-            # Sort candidates by search score
-            if "results" in row_matches and row_matches["results"]:
-                row_matches["results"] = sorted(
-                    row_matches["results"], 
-                    key=lambda candidate: candidate["search_meta"]["search_score"], 
-                    reverse=True
-                )
-            
-            # Extract top-N candidates
-            result_dict = {}
-            candidates = row_matches.get("results", [])
-            
-            # Apply LOINC type filter if specified
-            if filter_loinc_type:
-                filtered_candidates = [
-                    candidate for candidate in candidates
-                    if matches_loinc_type(candidate.get("id", ""), filter_loinc_type)
-                ]
-            else:
-                filtered_candidates = candidates
-            
-            # Add filtered candidates to results (up to top_n)
-            for i in range(min(top_n, len(filtered_candidates))):
-                candidate = filtered_candidates[i]
-                rank_prefix = f"{i+1:02d}"  # 01, 02, 03, etc.
-                
-                result_dict[f"{rank_prefix}_code"] = candidate.get("id", "")
-                result_dict[f"{rank_prefix}_name"] = candidate.get("display_name", "")
-                result_dict[f"{rank_prefix}_score"] = round(candidate["search_meta"].get("search_score", 0), 4)
-            
-            # Fill in empty columns for candidates not found
-            for i in range(len(filtered_candidates), top_n):
-                rank_prefix = f"{i+1:02d}"
-                result_dict[f"{rank_prefix}_code"] = ""
-                result_dict[f"{rank_prefix}_name"] = ""
-                result_dict[f"{rank_prefix}_score"] = ""
-            
-            # Calculate top-n value if correct_map_column is provided
-            if correct_map_column:
-                result_dict["top-n"] = ""
-                # Get the correct map value from the original data
-                if original_row_index < len(data):
-                    original_row = data[original_row_index]
-                    correct_map = str(original_row.get(correct_map_column, "")).strip()
-                    
-                    # Skip empty values and "new" concepts
-                    if correct_map and correct_map.lower() != "new":
-                        # Check each filtered candidate for a match
-                        for i, candidate in enumerate(filtered_candidates[:top_n]):
-                            if str(candidate.get("id", "")).strip() == correct_map:
-                                result_dict["top-n"] = i + 1
-                                break
-            
-            # Add LLM evaluation if enabled
-            if use_llm and filtered_candidates:
-                # Prepare row data for LLM
-                llm_row_data = data[original_row_index].copy()
-                
-                # Remove correct mapping column if specified to prevent LLM from "cheating"
-                if correct_map_column and correct_map_column in llm_row_data:
-                    del llm_row_data[correct_map_column]
-                
-                # Get LLM recommendation
-                recommendation_id, rationale = get_llm_recommendation(
-                    llm_row_data, 
-                    filtered_candidates[:top_n],
-                    anthropic_api_key,
-                    anthropic_model,
-                    debug
-                )
-                
-                result_dict["ai-recommendation"] = recommendation_id or ""
-                result_dict["ai-rationale"] = rationale or ""
-                
-                if verbosity > 1 and recommendation_id:
-                    print(f"    Row {original_row_index + 1}: AI recommended '{recommendation_id}'")
-            elif use_llm:
-                # No candidates, so no recommendation
-                result_dict["ai-recommendation"] = ""
-                result_dict["ai-rationale"] = "No candidates available for evaluation"
-            
-            all_results.append(result_dict)
-
-    # Combine original data with results
-    results_df = pd.DataFrame(all_results)
-    
-    # Reload original dataframe to preserve original column names
-    if import_file_type == 'csv':
-        output_df = pd.read_csv(input_filename)
-    else:
-        output_df = pd.read_excel(input_filename)
+            tracer.count("failed_chunks")
+            return None, [f"  {target['prefix']}Error in chunk {chunk_num}: {str(e)}"]
+
+        # Re-query the rows left short by the LOINC type filter with a larger limit
+        if adaptive_fetch:
+            def fetch(refetch_rows, limit):
+                return client.match(refetch_rows, limit=limit, chunk_num=chunk_num)
+
+            try:
+                with tracer.span("refetch", chunk=chunk_num):
+                    short_rows = refetch_short_rows(response, rows, fetch, fetch_limit, target_count,
+                                                    filter_fetch_max, fetch_growth,
+                                                    filter_loinc_type, fetch_stats)
+                fetch_stats["short_rows"] += short_rows
+            except requests.exceptions.RequestException as e:
+                return response, [f"  {target['prefix']}Re-query error in chunk {chunk_num}: {str(e)}"]
+        return response, []
+
+    # Several targets are requested concurrently, one thread per target
+    executor = ThreadPoolExecutor(max_workers=len(targets)) if len(targets) > 1 else None
     
-    # Concatenate with results
-    output_df = pd.concat([output_df, results_df], axis=1)
+    print("\nMATCHING:")
+    try:
+        for chunk_index, chunk_indices in enumerate(list_of_chunked_indices):
+            with tracer.span("chunk", chunk=chunk_index + 1, rows=len(chunk_indices)):
+                # Prepare chunk data
+                new_chunk = prepare_rows([data[i] for i in chunk_indices])
+
+                # Request match results
+                chunk_num += 1
+
+                if verbosity:
+                    print(f"Chunk #: {chunk_num} ({len(new_chunk)} rows)")
+                    print(f"  {api_match_url} {json.dumps(targets[0]['client'].params)}")
+
+                chunk_start_time = time.time()
+                # Serialize the rows once for all targets
+                encoded_rows = json_dumps(new_chunk)
+                if executor:
+                    fetched = list(executor.map(
+                        lambda target: fetch_target(target, new_chunk, encoded_rows, chunk_num), targets))
+                else:
+                    fetched = [fetch_target(targets[0], new_chunk, encoded_rows, chunk_num)]
+                responses = [response for response, _ in fetched]
+                for _, errors in fetched:
+                    for error in errors:
+                        print(error)
+                    if errors:
+                        failed_rows.update(chunk_indices)
+                if fail_on_error and any(errors for _, errors in fetched):
+                    raise RuntimeError(next(error for _, errors in fetched for error in errors).strip())
+                if all(response is None for response in responses):
+                    # Results of this chunk stay empty
+                    continue
+
+                chunk_elapsed_time = time.time() - chunk_start_time
+                cumulative_chunk_elapsed_time += chunk_elapsed_time
+                chunk_average_time_per_row = chunk_elapsed_time / len(new_chunk)
+
+                if verbosity:
+                    print(f"  Chunk Match Time: {round(chunk_elapsed_time, 4)} sec ({round(chunk_average_time_per_row, 4)} sec/row)")
+
+                for target, response in zip(targets, responses):
+                    if response is None:
+                        continue
+                    results, prefix = target["results"], target["prefix"]
+
+                    # Filter and sort the candidates of each row in the chunk
+                    chunk_candidates = []
+                    num_candidates = num_filtered_candidates = 0
+                    with tracer.span("sort_filter", chunk=chunk_num):
+                        for row_matches in response:
+                            candidates = row_matches.get("results") or []
+                            num_candidates += len(candidates)
+
+                            # Apply LOINC type filter if specified
+                            candidates = filter_candidates(candidates, filter_loinc_type)
+                            num_filtered_candidates += len(candidates)
+
+                            # Order by search score: every candidate for the reranker, otherwise only the top-n
+                            chunk_candidates.append(sort_candidates(candidates, None if use_rerank else top_n))
+                    tracer.count("candidates", num_candidates)
+                    tracer.count("filtered_candidates", num_filtered_candidates)
+
+                    # Rerank the candidates of the whole chunk with the cross-encoder
+                    chunk_rerank_scores = None
+                    if use_rerank:
+                        rerank_start_time = time.time()
+                        try:
+                            with tracer.span("rerank", chunk=chunk_num):
+                                chunk_candidates, chunk_rerank_scores = rerank_candidates(
+                                    [row.get("name", "") for row in new_chunk],
+                                    chunk_candidates,
+                                    ranker=ranker,
+                                    rerank_url=rerank_url,
+                                    batch_size=rerank_batch_size
+                                )
+                        except Exception as e:
+                            print(f"  {prefix}Rerank error in chunk {chunk_num}: {str(e)}")
+                            failed_rows.update(chunk_indices)
+                        rerank_elapsed_time = time.time() - rerank_start_time
+                        cumulative_rerank_elapsed_time += rerank_elapsed_time
+                        if verbosity:
+                            print(f"  {prefix}Chunk Rerank Time: {round(rerank_elapsed_time, 4)} sec")
+
+                    # Process results for each row in the chunk
+                    with tracer.span("results", chunk=chunk_num):
+                        for row_index, filtered_candidates in enumerate(chunk_candidates):
+                            # Get the original row index
+                            original_row_index = chunk_indices[row_index]
+
+                            # Store the top-N candidates
+                            results.set_candidates(original_row_index, filtered_candidates,
+                                                   chunk_rerank_scores[row_index] if chunk_rerank_scores else None)
+
+                            # Calculate top-n value if correct_map_column is provided
+                            if correct_map_column and original_row_index < len(data):
+                                status, correct_map = correct_map_status(data[original_row_index].get(correct_map_column))
+
+                                # Skip empty values and "new" concepts
+                                if not status:
+                                    results.top_n_ranks[original_row_index] = correct_rank(correct_map,
+                                                                                           filtered_candidates, top_n)
+
+                            # Add LLM evaluation if enabled
+                            if use_llm and filtered_candidates:
+                                # Prepare row data for LLM
+                                llm_row_data = data[original_row_index].copy()
+
+                                # Remove correct mapping column if specified to prevent LLM from "cheating"
+                                if correct_map_column and correct_map_column in llm_row_data:
+                                    del llm_row_data[correct_map_column]
+
+                                # Get LLM recommendation
+                                with tracer.span("llm", category="llm", row=original_row_index + 1):
+                                    recommendation_id, rationale = get_llm_recommendation(
+                                        llm_row_data,
+                                        filtered_candidates[:top_n],
+                                        anthropic_api_key,
+                                        anthropic_model,
+                                        debug
+                                    )
+                                tracer.count("llm_calls")
+                                if llm_failed(recommendation_id, rationale):
+                                    failed_rows.add(original_row_index)
+
+                                results.ai_recommendations[original_row_index] = recommendation_id or ""
+                                results.ai_rationales[original_row_index] = rationale or ""
+
+                                if verbosity > 1 and recommendation_id:
+                                    print(f"    {prefix}Row {original_row_index + 1}: AI recommended '{recommendation_id}'")
+                            elif use_llm:
+                                # No candidates, so no recommendation
+                                results.ai_rationales[original_row_index] = "No candidates available for evaluation"
+    finally:
+        if executor:
+            executor.shutdown()
+        for target in targets:
+            target["client"].close()
+
+    # Combine original data with results (one prefixed column group per target if there are several)
+    with tracer.span("concat"):
+        frames = result_frames([target["results"] for target in targets])
+        output_df = pd.concat([input_df] + frames, axis=1)
+
+    # Carry the results of the unchanged rows over from the baseline
+    if baseline is not None:
+        with tracer.span("carry_over"):
+            carried = [i for i, row_hash in enumerate(hashes) if row_hash in baseline]
+            if carried:
+                columns = baseline.results.columns
+                output_df[columns] = output_df[columns].astype(object)
+                output_df.loc[carried, columns] = baseline.results.iloc[
+                    [baseline.positions[hashes[i]] for i in carried]].to_numpy()
+            output_df[HASH_COLUMN] = ["" if i in failed_rows else row_hash for i, row_hash in enumerate(hashes)]
+        if failed_rows:
+            print(f"\n{len(failed_rows)} rows failed and have no {HASH_COLUMN}: the next run matches them again")
     
     # Calculate final statistics
     elapsed_seconds = time.time() - start_time
+    fetch_stats = {key: sum(target["fetch_stats"][key] for target in targets) for key in targets[0]["fetch_stats"]}
     
     if verbosity:
         print(f"\nRESULTS:")
@@ -362,97 +481,170 @@ def match(api_token="", api_match_url="", input_filename="", target_repo="",
         print(f"  Total Elapsed Time: {round(elapsed_seconds, 2)} sec")
         print(f"  Total Match Time: {round(cumulative_chunk_elapsed_time, 2)} sec")
         print(f"  Average Match Time per Row: {round(cumulative_chunk_elapsed_time / len(df), 2)} sec/row")
+        if filter_loinc_type:
+            print(f"  $match Requests: {fetch_stats['requests']} ({fetch_stats['refetched_rows']} rows re-queried)")
+            print(f"  Candidates Requested: {fetch_stats['requested_candidates']} "
+                  f"({round(fetch_stats['requested_candidates'] / len(df), 1)} per row)")
+            if adaptive_fetch:
+                print(f"  Rows Short After Filtering: {fetch_stats['short_rows']}")
+                # What --filter-fetch-strategy=fixed would have requested for the same rows
+                print(f"  Candidates Requested by the Fixed Strategy: "
+                      f"{len(row_indices) * len(targets) * fixed_fetch_limit} ({fixed_fetch_limit} per row)")
+        if use_rerank:
+            print(f"  Total Rerank Time: {round(cumulative_rerank_elapsed_time, 2)} sec")
+        if ranker is not None:
+            print(f"  Rerank Cache: {json.dumps(ranker.cache.stats()['score'])}")
+        if correct_map_column and len(targets) > 1:
+            for target in targets:
+                found = int(output_df[f"{target['label']}_top-n"].notna().sum())
+                print(f"  Correct Map in Top-{top_n} [{target['label']}]: {found} of {len(df)} rows")
 
     return output_df
 
 
-# CLI
-parser = argparse.ArgumentParser(prog='match.py', description='Match terms to a target repository using OCL API')
-parser.add_argument('-t', '--token', required=True, help="OCL API token")
-parser.add_argument('-i', '--inputfile', required=True, help="File of input data to be mapped")
-parser.add_argument('-r', '--repo', help="Map target repo, e.g. /orgs/CIEL/sources/CIEL/v2024-10-04/", 
-                    default="/orgs/CIEL/sources/CIEL/v2024-10-04/")
-parser.add_argument('-e', '--env', default="http://localhost:8000", 
-                    help="OCL API environment, e.g. https://api.qa.openconceptlab.org")
-parser.add_argument('--endpoint', default="/concepts/$match/", help="$match endpoint, e.g. /concepts/$match/")
-parser.add_argument('--columnmap_filename', help="JSON file containing column mappings")
-parser.add_argument('-s', '--semantic', default='false', choices=['true', 'false'])
-parser.add_argument('-c', '--chunk', type=int, default=200, 
-                    help="Max chunk size to send to $match algorithm at a time")
-parser.add_argument('--numcandidates', type=int, default=5000, 
-                    help="Approximate number of nearest neighbor candidates to consider on each shard")
-parser.add_argument('--knearest', type=int, default=5, 
-                    help="Number of nearest neighbors to consider for each row")
-parser.add_argument('-n', '--topn', type=int, default=5, help="Number of top candidates to save for each row")
-parser.add_argument('-v', '--verbosity', type=int, default=0)
-parser.add_argument('-o', '--outputfile', help="Output file to save the results (defaults to stdout if not provided)")
-parser.add_argument('--correctmap', help="Column name containing the correct map for top-n calculation")
-parser.add_argument('--filter-loinc-type', choices=['LOINC', 'Part', 'Group', 'List', 'Answers'],
-                    help="Filter candidates by LOINC code type")
-parser.add_argument('--filter-fetch-factor', type=float, default=2.0,
-                    help="Multiplier for fetching extra candidates when filtering (default: 2.0)")
-parser.add_argument('-k', '--anthropic-api-key', help="Anthropic API key for LLM evaluation")
-parser.add_argument('--model', default='claude-3-5-sonnet-20241022',
-                    help="Anthropic model to use for LLM evaluation")
-parser.add_argument('--debug', action='store_true', help="Enable debug mode for LLM prompts and responses")
-
-args = parser.parse_args()
-
-# Convert columnmap_filename argument to dictionary, if provided
-column_map = {}
-if args.columnmap_filename:
-    try:
+def add_match_arguments(parser):
+    """Add the arguments of the match settings (target repos, $match, filtering and reranking) to a parser."""
+    parser.add_argument('-r', '--repo', help="Map target repo, e.g. /orgs/CIEL/sources/CIEL/v2024-10-04/, "
+                        "or a comma-separated list of repos to match against in one run",
+                        default="/orgs/CIEL/sources/CIEL/v2024-10-04/")
+    parser.add_argument('--repo-labels', help="Comma-separated column prefixes for the target repos "
+                        "(default: source and version of each repo, e.g. CIEL_v2024-10-04)")
+    parser.add_argument('-e', '--env', default="http://localhost:8000", 
+                        help="OCL API environment, e.g. https://api.qa.openconceptlab.org")
+    parser.add_argument('--endpoint', default="/concepts/$match/", help="$match endpoint, e.g. /concepts/$match/")
+    parser.add_argument('--columnmap_filename', help="JSON file containing column mappings")
+    parser.add_argument('-s', '--semantic', default='false', choices=['true', 'false'])
+    parser.add_argument('-c', '--chunk', type=int, default=200, 
+                        help="Max chunk size to send to $match algorithm at a time")
+    parser.add_argument('--numcandidates', type=int, default=5000, 
+                        help="Approximate number of nearest neighbor candidates to consider on each shard")
+    parser.add_argument('--knearest', type=int, default=5, 
+                        help="Number of nearest neighbors to consider for each row")
+    parser.add_argument('-n', '--topn', type=int, default=5, help="Number of top candidates to save for each row")
+    parser.add_argument('--correctmap', help="Column name containing the correct map for top-n calculation")
+    parser.add_argument('--filter-loinc-type', choices=['LOINC', 'Part', 'Group', 'List', 'Answers'],
+                        help="Filter candidates by LOINC code type")
+    parser.add_argument('--filter-fetch-factor', type=float, default=2.0,
+                        help="Multiplier for fetching extra candidates when filtering or reranking (default: 2.0); "
+                        "adaptive re-queries grow the limit by this factor, but at least 2x")
+    parser.add_argument('--filter-fetch-strategy', choices=['adaptive', 'fixed'], default='adaptive',
+                        help="Re-query only rows left short after LOINC filtering, each time fetching the whole list "
+                        "with a larger limit (adaptive), or always over-fetch (fixed); -v=1 prints both request totals")
+    parser.add_argument('--filter-fetch-max', type=int, default=0,
+                        help="Maximum $match limit for adaptive re-queries (default: 10 x top-n)")
+    parser.add_argument('--model', default='claude-3-5-sonnet-20241022',
+                        help="Anthropic model to use for LLM evaluation")
+    parser.add_argument('--rerank', action='store_true',
+                        help="Rerank the $match candidates of each row with the local cross-encoder")
+    parser.add_argument('--rerank-url', help="Base URL of a running rank_server.py to use for reranking, e.g. http://localhost:8765")
+    parser.add_argument('--rerank-batch-size', type=int, default=64,
+                        help="Number of (row, candidate) pairs per cross-encoder forward pass (default: 64)")
+    parser.add_argument('--rerank-cache', help="SQLite file to cache cross-encoder pair scores across runs (local --rerank only)")
+
+
+def match_settings(args):
+    """
+    Keyword arguments of match() for the arguments added by add_match_arguments (without the API token,
+    input file and Anthropic API key); raises an exception if the column map file cannot be loaded.
+    """
+    # Convert columnmap_filename argument to dictionary, if provided
+    column_map = {}
+    if args.columnmap_filename:
         with open(args.columnmap_filename, 'r') as f:
             column_map = json.load(f)
+
+    return {
+        "api_match_url": args.env + args.endpoint,
+        "target_repo": [repo.strip() for repo in args.repo.split(",") if repo.strip()],
+        "target_labels": [label.strip() for label in args.repo_labels.split(",")] if args.repo_labels else None,
+        "column_map": column_map,
+        "semantic": args.semantic == 'true',
+        "max_chunk_size": args.chunk,
+        "knn_num_candidates": args.numcandidates,
+        "knearest": args.knearest,
+        "top_n": args.topn,
+        "correct_map_column": args.correctmap or "",
+        "filter_loinc_type": args.filter_loinc_type or "",
+        "filter_fetch_factor": args.filter_fetch_factor,
+        "filter_fetch_strategy": args.filter_fetch_strategy,
+        "filter_fetch_max": args.filter_fetch_max,
+        "anthropic_model": args.model,
+        "rerank": args.rerank,
+        "rerank_url": args.rerank_url or "",
+        "rerank_batch_size": args.rerank_batch_size,
+        "rerank_cache": args.rerank_cache or "",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='match.py', description='Match terms to a target repository using OCL API')
+    parser.add_argument('-t', '--token', required=True, help="OCL API token")
+    parser.add_argument('-i', '--inputfile', required=True, help="File of input data to be mapped")
+    add_match_arguments(parser)
+    parser.add_argument('-v', '--verbosity', type=int, default=0)
+    parser.add_argument('-o', '--outputfile', help="Output file to save the results (defaults to stdout if not provided)")
+    parser.add_argument('-k', '--anthropic-api-key', help="Anthropic API key for LLM evaluation")
+    parser.add_argument('--debug', action='store_true', help="Enable debug mode for LLM prompts and responses")
+    parser.add_argument('--baseline', help="Previous output file (may be the output file itself): only re-match rows that are "
+                        "new or changed since then and carry over the other results (adds a match-hash column)")
+    parser.add_argument('--baseline-key', help="Input column identifying a row across runs, to report rows as new or changed")
+    parser.add_argument('--change-report', help="JSON file listing the re-matched and removed rows of an incremental run")
+    parser.add_argument('--trace', help="Write a Chrome trace JSON of the pipeline stages and counters to this file")
+    parser.add_argument('--profile', choices=['cprofile', 'pyinstrument'], help="Profile the run with cProfile or pyinstrument")
+    parser.add_argument('--profile-output', help="File for the profile (.prof for cprofile, .html for pyinstrument)")
+
+    args = parser.parse_args()
+
+    try:
+        settings = match_settings(args)
     except Exception as e:
         print(f"Error loading column map file: {str(e)}")
         sys.exit(1)
 
-# Run match
-api_match_url = args.env + args.endpoint
-semantic = args.semantic == 'true'
-
-# Get Anthropic API key from args or environment
-anthropic_api_key = args.anthropic_api_key or os.environ.get('ANTHROPIC_API_KEY', '')
-
-try:
-    output_df = match(
-        api_token=args.token,
-        api_match_url=api_match_url,
-        input_filename=args.inputfile,
-        target_repo=args.repo,
-        column_map=column_map,
-        semantic=semantic,
-        max_chunk_size=args.chunk,
-        knn_num_candidates=args.numcandidates,
-        knearest=args.knearest,
-        top_n=args.topn,
-        verbosity=args.verbosity,
-        correct_map_column=args.correctmap or "",
-        filter_loinc_type=getattr(args, 'filter_loinc_type', '') or "",
-        filter_fetch_factor=args.filter_fetch_factor,
-        anthropic_api_key=anthropic_api_key,
-        anthropic_model=args.model,
-        debug=args.debug
-    )
-    
-    # Save output
-    if args.outputfile:
-        # Save to file
-        output_file_type = args.outputfile.split('.')[-1]
-        if output_file_type == 'csv':
-            output_df.to_csv(args.outputfile, index=False)
-        elif output_file_type == 'xlsx':
-            output_df.to_excel(args.outputfile, index=False)
-        else:
-            print(f"Error: Unknown output file type '{output_file_type}'. Using CSV format.")
-            output_df.to_csv(args.outputfile, index=False)
-        
-        print(f"\nOutput saved to: {args.outputfile}")
-    else:
-        # Output to stdout
-        output_df.to_csv(sys.stdout, index=False)
-    
-except Exception as e:
-    print(f"Error: {str(e)}")
-    sys.exit(1)
\ No newline at end of file
+    # Get Anthropic API key from args or environment
+    anthropic_api_key = args.anthropic_api_key or os.environ.get('ANTHROPIC_API_KEY', '')
+
+    tracer = Tracer(enabled=bool(args.trace))
+
+    try:
+        with profiled(args.profile or "", args.profile_output or ""):
+            output_df = match(
+                api_token=args.token,
+                input_filename=args.inputfile,
+                baseline_filename=args.baseline or "",
+                baseline_key_column=args.baseline_key or "",
+                change_report_filename=args.change_report or "",
+                verbosity=args.verbosity,
+                anthropic_api_key=anthropic_api_key,
+                debug=args.debug,
+                tracer=tracer,
+                **settings
+            )
+
+            # Save output
+            with tracer.span("write_output"):
+                if args.outputfile:
+                    # Save to file
+                    output_file_type = args.outputfile.split('.')[-1]
+                    if output_file_type not in ('csv', 'xlsx'):
+                        print(f"Error: Unknown output file type '{output_file_type}'. Using CSV format.")
+                    write_table(output_df, args.outputfile)
+
+                    print(f"\nOutput saved to: {args.outputfile}")
+                else:
+                    # Output to stdout
+                    write_table(output_df, sys.stdout)
+
+        if args.trace:
+            tracer.save(args.trace)
+            if args.verbosity:
+                tracer.print_summary()
+            print(f"Trace saved to: {args.trace}")
+
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
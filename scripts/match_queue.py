@@ -0,0 +1,284 @@
+'''
+Distributed match.py: a coordinator splits the input file into tasks in a SQLite work queue, any number
+of workers on one or more hosts match the tasks and a merger writes the output in input order.
+
+The queue file (see ocl_mapping.workqueue) holds the match settings and one task per --task-rows input
+rows; put it, and the input file, on a filesystem shared by the worker hosts. Each worker reads the input
+once, then claims one task at a time with a lease, runs match() (the $match request, LOINC filtering,
+reranking and LLM judge of match.py) on its rows and stores the output rows in the queue. The lease is
+renewed while the worker runs; if the worker dies, the task is claimed again once the lease expires.
+A task whose $match request fails is retried up to --max-attempts times. Workers only touch the queue
+to claim and store tasks, so throughput grows with the number of workers until $match (or the LLM API)
+is saturated. The merged output is the same as a single match.py run with the same settings.
+
+Usage:
+python match_queue.py init -q=./output/job.sqlite -i=./samples/sample01.csv -r=/orgs/CIEL/sources/CIEL/v2024-10-04/ -e=https://api.dev.openconceptlab.org --correctmap=loinc_code --task-rows=1000
+python match_queue.py work -q=./output/job.sqlite -t=[your-token-here]  # on each host, as many processes as needed
+python match_queue.py status -q=./output/job.sqlite
+python match_queue.py retry -q=./output/job.sqlite  # after fixing the cause of failed tasks
+python match_queue.py merge -q=./output/job.sqlite -o=./output/results.csv
+
+CLI arguments (init):
+-q, --queue: Work queue file to create
+-i, --inputfile: Input file
+-r, -e, --endpoint, -s, -c, -n, --correctmap, --filter-*, --model, --rerank*, ...: Match settings, as for match.py
+--llm: Add the LLM judge recommendation columns (workers need an Anthropic API key)
+--task-rows: Input rows per task (default: 1000)
+--max-attempts: Claims of a task, including expired leases, before it is marked failed (default: 3)
+--overwrite: Replace an existing queue file
+
+CLI arguments (work):
+-q, --queue: Work queue file
+-t, --token: OCL API token
+-k, --anthropic-api-key: Anthropic API key for --llm jobs (default: ANTHROPIC_API_KEY environment variable)
+--worker-id: Name of the worker in the queue (default: <hostname>-<pid>)
+--lease: Lease duration in seconds, renewed every third of it while a task runs (default: 300)
+--poll: Seconds between claims after a failed task or while all remaining tasks are leased by other workers (default: 2)
+-v, --verbosity: match() verbosity
+--debug: Enable debug mode for LLM prompts and responses
+
+CLI arguments (status, retry):
+-q, --queue: Work queue file
+
+CLI arguments (merge):
+-q, --queue: Work queue file
+-o, --outputfile: Output file (CSV or .xlsx; defaults to stdout if not provided)
+'''
+
+import argparse
+import io
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from match import add_match_arguments, match, match_settings
+from ocl_mapping import load_ranker, read_table, write_table
+from ocl_mapping.workqueue import DONE, FAILED, LEASED, PENDING, WorkQueue
+
+
+def init(args):
+    """Coordinator: create the queue with the match settings and one task per --task-rows rows."""
+    settings = match_settings(args)
+    settings["use_llm"] = args.llm
+    input_df = read_table(args.inputfile)
+    if args.overwrite and os.path.exists(args.queue):
+        os.remove(args.queue)
+    queue = WorkQueue.create(args.queue, args.inputfile, settings, len(input_df), task_rows=args.task_rows,
+                             max_attempts=args.max_attempts)
+    counts = queue.counts()
+    print(f"✅ Created {args.queue}: {counts[PENDING]['tasks']} tasks of up to {args.task_rows} rows "
+          f"({len(input_df)} rows of {args.inputfile})")
+
+
+@contextmanager
+def kept_lease(queue, task_id, worker, lease_seconds):
+    """Renew the lease of a task every third of its duration while the block runs."""
+    stop = threading.Event()
+
+    def renew():
+        while not stop.wait(lease_seconds / 3):
+            try:
+                if not queue.renew(task_id, worker, lease_seconds):
+                    print(f"  • Lost the lease of task {task_id}; its result is kept only if it finishes first")
+                    return
+            except sqlite3.Error as e:
+                print(f"  • Could not renew the lease of task {task_id}: {str(e)}")
+
+    thread = threading.Thread(target=renew, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def work(args):
+    """Worker: claim and match tasks until every task is done or failed."""
+    queue = WorkQueue(args.queue)
+    job = queue.job()
+    settings = dict(job["settings"])
+    use_llm = settings.pop("use_llm", False)
+    anthropic_api_key = args.anthropic_api_key or os.environ.get('ANTHROPIC_API_KEY', '')
+    if use_llm and not anthropic_api_key:
+        raise ValueError("The job uses the LLM judge: pass -k or set ANTHROPIC_API_KEY")
+    worker = args.worker_id or f"{socket.gethostname()}-{os.getpid()}"
+
+    # Read the input and load the cross-encoder once for all tasks
+    input_df = read_table(job["input_filename"])
+    if len(input_df) != job["num_rows"]:
+        raise ValueError(f"{job['input_filename']} has {len(input_df)} rows, the queue was created for {job['num_rows']}")
+    ranker = load_ranker(settings["rerank_cache"]) if settings["rerank"] and not settings["rerank_url"] else None
+
+    print(f"Worker {worker} on {args.queue}")
+    start_time = time.time()
+    num_tasks = num_rows = 0
+    while True:
+        task = queue.claim(worker, args.lease)
+        if task is None:
+            counts = queue.counts()
+            if not counts[PENDING]["tasks"] and not counts[LEASED]["tasks"]:
+                break
+            # The remaining tasks are leased by other workers; wait in case a lease expires
+            time.sleep(args.poll)
+            continue
+
+        task_id, start_row, end_row = task["task_id"], task["start_row"], task["end_row"]
+        task_start_time = time.time()
+        try:
+            with kept_lease(queue, task_id, worker, args.lease):
+                output_df = match(
+                    api_token=args.token,
+                    input_filename=job["input_filename"],
+                    input_df=input_df.iloc[start_row:end_row].reset_index(drop=True),
+                    verbosity=args.verbosity,
+                    anthropic_api_key=anthropic_api_key if use_llm else "",
+                    debug=args.debug,
+                    ranker=ranker,
+                    fail_on_error=True,
+                    **settings
+                )
+                stored = queue.complete(task_id, output_df.columns, output_df.to_csv(index=False, header=False), worker)
+        except Exception as e:
+            print(f"  • Task {task_id} (attempt {task['attempts']}) failed: {str(e)}")
+            queue.fail(task_id, worker, e)
+            # Back off so an outage does not use up the attempts of every task at once
+            time.sleep(args.poll)
+            continue
+
+        elapsed = time.time() - task_start_time
+        if stored:
+            num_tasks += 1
+            num_rows += end_row - start_row
+            print(f"✅ Task {task_id} (rows {start_row + 1}-{end_row}) done in {round(elapsed, 2)} sec")
+        else:
+            print(f"  • Task {task_id} was already done by another worker")
+
+    elapsed_seconds = time.time() - start_time
+    print(f"\nWorker {worker}: {num_tasks} tasks, {num_rows} rows in {round(elapsed_seconds, 2)} sec "
+          f"({round(num_rows / elapsed_seconds, 2) if elapsed_seconds else 0} rows/sec)")
+
+
+def status(args):
+    """Print the progress, throughput, active leases and failed tasks of the queue."""
+    queue = WorkQueue(args.queue)
+    job = queue.job()
+    counts = queue.counts()
+    tasks = queue.tasks()
+    print(f"\nQUEUE: {args.queue}")
+    print(f"  Input: {job['input_filename']} ({job['num_rows']} rows, {len(tasks)} tasks)")
+    for state in (PENDING, LEASED, DONE, FAILED):
+        print(f"  {state.capitalize()}: {counts[state]['tasks']} tasks, {counts[state]['rows']} rows")
+
+    done = [task for task in tasks if task["status"] == DONE]
+    if done and job["num_rows"]:
+        elapsed = max(task["finished"] for task in done) - min(task["started"] for task in done)
+        rows_per_sec = counts[DONE]["rows"] / elapsed if elapsed > 0 else 0
+        print(f"  Progress: {round(100 * counts[DONE]['rows'] / job['num_rows'], 1)}%, "
+              f"{round(rows_per_sec, 2)} rows/sec", end="")
+        remaining = job["num_rows"] - counts[DONE]["rows"] - counts[FAILED]["rows"]
+        print(f", about {round(remaining / rows_per_sec)} sec left" if rows_per_sec and remaining else "")
+
+    now = time.time()
+    leased = [task for task in tasks if task["status"] == LEASED]
+    if leased:
+        print("\nLEASES:")
+        for task in leased:
+            expires = round(task["lease_expires"] - now)
+            print(f"  Task {task['task_id']}: {task['worker']} (attempt {task['attempts']}, "
+                  f"{f'expires in {expires} sec' if expires >= 0 else 'expired'})")
+    failed = [task for task in tasks if task["status"] == FAILED]
+    if failed:
+        print("\nFAILED:")
+        for task in failed:
+            print(f"  Task {task['task_id']} (rows {task['start_row'] + 1}-{task['end_row']}): {task['error']}")
+
+
+def retry(args):
+    """Make the failed tasks pending again."""
+    print(f"✅ {WorkQueue(args.queue).retry_failed()} failed tasks are pending again")
+
+
+def merge(args):
+    """Merger: write the task outputs in input order as one output file."""
+    # Lazy import to keep CLI startup (e.g. --help) fast
+    import pandas as pd
+
+    queue = WorkQueue(args.queue)
+    output = io.StringIO()
+    header = None
+    for columns, rows in queue.outputs():
+        if header is None:
+            header = columns
+            output.write(pd.DataFrame(columns=columns).to_csv(index=False))
+        elif columns != header:
+            raise ValueError(f"Task outputs have different columns: {columns} instead of {header}")
+        output.write(rows)
+
+    if not args.outputfile:
+        sys.stdout.write(output.getvalue())
+        return
+    if args.outputfile.split('.')[-1] == 'xlsx':
+        output.seek(0)
+        write_table(pd.read_csv(output), args.outputfile)
+    else:
+        with open(args.outputfile, 'w', newline='') as f:
+            f.write(output.getvalue())
+    print(f"✅ Output saved to: {args.outputfile}")
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='match_queue.py',
+                                     description='Match a large input file with many workers through a SQLite work queue')
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    init_parser = subparsers.add_parser("init", help="Create the work queue (coordinator)")
+    init_parser.add_argument('-q', '--queue', required=True, help="Work queue file to create")
+    init_parser.add_argument('-i', '--inputfile', required=True, help="File of input data to be mapped")
+    add_match_arguments(init_parser)
+    init_parser.add_argument('--llm', action='store_true',
+                             help="Add the LLM judge recommendation columns (workers need an Anthropic API key)")
+    init_parser.add_argument('--task-rows', type=int, default=1000, help="Input rows per task (default: 1000)")
+    init_parser.add_argument('--max-attempts', type=int, default=3,
+                             help="Claims of a task, including expired leases, before it is marked failed (default: 3)")
+    init_parser.add_argument('--overwrite', action='store_true', help="Replace an existing queue file")
+    init_parser.set_defaults(func=init)
+
+    work_parser = subparsers.add_parser("work", help="Claim and match tasks until the queue is finished (worker)")
+    work_parser.add_argument('-q', '--queue', required=True, help="Work queue file")
+    work_parser.add_argument('-t', '--token', required=True, help="OCL API token")
+    work_parser.add_argument('-k', '--anthropic-api-key', help="Anthropic API key for LLM evaluation")
+    work_parser.add_argument('--worker-id', help="Name of the worker in the queue (default: <hostname>-<pid>)")
+    work_parser.add_argument('--lease', type=float, default=300,
+                             help="Lease duration in seconds, renewed while a task runs (default: 300)")
+    work_parser.add_argument('--poll', type=float, default=2,
+                             help="Seconds between claims after a failed task or while the remaining tasks are leased (default: 2)")
+    work_parser.add_argument('-v', '--verbosity', type=int, default=0)
+    work_parser.add_argument('--debug', action='store_true', help="Enable debug mode for LLM prompts and responses")
+    work_parser.set_defaults(func=work)
+
+    for name, func, help_text in (("status", status, "Print the progress of the queue"),
+                                  ("retry", retry, "Make the failed tasks pending again")):
+        command_parser = subparsers.add_parser(name, help=help_text)
+        command_parser.add_argument('-q', '--queue', required=True, help="Work queue file")
+        command_parser.set_defaults(func=func)
+
+    merge_parser = subparsers.add_parser("merge", help="Write the output of a finished queue in input order (merger)")
+    merge_parser.add_argument('-q', '--queue', required=True, help="Work queue file")
+    merge_parser.add_argument('-o', '--outputfile', help="Output file (defaults to stdout if not provided)")
+    merge_parser.set_defaults(func=merge)
+
+    args = parser.parse_args()
+    try:
+        args.func(args)
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
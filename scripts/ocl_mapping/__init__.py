@@ -0,0 +1,70 @@
+'''
+Importable building blocks of the match.py and mapeval.py scripts.
+
+- client: MatchClient posts chunks of rows to an OCL $match endpoint, plus the shared row
+  preparation, chunking, candidate sorting and LOINC type filtering
+- evaluator: TopNEvaluator scores candidates against a correct-map column (top-n, auto-matches,
+  excluded and new-concept rows)
+- writer: read_table/write_table for CSV and Excel files and ResultBuffer for the top-n output columns
+- rerank: cross-encoder reranking of the candidates of a chunk (local model or rank server)
+- llm: LLM judge recommendation for the candidates of a row
+- incremental: row hashes, baselines and change reports for re-matching only new or changed rows
+- workqueue: WorkQueue, the SQLite task queue with leases behind match_queue.py
+
+Names are imported from their submodule on first use, so importing the package (or a CLI built on
+it) does not load pandas, numpy, requests, anthropic or torch until they are needed.
+
+Usage (with scripts/ on sys.path, e.g. from a notebook or a long-running service):
+from ocl_mapping import MatchClient, TopNEvaluator, read_table, prepare_rows, chunked
+
+client = MatchClient("https://api.dev.openconceptlab.org/concepts/$match/",
+                     "/orgs/CIEL/sources/CIEL/v2024-10-04/", api_token=token, limit=5)
+rows = prepare_rows(read_table("./samples/sample01.csv").to_dict(orient="records"))
+for chunk in chunked(rows, 200):
+    response = client.match(chunk)
+'''
+
+import importlib
+
+_EXPORTS = {
+    "MatchClient": "client",
+    "chunked": "client",
+    "prepare_rows": "client",
+    "search_score": "client",
+    "sort_candidates": "client",
+    "matches_loinc_type": "client",
+    "filter_candidates": "client",
+    "refetch_short_rows": "client",
+    "json_dumps": "client",
+    "json_loads": "client",
+    "TopNEvaluator": "evaluator",
+    "correct_rank": "evaluator",
+    "correct_map_status": "evaluator",
+    "ResultBuffer": "writer",
+    "read_table": "writer",
+    "write_table": "writer",
+    "load_ranker": "rerank",
+    "rerank_candidates": "rerank",
+    "get_llm_recommendation": "llm",
+    "llm_failed": "llm",
+    "HASH_COLUMN": "incremental",
+    "Baseline": "incremental",
+    "change_report": "incremental",
+    "row_hashes": "incremental",
+    "run_fingerprint": "incremental",
+    "WorkQueue": "workqueue",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{_EXPORTS[name]}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,170 @@
+'''
+$match client and the candidate handling shared by match.py and mapeval.py.
+'''
+
+import heapq
+import json
+
+from tracing import Tracer
+
+# Use orjson for the $match request and response bodies when it is installed (several times faster)
+try:
+    import orjson
+
+    json_dumps = orjson.dumps
+    json_loads = orjson.loads
+except ImportError:
+    def json_dumps(obj):
+        return json.dumps(obj).encode("utf-8")
+
+    json_loads = json.loads
+
+LOINC_TYPE_PREFIXES = {"Part": "LP", "Group": "LG", "List": "LL", "Answers": "LA"}
+
+
+class MatchClient:
+    """Posts chunks of rows to an OCL $match endpoint, reusing one HTTP session across requests."""
+
+    def __init__(self, api_match_url, target_repo="", api_token="", semantic=False, knn_num_candidates=1000,
+                 knearest=5, limit=5, tracer=None):
+        """
+        Args:
+            api_match_url: Full $match URL, e.g. https://api.dev.openconceptlab.org/concepts/$match/
+            target_repo: Target repository, e.g. /orgs/CIEL/sources/CIEL/v2024-10-04/
+            limit: Default number of candidates requested per row
+            tracer: Optional tracing.Tracer for request/encode/parse spans and byte counters
+        """
+        # Lazy import to keep CLI startup (e.g. --help) fast
+        import requests
+
+        self.api_match_url = api_match_url
+        self.target_repo = target_repo
+        self.tracer = tracer or Tracer(enabled=False)
+        self.params = {
+            "includeSearchMeta": True,
+            "semantic": semantic,
+            "limit": limit,
+            "kNearest": knearest,
+            "numCandidates": knn_num_candidates,
+            "bestMatch": False
+        }
+        self.headers = {"Content-Type": "application/json"}
+        if api_token:
+            self.headers["Authorization"] = "Token %s" % (api_token)
+        self.session = requests.Session()
+
+    def match(self, rows, limit=None, chunk_num=0, encoded_rows=None):
+        """
+        POST rows to the $match endpoint and return the parsed response (one entry per row).
+
+        `encoded_rows` (json_dumps(rows)) lets callers serialize a chunk once for several targets.
+        """
+        params = self.params if limit is None else dict(self.params, limit=limit)
+        with self.tracer.span("encode_request", chunk=chunk_num):
+            if encoded_rows is None:
+                encoded_rows = json_dumps(rows)
+            body = b'{"rows":' + encoded_rows + b',"target_repo_url":' + json_dumps(self.target_repo) + b'}'
+        with self.tracer.span("request", chunk=chunk_num, rows=len(rows), limit=params["limit"]):
+            r = self.session.post(self.api_match_url, data=body, params=params, headers=self.headers)
+            r.raise_for_status()
+        self.tracer.count("request_bytes", len(body))
+        self.tracer.count("response_bytes", len(r.content))
+        with self.tracer.span("parse_response", chunk=chunk_num):
+            return json_loads(r.content)
+
+    def close(self):
+        self.session.close()
+
+
+def chunked(data, max_chunk_size):
+    """Split a list of rows into chunks of at most max_chunk_size rows."""
+    return [data[i * max_chunk_size:(i + 1) * max_chunk_size]
+            for i in range((len(data) + max_chunk_size - 1) // max_chunk_size)]
+
+
+def prepare_rows(rows):
+    """Prepare input rows for $match in place: name defaults to "", synonyms to [name], id is dropped."""
+    for row in rows:
+        row['name'] = row.get('name', None) or ""
+        row['synonyms'] = [row['name']]
+        row.pop('id', None)
+    return rows
+
+
+def search_score(candidate):
+    return candidate["search_meta"]["search_score"]
+
+
+def sort_candidates(candidates, top_n=None):
+    """
+    Candidates ordered by search score, highest first: all of them, or only the top_n
+    (heapq.nlargest is stable, like the full sort).
+    """
+    if top_n is None:
+        return sorted(candidates, key=search_score, reverse=True)
+    return heapq.nlargest(top_n, candidates, key=search_score)
+
+
+def matches_loinc_type(code, loinc_type):
+    """
+    Check if a LOINC code matches the specified type based on prefix.
+
+    LOINC Code Types:
+    - LOINC: Regular codes (no special prefix like LP, LG, LL, LA)
+    - Part: LP prefix
+    - Group: LG prefix
+    - List: LL prefix
+    - Answers: LA prefix
+    """
+    if not code or not loinc_type:
+        return True
+
+    code = str(code).strip()
+
+    if loinc_type == "LOINC":
+        # Regular LOINC codes don't start with the special prefixes
+        return not any(code.startswith(prefix) for prefix in LOINC_TYPE_PREFIXES.values())
+    if loinc_type in LOINC_TYPE_PREFIXES:
+        return code.startswith(LOINC_TYPE_PREFIXES[loinc_type])
+
+    return True
+
+
+def filter_candidates(candidates, loinc_type):
+    """Keep the candidates whose id matches the LOINC code type (all of them if loinc_type is empty)."""
+    if not loinc_type:
+        return candidates
+    return [candidate for candidate in candidates if matches_loinc_type(candidate.get("id", ""), loinc_type)]
+
+
+def refetch_short_rows(response, rows, fetch, limit, target_count, max_limit, growth, loinc_type, fetch_stats):
+    """
+    Adaptive over-fetch for LOINC type filtering.
+
+    Rows that have fewer than `target_count` candidates of the requested type although $match
+    returned a full page (so more candidates exist) are re-queried together with a limit grown by
+    `growth`, until every row is filled or `max_limit` is reached. `response` is updated in place.
+
+    Args:
+        fetch: Function (rows, limit) -> $match response for those rows
+        fetch_stats: Dictionary of counters updated with the re-queries
+
+    Returns:
+        Number of rows still short of `target_count` after the last re-query
+    """
+    def is_short(row_matches, row_limit):
+        candidates = row_matches.get("results") or []
+        matching = sum(1 for candidate in candidates if matches_loinc_type(candidate.get("id", ""), loinc_type))
+        return matching < target_count and len(candidates) >= row_limit
+
+    short = [i for i, row_matches in enumerate(response) if is_short(row_matches, limit)]
+    while short and limit < max_limit:
+        limit = min(max(int(limit * growth), limit + 1), max_limit)
+        refetched = fetch([rows[i] for i in short], limit)
+        fetch_stats["requests"] += 1
+        fetch_stats["refetched_rows"] += len(short)
+        fetch_stats["requested_candidates"] += len(short) * limit
+        for i, row_matches in zip(short, refetched):
+            response[i] = row_matches
+        short = [i for i in short if is_short(response[i], limit)]
+    return sum(1 for row_matches in response if is_short(row_matches, 0))
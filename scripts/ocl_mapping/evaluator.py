@@ -0,0 +1,77 @@
+'''
+Top-n evaluation of $match candidates against a correct-map column.
+'''
+
+
+def correct_map_status(value):
+    """
+    Classify a correct-map value.
+
+    Returns:
+        Tuple of (status, correct map): status is "excluded" (empty or missing correct map), "new" (a new
+        concept is proposed) or "" when the row can be evaluated against the stripped correct map
+    """
+    correct_map = str(value).strip() if value else ""
+    if not correct_map:
+        return "excluded", ""
+    if correct_map.lower() == "new":
+        return "new", correct_map
+    return "", correct_map
+
+
+def correct_rank(correct_map, candidates, limit=None):
+    """1-based position of the correct map among the (first `limit`) candidates; 0 if not found."""
+    for i, candidate in enumerate(candidates[:limit] if limit else candidates):
+        if str(candidate.get("id", "")).strip() == correct_map:
+            return i + 1
+    return 0
+
+
+class TopNEvaluator:
+    """Accumulates top-n, auto-match, excluded and new-concept counts over evaluated rows."""
+
+    def __init__(self, correct_map_column, top_n=5):
+        self.correct_map_column = correct_map_column
+        self.top_n = top_n
+        self.num_correct_matches_in_top_n = [0] * top_n
+        self.num_auto_match = 0  # 'search_meta.match_type=very_high'
+        self.num_excluded = 0
+        self.num_new_concept_proposed = 0
+        self.unmatched = []
+
+    def evaluate(self, row, candidates):
+        """
+        Evaluate the sorted candidates of a row.
+
+        Returns:
+            Tuple of (status, rank, matched candidate): status is matched, unmatched, excluded, new or
+            not_evaluated (no correct map column), rank is 1-based (0 if not matched)
+        """
+        if not self.correct_map_column:
+            return "not_evaluated", 0, None
+        status, correct_map = correct_map_status(row.get(self.correct_map_column))
+        if status == "excluded":
+            self.num_excluded += 1
+            return status, 0, None
+        if status == "new":
+            self.num_new_concept_proposed += 1
+            return status, 0, None
+
+        rank = correct_rank(correct_map, candidates)
+        if not rank:
+            self.unmatched.append(row)
+            return "unmatched", 0, None
+        candidate = candidates[rank - 1]
+        if candidate["search_meta"].get("match_type") == "very_high":
+            self.num_auto_match += 1
+        for i in range(rank - 1, self.top_n):
+            self.num_correct_matches_in_top_n[i] += 1
+        return "matched", rank, candidate
+
+    def metrics(self):
+        return {
+            "num_auto_matches": self.num_auto_match,
+            "num_correct_matches_in_top_n": self.num_correct_matches_in_top_n,
+            "num_excluded_rows": self.num_excluded,
+            "num_new_concept_proposed": self.num_new_concept_proposed,
+        }
@@ -0,0 +1,129 @@
+'''
+Row hashes, baselines and change reports for incremental re-matching.
+
+Every output row of an incremental run carries a match-hash: a fingerprint of the run settings that
+affect the results, followed by a hash of the row's fields after the column map. A later run with the
+previous output as its baseline only re-matches the rows whose hash is not in the baseline and carries
+the result columns of the other rows over. Rows whose matching failed are written with a blank hash,
+so they are never carried over.
+'''
+
+import hashlib
+import json
+import os
+
+from .writer import read_table
+
+HASH_COLUMN = "match-hash"
+
+
+def _digest(value, length):
+    return hashlib.sha1(json.dumps(value, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:length]
+
+
+def run_fingerprint(settings):
+    """Short hash of the run settings that affect the results (dictionary of JSON-serializable values)."""
+    return _digest(settings, 12)
+
+
+def _normalize(value):
+    # A blank cell turns an integer column into floats; hash 123.0 like 123 so the other rows keep their hash
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def row_hashes(rows, fingerprint):
+    """<fingerprint>-<row hash> of every row (dictionaries of the row's fields after the column map)."""
+    return [f"{fingerprint}-{_digest({key: _normalize(value) for key, value in row.items()}, 16)}" for row in rows]
+
+
+class Baseline:
+    """Result columns of a previous output file, looked up by match-hash (rows with a blank hash are skipped)."""
+
+    def __init__(self, filename, result_columns, key_column=""):
+        """
+        Args:
+            filename: Previous output file (a missing file gives an empty baseline, e.g. on the first run)
+            result_columns: Result columns the rows must have to be carried over
+            key_column: Optional input column identifying a row across runs, to tell new from changed rows
+        """
+        self.filename = filename
+        self.key_column = key_column
+        self.hashes = []
+        self.keys = []
+        self.failed_keys = set()
+        self.num_failed = 0
+        self.positions = {}
+        self.results = None
+        self.reason = ""
+        if not filename or not os.path.exists(filename):
+            self.reason = f"baseline {filename} not found"
+            return
+
+        # Cells are read as text and written back unchanged; empty cells become NaN
+        df = read_table(filename, dtype=str, keep_default_na=False)
+        missing = [column for column in [HASH_COLUMN] + list(result_columns) if column not in df.columns]
+        if missing:
+            self.reason = f"baseline {filename} has no {', '.join(missing[:3])}{'...' if len(missing) > 3 else ''} column"
+            return
+        # Rows whose matching failed have no hash: they are matched again, never carried over
+        failed = df[HASH_COLUMN].str.strip() == ""
+        self.num_failed = int(failed.sum())
+        if key_column and key_column in df.columns:
+            self.failed_keys = set(df.loc[failed, key_column])
+        df = df[~failed].reset_index(drop=True)
+        self.hashes = df[HASH_COLUMN].tolist()
+        if key_column and key_column in df.columns:
+            self.keys = df[key_column].tolist()
+        for position, row_hash in enumerate(self.hashes):
+            self.positions.setdefault(row_hash, position)
+        results = df[list(result_columns)]
+        self.results = results.mask(results == "")
+
+    @property
+    def fingerprints(self):
+        return {row_hash.split("-")[0] for row_hash in self.hashes}
+
+    def __contains__(self, row_hash):
+        return row_hash in self.positions
+
+    def __len__(self):
+        return len(self.hashes)
+
+
+def change_report(baseline, hashes, keys=None):
+    """
+    Compare the row hashes (and keys) of the current input with a baseline.
+
+    Returns:
+        List of dictionaries (status, row_number, baseline_row_number, key, match-hash) for the rows
+        to re-match (status new, changed, failed for rows whose matching failed in the baseline run, or
+        new_or_changed without a key column) and the baseline rows that are gone (status removed); row
+        numbers are 1-based
+    """
+    current_hashes = set(hashes)
+    baseline_keys = set(baseline.keys)
+    report = []
+    for i, row_hash in enumerate(hashes):
+        if row_hash in baseline:
+            continue
+        key = keys[i] if keys else ""
+        if keys and key in baseline.failed_keys:
+            status = "failed"
+        elif not keys or not baseline.keys:
+            status = "new_or_changed"
+        else:
+            status = "changed" if key in baseline_keys else "new"
+        report.append({"status": status, "row_number": i + 1, "baseline_row_number": "", "key": key,
+                       HASH_COLUMN: row_hash})
+    current_keys = set(keys or [])
+    for position, row_hash in enumerate(baseline.hashes):
+        if row_hash in current_hashes:
+            continue
+        key = baseline.keys[position] if baseline.keys else ""
+        if keys and baseline.keys and key in current_keys:
+            continue  # Reported as changed
+        report.append({"status": "removed", "row_number": "", "baseline_row_number": position + 1, "key": key,
+                       HASH_COLUMN: row_hash})
+    return report
@@ -0,0 +1,71 @@
+'''
+LLM judge recommendation for the $match candidates of a row.
+'''
+
+from prompts import format_llm_judge_prompt, parse_llm_response
+
+# Rationales returned by get_llm_recommendation (and parse_llm_response) when the judge failed
+LLM_ERROR_PREFIXES = ("anthropic package not installed", "LLM evaluation error:", "Failed to parse LLM response",
+                      "Error parsing response:")
+
+
+def get_llm_recommendation(row_data, candidates, api_key, model="claude-3-5-sonnet-20241022", debug=False):
+    """
+    Get LLM recommendation for the best candidate match.
+
+    Returns:
+        Tuple of (recommendation_id, rationale) or (None, error_message)
+    """
+    try:
+        # Lazy import to avoid requiring anthropic when not using LLM features
+        import anthropic
+
+        client = anthropic.Anthropic(api_key=api_key)
+
+        # Format the prompt
+        system_prompt, user_prompt = format_llm_judge_prompt(row_data, candidates, debug=debug)
+
+        if debug:
+            print("\n" + "="*80)
+            print("DEBUG: LLM PROMPT")
+            print("="*80)
+            print("System Prompt:")
+            print(system_prompt[:500] + "..." if len(system_prompt) > 500 else system_prompt)
+            print("\nUser Prompt:")
+            print(user_prompt)
+            print("="*80 + "\n")
+
+        # Call the API
+        message = client.messages.create(
+            model=model,
+            max_tokens=2000,
+            temperature=0,
+            system=system_prompt,
+            messages=[
+                {"role": "user", "content": user_prompt}
+            ]
+        )
+
+        response_text = message.content[0].text
+
+        if debug:
+            print("\n" + "="*80)
+            print("DEBUG: LLM RESPONSE")
+            print("="*80)
+            print(response_text)
+            print("="*80 + "\n")
+
+        # Parse the response
+        recommendation, rationale = parse_llm_response(response_text)
+
+        return recommendation, rationale
+
+    except ImportError:
+        return None, "anthropic package not installed. Run: pip install anthropic"
+    except Exception as e:
+        return None, f"LLM evaluation error: {str(e)}"
+
+
+def llm_failed(recommendation_id, rationale):
+    """True if a get_llm_recommendation result is an error rather than the judge's answer."""
+    return recommendation_id is None and str(rationale or "").startswith(LLM_ERROR_PREFIXES)
@@ -0,0 +1,71 @@
+'''
+Cross-encoder reranking of $match candidates (in-process MedicalTermRanker or a running rank server).
+'''
+
+import os
+import sys
+
+
+def add_cross_encoder_path():
+    """Make the cross-encoder modules (cross_encode, rank_server) importable."""
+    cross_encoder_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'cross-encoder')
+    if cross_encoder_dir not in sys.path:
+        sys.path.insert(0, cross_encoder_dir)
+
+
+def load_ranker(cache_path=""):
+    """
+    Load the cross-encoder used for reranking, with an in-memory score cache (persisted to
+    `cache_path` if given).
+
+    Lazy import to avoid requiring torch/transformers when not reranking.
+    """
+    add_cross_encoder_path()
+    from cross_encode import MedicalTermRanker
+    from score_cache import ScoreCache
+    return MedicalTermRanker(candidate_pool=[], cache=ScoreCache(path=cache_path or None))
+
+
+def rerank_candidates(queries, candidates_per_row, ranker=None, rerank_url="", batch_size=64):
+    """
+    Rerank the candidates of every row in a chunk with the cross-encoder.
+
+    All (row, candidate) pairs of the chunk are scored together, either in-process with `ranker`
+    or by a rank server at `rerank_url`.
+
+    Args:
+        queries: Query text for each row
+        candidates_per_row: List of $match candidates for each row
+        ranker: MedicalTermRanker instance (used when rerank_url is not set)
+        rerank_url: Base URL of a running rank_server.py
+
+    Returns:
+        Tuple of (reranked candidates per row, rerank scores per row), both sorted by rerank score
+    """
+    if rerank_url:
+        add_cross_encoder_path()
+        from rank_server import rank_remote
+        # Send candidate positions as codes so results map back to the full candidate dicts
+        ranked_rows = rank_remote(
+            rerank_url, queries,
+            [[(str(i), candidate.get("display_name", "")) for i, candidate in enumerate(candidates)]
+             for candidates in candidates_per_row]
+        )
+        return ([[candidates[int(code)] for code, _, _ in ranked]
+                 for candidates, ranked in zip(candidates_per_row, ranked_rows)],
+                [[score for _, _, score in ranked] for ranked in ranked_rows])
+
+    pair_queries, pair_texts = [], []
+    for query, candidates in zip(queries, candidates_per_row):
+        pair_queries.extend([query] * len(candidates))
+        pair_texts.extend([candidate.get("display_name", "") for candidate in candidates])
+    scores = ranker.score_pairs(pair_queries, pair_texts, batch_size=batch_size) if pair_queries else []
+
+    reranked, reranked_scores, offset = [], [], 0
+    for candidates in candidates_per_row:
+        row_scores = scores[offset:offset + len(candidates)]
+        offset += len(candidates)
+        order = sorted(range(len(candidates)), key=lambda i: row_scores[i], reverse=True)
+        reranked.append([candidates[i] for i in order])
+        reranked_scores.append([row_scores[i] for i in order])
+    return reranked, reranked_scores
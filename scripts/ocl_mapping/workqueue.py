@@ -0,0 +1,200 @@
+'''
+Durable SQLite work queue for matching one input file with many worker processes.
+
+A coordinator creates the queue file: the job (input file and match settings) and one task per range
+of input rows. Workers on one or more hosts claim tasks with a lease, renew it while they match and
+store each task's output rows (CSV text, without header) when they are done. A task whose worker died
+is claimed again once its lease expires, and a task that keeps failing is marked failed after
+max_attempts. The merger concatenates the task outputs in input order.
+
+Every operation is a short transaction on its own connection, so the file can live on a shared
+filesystem (the default rollback journal is used, as WAL needs shared memory between the hosts).
+Leases use wall-clock time, so the clocks of the worker hosts should be roughly in sync.
+
+Usage:
+from ocl_mapping.workqueue import WorkQueue
+
+queue = WorkQueue.create("./output/job.sqlite", "./samples/sample01.csv", settings, num_rows=100000)
+task = queue.claim("host-1234", lease_seconds=300)
+queue.complete(task["task_id"], columns, csv_text)
+print(queue.counts())
+'''
+
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+PENDING, LEASED, DONE, FAILED = "pending", "leased", "done", "failed"
+
+
+class WorkQueue:
+    """Tasks of row ranges with leases, attempts and stored outputs in one SQLite file."""
+
+    def __init__(self, path, timeout=60.0):
+        """
+        Args:
+            path: Existing queue file (see create)
+            timeout: Seconds to wait for a lock held by another process
+        """
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Work queue {path} not found")
+        self.path = path
+        self.timeout = timeout
+
+    @classmethod
+    def create(cls, path, input_filename, settings, num_rows, task_rows=1000, max_attempts=3):
+        """
+        Create a queue file with one task per task_rows input rows.
+
+        Args:
+            path: New queue file (must not exist)
+            input_filename: Input file; stored as an absolute path so workers can run from any directory
+            settings: JSON-serializable job settings (e.g. match() keyword arguments)
+            num_rows: Number of input rows
+            task_rows: Rows per task
+            max_attempts: Claims of a task (including expired leases) before it is marked failed
+        """
+        if os.path.exists(path):
+            raise FileExistsError(f"Work queue {path} already exists")
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        conn = sqlite3.connect(path)
+        try:
+            with conn:
+                conn.execute("CREATE TABLE job (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+                conn.execute("CREATE TABLE tasks (task_id INTEGER PRIMARY KEY, start_row INTEGER NOT NULL, "
+                             "end_row INTEGER NOT NULL, status TEXT NOT NULL, worker TEXT, lease_expires REAL, "
+                             "attempts INTEGER NOT NULL DEFAULT 0, error TEXT, started REAL, finished REAL)")
+                conn.execute("CREATE INDEX tasks_status ON tasks (status)")
+                conn.execute("CREATE TABLE results (task_id INTEGER PRIMARY KEY, columns TEXT NOT NULL, "
+                             "output TEXT NOT NULL)")
+                job = {"input_filename": os.path.abspath(input_filename), "settings": settings, "num_rows": num_rows,
+                       "task_rows": task_rows, "max_attempts": max_attempts, "created": time.time()}
+                conn.executemany("INSERT INTO job (key, value) VALUES (?, ?)",
+                                 [(key, json.dumps(value)) for key, value in job.items()])
+                conn.executemany("INSERT INTO tasks (start_row, end_row, status) VALUES (?, ?, ?)",
+                                 [(start, min(start + task_rows, num_rows), PENDING)
+                                  for start in range(0, num_rows, task_rows)])
+        finally:
+            conn.close()
+        return cls(path)
+
+    @contextmanager
+    def _transaction(self):
+        """Connection in an immediate (write-locked) transaction, committed on success."""
+        conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def job(self):
+        """Job settings: input_filename, settings, num_rows, task_rows, max_attempts and created."""
+        with self._transaction() as conn:
+            return {row["key"]: json.loads(row["value"]) for row in conn.execute("SELECT key, value FROM job")}
+
+    def claim(self, worker, lease_seconds=300):
+        """
+        Lease the first pending task (or task with an expired lease) to a worker.
+
+        Returns:
+            Dictionary of the task (task_id, start_row, end_row, attempts), or None if no task is claimable
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            max_attempts = json.loads(conn.execute("SELECT value FROM job WHERE key = 'max_attempts'").fetchone()[0])
+            # Tasks whose last allowed attempt died with its worker are not retried
+            conn.execute("UPDATE tasks SET status = ?, error = 'lease expired' "
+                         "WHERE status = ? AND lease_expires < ? AND attempts >= ?",
+                         (FAILED, LEASED, now, max_attempts))
+            row = conn.execute("SELECT task_id, start_row, end_row, attempts FROM tasks "
+                               "WHERE status = ? OR (status = ? AND lease_expires < ?) ORDER BY task_id LIMIT 1",
+                               (PENDING, LEASED, now)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE tasks SET status = ?, worker = ?, lease_expires = ?, attempts = attempts + 1, "
+                         "started = ? WHERE task_id = ?", (LEASED, worker, now + lease_seconds, now, row["task_id"]))
+            task = dict(row)
+            task["attempts"] += 1
+            return task
+
+    def renew(self, task_id, worker, lease_seconds=300):
+        """Extend the lease of a task; False if the worker no longer holds it (e.g. it expired and was re-claimed)."""
+        with self._transaction() as conn:
+            cursor = conn.execute("UPDATE tasks SET lease_expires = ? WHERE task_id = ? AND worker = ? AND status = ?",
+                                  (time.time() + lease_seconds, task_id, worker, LEASED))
+            return cursor.rowcount == 1
+
+    def complete(self, task_id, columns, output, worker=""):
+        """
+        Store the output of a task (list of column names, CSV text of its rows without header).
+
+        The first completion wins, even from a worker whose lease expired, so a slow worker's result is
+        not thrown away; False if the task was already done.
+        """
+        with self._transaction() as conn:
+            cursor = conn.execute("UPDATE tasks SET status = ?, worker = COALESCE(NULLIF(?, ''), worker), error = NULL, "
+                                  "finished = ? WHERE task_id = ? AND status != ?",
+                                  (DONE, worker, time.time(), task_id, DONE))
+            if cursor.rowcount != 1:
+                return False
+            conn.execute("INSERT OR REPLACE INTO results (task_id, columns, output) VALUES (?, ?, ?)",
+                         (task_id, json.dumps(list(columns)), output))
+            return True
+
+    def fail(self, task_id, worker, error):
+        """Release a task after an error: pending again, or failed once it used up max_attempts."""
+        with self._transaction() as conn:
+            max_attempts = json.loads(conn.execute("SELECT value FROM job WHERE key = 'max_attempts'").fetchone()[0])
+            conn.execute("UPDATE tasks SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, lease_expires = NULL, "
+                         "error = ? WHERE task_id = ? AND worker = ? AND status = ?",
+                         (max_attempts, FAILED, PENDING, str(error), task_id, worker, LEASED))
+
+    def retry_failed(self):
+        """Make the failed tasks pending again with a fresh set of attempts; returns their number."""
+        with self._transaction() as conn:
+            return conn.execute("UPDATE tasks SET status = ?, attempts = 0 WHERE status = ?", (PENDING, FAILED)).rowcount
+
+    def counts(self):
+        """Number of tasks and rows per status (pending, leased, done, failed)."""
+        counts = {status: {"tasks": 0, "rows": 0} for status in (PENDING, LEASED, DONE, FAILED)}
+        with self._transaction() as conn:
+            for row in conn.execute("SELECT status, COUNT(*), SUM(end_row - start_row) FROM tasks GROUP BY status"):
+                counts[row[0]] = {"tasks": row[1], "rows": row[2]}
+        return counts
+
+    def tasks(self, status=None):
+        """Tasks (without outputs) in input order, optionally only those of one status."""
+        query = ("SELECT task_id, start_row, end_row, status, worker, lease_expires, attempts, error, started, finished "
+                 "FROM tasks")
+        with self._transaction() as conn:
+            if status:
+                return [dict(row) for row in conn.execute(query + " WHERE status = ? ORDER BY task_id", (status,))]
+            return [dict(row) for row in conn.execute(query + " ORDER BY task_id")]
+
+    def outputs(self):
+        """
+        Generate (columns, CSV text) of the task outputs in input order.
+
+        Raises:
+            RuntimeError: if a task is not done yet
+        """
+        unfinished = [task for task in self.tasks() if task["status"] != DONE]
+        if unfinished:
+            raise RuntimeError(f"{len(unfinished)} tasks are not done (first: task {unfinished[0]['task_id']}, "
+                               f"{unfinished[0]['status']})")
+        conn = sqlite3.connect(self.path, timeout=self.timeout)
+        try:
+            for columns, output in conn.execute("SELECT columns, output FROM results ORDER BY task_id"):
+                yield json.loads(columns), output
+        finally:
+            conn.close()
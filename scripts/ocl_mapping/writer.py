@@ -0,0 +1,77 @@
+'''
+Input/output tables and the top-n result columns of match.py.
+'''
+
+
+def read_table(filename, **kwargs):
+    """Read a CSV or Excel (.xlsx) input file as a DataFrame; kwargs are passed to the pandas reader."""
+    # Lazy import to keep CLI startup (e.g. --help) fast
+    import pandas as pd
+
+    file_type = filename.split('.')[-1]  # e.g. csv, xlsx
+    if file_type == 'csv':
+        return pd.read_csv(filename, **kwargs)
+    if file_type == 'xlsx':
+        return pd.read_excel(filename, **kwargs)
+    raise ValueError(f"Unknown file type {file_type}")
+
+
+def write_table(df, filename):
+    """Write a DataFrame as Excel for .xlsx files and as CSV otherwise (filename may be a file object)."""
+    if isinstance(filename, str) and filename.split('.')[-1] == 'xlsx':
+        df.to_excel(filename, index=False)
+    else:
+        df.to_csv(filename, index=False)
+
+
+class ResultBuffer:
+    """
+    Preallocated, column-oriented storage of the top-n candidates of every input row.
+
+    Codes and names are (rows, top_n) object arrays and scores (rows, top_n) float arrays, filled in
+    place; to_frame() turns them into the output columns (01_code, 01_name, 01_score, ...) in one step.
+    """
+
+    def __init__(self, num_rows, top_n, rerank=False, top_n_column=False, llm=False):
+        import numpy as np
+
+        self.top_n = top_n
+        self.codes = np.full((num_rows, top_n), "", dtype=object)
+        self.names = np.full((num_rows, top_n), "", dtype=object)
+        self.scores = np.full((num_rows, top_n), np.nan)
+        self.rerank_scores = np.full((num_rows, top_n), np.nan) if rerank else None
+        # Rank of the correct map among the candidates (0: not found)
+        self.top_n_ranks = np.zeros(num_rows, dtype=np.int64) if top_n_column else None
+        self.ai_recommendations = np.full(num_rows, "", dtype=object) if llm else None
+        self.ai_rationales = np.full(num_rows, "", dtype=object) if llm else None
+
+    def set_candidates(self, row_index, candidates, rerank_scores=None):
+        """Store the first top_n candidates (and their rerank scores) of a row."""
+        count = min(self.top_n, len(candidates))
+        for i in range(count):
+            candidate = candidates[i]
+            self.codes[row_index, i] = candidate.get("id", "")
+            self.names[row_index, i] = candidate.get("display_name", "")
+            self.scores[row_index, i] = candidate["search_meta"].get("search_score", 0)
+        if rerank_scores is not None and self.rerank_scores is not None:
+            self.rerank_scores[row_index, :count] = rerank_scores[:count]
+
+    def to_frame(self):
+        import pandas as pd
+
+        columns = {}
+        scores = self.scores.round(4)
+        rerank_scores = self.rerank_scores.round(4) if self.rerank_scores is not None else None
+        for i in range(self.top_n):
+            rank_prefix = f"{i+1:02d}"  # 01, 02, 03, etc.
+            columns[f"{rank_prefix}_code"] = self.codes[:, i]
+            columns[f"{rank_prefix}_name"] = self.names[:, i]
+            columns[f"{rank_prefix}_score"] = scores[:, i]
+            if rerank_scores is not None:
+                columns[f"{rank_prefix}_rerank_score"] = rerank_scores[:, i]
+        if self.top_n_ranks is not None:
+            columns["top-n"] = pd.arrays.IntegerArray(self.top_n_ranks, self.top_n_ranks == 0)
+        if self.ai_recommendations is not None:
+            columns["ai-recommendation"] = self.ai_recommendations
+            columns["ai-rationale"] = self.ai_rationales
+        return pd.DataFrame(columns)
@@ -0,0 +1,143 @@
+'''
+Columnar per-row analytics for mapeval runs.
+
+RowAnalyticsWriter streams one record per evaluated row (rank of the correct match, its match type,
+the top candidate's match type and the sorted candidate scores) to a file per run, chunk by chunk:
+- Parquet (.parquet) when pyarrow is installed: one row group per chunk, nothing kept in memory
+- NPZ (.npz) otherwise: chunks are kept as compact typed arrays and written on close
+
+Scores are stored as float32 columns score_01 ... score_NN (NaN when a row has fewer candidates).
+
+Usage:
+from row_analytics import RowAnalyticsWriter, load_row_analytics, scores_matrix
+
+with RowAnalyticsWriter("./output/analytics/mapeval01", max_candidates=5) as writer:
+    writer.append(rows)   # list of dicts with the ROW_COLUMNS keys and a "scores" list
+df = load_row_analytics("./output/analytics/mapeval01.parquet")
+scores = scores_matrix(df)   # (rows, max_candidates) float32 array
+'''
+
+import os
+
+import numpy as np
+import pandas as pd
+
+# Column -> dtype; correct_rank is 1-based (0: correct map not among the candidates or not evaluated)
+ROW_COLUMNS = {
+    "row_num": np.int64,
+    "status": object,  # matched, unmatched, excluded, new, not_evaluated
+    "correct_rank": np.int16,
+    "correct_match_type": object,
+    "top_match_type": object,
+    "num_candidates": np.int16,
+}
+
+
+def has_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def score_columns(max_candidates):
+    return [f"score_{i+1:02d}" for i in range(max_candidates)]
+
+
+def parquet_schema(max_candidates):
+    """Arrow schema of the analytics file, so that a chunk of all-None match types isn't inferred as null."""
+    import pyarrow as pa
+    fields = [(name, pa.string() if dtype is object else pa.from_numpy_dtype(dtype)) for name, dtype in ROW_COLUMNS.items()]
+    return pa.schema(fields + [(name, pa.float32()) for name in score_columns(max_candidates)])
+
+
+class RowAnalyticsWriter:
+    """Streams per-row analytics of one run to a Parquet or NPZ file."""
+
+    def __init__(self, path, max_candidates, file_format="auto"):
+        """
+        Args:
+            path: Output file, with or without the .parquet / .npz extension
+            max_candidates: Number of score columns (the $match limit)
+            file_format: parquet, npz or auto (parquet if pyarrow is installed)
+        """
+        if file_format == "auto":
+            file_format = "parquet" if has_pyarrow() else "npz"
+        root, extension = os.path.splitext(path)
+        self.path = f"{root if extension in ('.parquet', '.npz') else path}.{file_format}"
+        self.file_format = file_format
+        self.max_candidates = max_candidates
+        self.num_rows = 0
+        self.parquet_writer = None
+        self.chunks = []
+        self.closed = False
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _frame(self, rows):
+        columns = {name: np.array([row[name] for row in rows], dtype=dtype) for name, dtype in ROW_COLUMNS.items()}
+        scores = np.full((len(rows), self.max_candidates), np.nan, dtype=np.float32)
+        for i, row in enumerate(rows):
+            row_scores = row["scores"][:self.max_candidates]
+            scores[i, :len(row_scores)] = row_scores
+        for i, name in enumerate(score_columns(self.max_candidates)):
+            columns[name] = scores[:, i]
+        return pd.DataFrame(columns)
+
+    def append(self, rows):
+        """Write the analytics of a chunk of rows."""
+        if not rows:
+            return
+        frame = self._frame(rows)
+        self.num_rows += len(frame)
+        if self.file_format == "parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            schema = parquet_schema(self.max_candidates)
+            if self.parquet_writer is None:
+                self.parquet_writer = pq.ParquetWriter(self.path, schema)
+            self.parquet_writer.write_table(pa.Table.from_pandas(frame, schema=schema, preserve_index=False))
+        else:
+            self.chunks.append(frame)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.file_format == "parquet":
+            if self.parquet_writer is None:
+                # No rows: still write the (empty) file the run results point to
+                import pyarrow.parquet as pq
+                self.parquet_writer = pq.ParquetWriter(self.path, parquet_schema(self.max_candidates))
+            self.parquet_writer.close()
+            self.parquet_writer = None
+            return
+        frame = pd.concat(self.chunks, ignore_index=True) if self.chunks else self._frame([])
+        arrays = {name: frame[name].to_numpy() for name in frame.columns}
+        for name, dtype in ROW_COLUMNS.items():
+            if dtype is object:
+                arrays[name] = arrays[name].astype(str)
+        np.savez_compressed(self.path, **arrays)
+        self.chunks = []
+
+
+def load_row_analytics(path, columns=None):
+    """Load the per-row analytics of a run (Parquet or NPZ) as a DataFrame."""
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path, columns=columns)
+    with np.load(path, allow_pickle=False) as data:
+        names = columns or list(data.files)
+        return pd.DataFrame({name: data[name] for name in names})
+
+
+def scores_matrix(df):
+    """Candidate scores of every row as a (rows, max_candidates) float32 array."""
+    return df[[column for column in df.columns if column.startswith("score_")]].to_numpy(dtype=np.float32)
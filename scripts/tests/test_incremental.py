@@ -0,0 +1,98 @@
+'''
+Incremental re-matching (match.py --baseline) against an in-process stub $match server.
+
+Run from scripts/: python -m pytest -q tests
+'''
+
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from match import match  # noqa: E402
+from ocl_mapping import HASH_COLUMN, Baseline, change_report, llm_failed  # noqa: E402
+
+
+class FlakyMatchHandler(BaseHTTPRequestHandler):
+    """Answers $match with two candidates per row; the first `failures` requests get a 500."""
+
+    failures = 0
+    requests = 0
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        FlakyMatchHandler.requests += 1
+        if FlakyMatchHandler.failures:
+            FlakyMatchHandler.failures -= 1
+            self.send_response(500)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        response = [{"row": row, "results": [
+            {"id": f"{row['name']}-{j}", "display_name": f"{row['name']} {j}",
+             "search_meta": {"search_score": 1.0 / (j + 1), "match_type": "low"}} for j in range(2)]}
+            for row in body["rows"]]
+        data = json.dumps(response).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def match_url():
+    FlakyMatchHandler.failures = 0
+    FlakyMatchHandler.requests = 0
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FlakyMatchHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/concepts/$match/"
+    server.shutdown()
+    server.server_close()
+
+
+def run_incremental(match_url, input_filename, output_filename):
+    output_df = match(api_match_url=match_url, input_filename=input_filename, target_repo="/orgs/A/sources/B/",
+                      max_chunk_size=10, top_n=2, baseline_filename=output_filename, baseline_key_column="id")
+    output_df.to_csv(output_filename, index=False)
+    return output_df
+
+
+def test_failed_chunk_is_matched_again(match_url, tmp_path):
+    input_filename = str(tmp_path / "input.csv")
+    output_filename = str(tmp_path / "output.csv")
+    pd.DataFrame({"id": range(1, 31), "name": [f"term {i}" for i in range(1, 31)]}).to_csv(input_filename, index=False)
+
+    # First run: the request of chunk 1 fails, so its 10 rows stay empty and get no match-hash
+    FlakyMatchHandler.failures = 1
+    first = run_incremental(match_url, input_filename, output_filename)
+    assert (first[HASH_COLUMN] == "").sum() == 10
+    assert first.loc[:9, "01_code"].eq("").all()
+
+    baseline = Baseline(output_filename, ["01_code", "01_name", "01_score", "02_code", "02_name", "02_score"], "id")
+    assert len(baseline) == 20 and baseline.num_failed == 10
+
+    # Second run: only the failed rows are sent to $match; the others are carried over
+    FlakyMatchHandler.requests = 0
+    second = run_incremental(match_url, input_filename, output_filename)
+    assert FlakyMatchHandler.requests == 1
+    assert (second[HASH_COLUMN] != "").all()
+    assert second["01_code"].tolist() == [f"term {i}-0" for i in range(1, 31)]
+    report = change_report(baseline, second[HASH_COLUMN].tolist(), [str(i) for i in range(1, 31)])
+    assert [(entry["status"], entry["key"]) for entry in report] == [("failed", str(i)) for i in range(1, 11)]
+
+
+def test_llm_failed():
+    assert llm_failed(None, "LLM evaluation error: timeout")
+    assert llm_failed(None, "Failed to parse LLM response")
+    assert not llm_failed(None, "None of the candidates is a match")
+    assert not llm_failed("123-4", "Best match")
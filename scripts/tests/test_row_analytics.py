@@ -0,0 +1,43 @@
+'''
+Per-row analytics files (row_analytics.py).
+
+Run from scripts/: python -m pytest -q tests
+'''
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from row_analytics import RowAnalyticsWriter, has_pyarrow, load_row_analytics, scores_matrix  # noqa: E402
+
+FORMATS = ["npz", pytest.param("parquet", marks=pytest.mark.skipif(not has_pyarrow(),
+                                                                  reason="pyarrow is not installed"))]
+
+
+def row(row_num, match_type, scores):
+    return {"row_num": row_num, "status": "matched", "correct_rank": 1, "correct_match_type": match_type,
+            "top_match_type": match_type, "num_candidates": len(scores), "scores": scores}
+
+
+@pytest.mark.parametrize("file_format", FORMATS)
+def test_chunk_of_missing_match_types_then_strings(file_format, tmp_path):
+    with RowAnalyticsWriter(str(tmp_path / "run"), max_candidates=3, file_format=file_format) as writer:
+        writer.append([row(1, None, [0.9]), row(2, None, [])])
+        writer.append([row(3, "very_high", [0.8, 0.5, 0.1])])
+    df = load_row_analytics(writer.path)
+    assert df["row_num"].tolist() == [1, 2, 3]
+    assert df["top_match_type"].tolist()[2] == "very_high"
+    np.testing.assert_array_equal(scores_matrix(df)[2], np.array([0.8, 0.5, 0.1], dtype=np.float32))
+
+
+@pytest.mark.parametrize("file_format", FORMATS)
+def test_run_without_rows_writes_an_empty_file(file_format, tmp_path):
+    with RowAnalyticsWriter(str(tmp_path / "run"), max_candidates=2, file_format=file_format) as writer:
+        pass
+    df = load_row_analytics(writer.path)
+    assert len(df) == 0
+    assert list(df.columns)[-2:] == ["score_01", "score_02"]
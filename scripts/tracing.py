@@ -0,0 +1,142 @@
+'''
+Lightweight stage tracing and profiling hooks for the match scripts.
+
+A Tracer records named timing spans (nested, per thread) and counters, prints a per-stage summary and
+exports a Chrome trace JSON file that can be opened in chrome://tracing or https://ui.perfetto.dev.
+A disabled tracer (the default) keeps span() and count() as near no-ops, so instrumented code runs
+unchanged when tracing is off.
+
+Usage:
+from tracing import Tracer, profiled
+
+tracer = Tracer(enabled=True)
+with tracer.span("request", chunk=1):
+    ...
+tracer.count("rows", 200)
+tracer.save("./output/match_trace.json")
+
+with profiled("cprofile", "./output/match.prof"):
+    ...
+'''
+
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+class Tracer:
+    """Collects timing spans and counters as Chrome trace events."""
+
+    def __init__(self, enabled=True, process_name="match"):
+        self.enabled = enabled
+        self.process_name = process_name
+        self.events = []
+        self.counters = defaultdict(float)
+        self.totals = defaultdict(lambda: [0, 0.0, 0.0])  # name -> [count, total seconds, max seconds]
+        self.origin = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def _now_us(self):
+        return (time.perf_counter() - self.origin) * 1e6
+
+    @contextmanager
+    def span(self, name, category="stage", **args):
+        """Time a block as a complete ('X') event; extra keyword arguments are stored as event args."""
+        if not self.enabled:
+            yield
+            return
+        start = self._now_us()
+        try:
+            yield
+        finally:
+            duration = self._now_us() - start
+            event = {"name": name, "cat": category, "ph": "X", "ts": round(start, 3), "dur": round(duration, 3),
+                     "pid": os.getpid(), "tid": threading.get_ident()}
+            if args:
+                event["args"] = args
+            with self.lock:
+                self.events.append(event)
+                totals = self.totals[name]
+                totals[0] += 1
+                totals[1] += duration / 1e6
+                totals[2] = max(totals[2], duration / 1e6)
+
+    def count(self, name, value=1):
+        """Add to a counter; its running total is recorded as a counter ('C') event."""
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] += value
+            self.events.append({"name": name, "ph": "C", "ts": round(self._now_us(), 3), "pid": os.getpid(),
+                                "args": {name: self.counters[name]}})
+
+    def summary(self):
+        """Per-span count, total, mean and max seconds, sorted by total time."""
+        return {
+            name: {"count": count, "total_sec": round(total, 4), "mean_sec": round(total / count, 4),
+                   "max_sec": round(maximum, 4)}
+            for name, (count, total, maximum) in sorted(self.totals.items(), key=lambda item: -item[1][1])
+        }
+
+    def print_summary(self):
+        print("\nTRACE:")
+        for name, stats in self.summary().items():
+            print(f"  {name}: {stats['total_sec']} sec total, {stats['count']}x, "
+                  f"{stats['mean_sec']} sec mean, {stats['max_sec']} sec max")
+        for name, value in self.counters.items():
+            print(f"  {name}: {int(value) if float(value).is_integer() else round(value, 4)}")
+
+    def save(self, filename):
+        """Write the events as a Chrome trace JSON file."""
+        metadata = [{"name": "process_name", "ph": "M", "pid": os.getpid(), "args": {"name": self.process_name}}]
+        with open(filename, 'w') as f:
+            json.dump({
+                "traceEvents": metadata + self.events,
+                "displayTimeUnit": "ms",
+                "otherData": {"counters": dict(self.counters), "summary": self.summary()},
+            }, f)
+
+
+@contextmanager
+def profiled(profiler="", output_filename=""):
+    """
+    Profile a block with cProfile or pyinstrument (profiler="cprofile" or "pyinstrument").
+
+    cProfile stats are dumped to output_filename (.prof, for snakeviz/pstats) and pyinstrument
+    writes an HTML report; without output_filename the top functions are printed.
+    """
+    if not profiler:
+        yield
+        return
+
+    if profiler == "pyinstrument":
+        # Lazy import to avoid requiring pyinstrument when not profiling with it
+        from pyinstrument import Profiler
+        profiler_instance = Profiler()
+        profiler_instance.start()
+        try:
+            yield
+        finally:
+            profiler_instance.stop()
+            if output_filename:
+                with open(output_filename, 'w') as f:
+                    f.write(profiler_instance.output_html())
+            else:
+                print(profiler_instance.output_text())
+        return
+
+    import cProfile
+    import pstats
+    profiler_instance = cProfile.Profile()
+    profiler_instance.enable()
+    try:
+        yield
+    finally:
+        profiler_instance.disable()
+        if output_filename:
+            profiler_instance.dump_stats(output_filename)
+        else:
+            pstats.Stats(profiler_instance).sort_stats("cumulative").print_stats(25)